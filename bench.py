@@ -0,0 +1,426 @@
+# bench.py
+"""Микробенчмарки горячих путей бота.
+
+Запуск: python bench.py <имя> [параметры], например: python bench.py db --users 200
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import config
+import db
+import money
+
+
+def _report(title: str, count: int, elapsed: float, unit: str = "handlers"):
+    print(f"{title:<32} {count:>7} {unit} за {elapsed:7.3f} с  -> {count / elapsed:10.1f} {unit}/с")
+
+
+# ========== db: обработчики до и после пула соединений ==========
+class _LegacyDB:
+    """Старые хелперы: новое соединение на каждый вызов, синхронно в event loop."""
+
+    def __init__(self, path: str):
+        self.path = path
+        conn = sqlite3.connect(path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                balance REAL DEFAULT 0,
+                total_bets INTEGER DEFAULT 0,
+                total_wins INTEGER DEFAULT 0,
+                registered_date TEXT
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def get_user(self, user_id: int):
+        conn = sqlite3.connect(self.path)
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        user = cur.fetchone()
+        if not user:
+            cur.execute("INSERT INTO users (user_id, balance, registered_date) VALUES (?, ?, ?)",
+                        (user_id, 0, datetime.now().isoformat()))
+            conn.commit()
+            cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+            user = cur.fetchone()
+        conn.close()
+        return user
+
+    def update_balance(self, user_id: int, amount: float):
+        conn = sqlite3.connect(self.path)
+        conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, user_id))
+        conn.commit()
+        conn.close()
+
+    def update_stats(self, user_id: int, win: bool):
+        conn = sqlite3.connect(self.path)
+        cur = conn.cursor()
+        cur.execute("UPDATE users SET total_bets = total_bets + 1 WHERE user_id = ?", (user_id,))
+        if win:
+            cur.execute("UPDATE users SET total_wins = total_wins + 1 WHERE user_id = ?", (user_id,))
+        conn.commit()
+        conn.close()
+
+
+async def _simulate_users(handler, users: int, rounds: int, latency: float):
+    async def player(user_id: int):
+        for i in range(rounds):
+            await handler(user_id, i, latency)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(player(uid) for uid in range(1, users + 1)))
+    return time.perf_counter() - start
+
+
+async def _legacy_handler(legacy: _LegacyDB, user_id: int, i: int, latency: float):
+    legacy.get_user(user_id)
+    legacy.update_balance(user_id, -1)
+    await asyncio.sleep(latency)  # имитация похода в Telegram
+    legacy.update_balance(user_id, 1.7)
+    legacy.update_stats(user_id, i % 2 == 0)
+
+
+async def _pooled_handler(user_id: int, i: int, latency: float):
+    await db.get_user(user_id)
+    await db.update_balance(user_id, -money.MICRO, 'bet')
+    await asyncio.sleep(latency)
+    await db.update_balance(user_id, money.multiply(money.MICRO, 1.7), 'payout')
+    await db.update_stats(user_id, i % 2 == 0)
+
+
+async def bench_db(args):
+    total = args.users * args.rounds
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = _LegacyDB(os.path.join(tmp, "legacy.db"))
+        elapsed = await _simulate_users(
+            lambda uid, i, lat: _legacy_handler(legacy, uid, i, lat),
+            args.users, args.rounds, args.latency
+        )
+        _report("per-call sqlite3.connect", total, elapsed)
+
+        await db.init_db(os.path.join(tmp, "pooled.db"))
+        try:
+            elapsed = await _simulate_users(_pooled_handler, args.users, args.rounds, args.latency)
+            _report("persistent WAL + db thread", total, elapsed)
+        finally:
+            await db.close_db()
+
+
+# ========== groupcommit: коммит на вызов против группового коммита ==========
+async def _run_bets(users: int, bets: int, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one_bet(i: int):
+        async with sem:
+            user_id = i % users + 1
+            bet_id = await db.reserve_bet(user_id, 'dice_over', money.MICRO, 1.7)
+            await db.settle_bet(bet_id, i % 2 == 0, money.multiply(money.MICRO, 1.7) if i % 2 == 0 else 0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_bet(i) for i in range(bets)))
+    return time.perf_counter() - start
+
+
+async def bench_groupcommit(args):
+    config.DB_SYNCHRONOUS = args.sync
+    config.DB_GROUP_COMMIT_MS = args.delay_ms
+    config.DB_GROUP_COMMIT_MAX_OPS = args.max_ops
+    for title, group_commit in (("commit per call", False), ("group commit", True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            await db.init_db(os.path.join(tmp, "bench.db"), group_commit=group_commit)
+            try:
+                for uid in range(1, args.users + 1):
+                    await db.get_user(uid)
+                    await db.update_balance(uid, args.bets * money.MICRO, 'admin')
+                elapsed = await _run_bets(args.users, args.bets, args.concurrency)
+                _report(f"{title} (sync={args.sync})", args.bets, elapsed, "bets")
+            finally:
+                await db.close_db()
+
+
+# ========== webhook: генератор нагрузки для режима RUN_MODE = 'webhook' ==========
+def _fake_update(update_id: int, user_id: int) -> dict:
+    # Текст без команды и без состояния FSM: проходит маршрутизацию, FSM и фильтры,
+    # но не вызывает Bot API, так что меряется пропускная способность самого конвейера
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+            "text": "ping",
+        },
+    }
+
+
+async def bench_webhook(args):
+    import aiohttp
+
+    url = args.url.rstrip("/")
+    headers = {"X-Telegram-Bot-Api-Secret-Token": config.WEBHOOK_SECRET} if config.WEBHOOK_SECRET else {}
+    sem = asyncio.Semaphore(args.concurrency)
+    statuses = {}
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{url}/stats") as response:
+            before = await response.json()
+
+        async def post(i: int):
+            async with sem:
+                update = _fake_update(i + 1, i % args.users + 1)
+                async with session.post(url + config.WEBHOOK_PATH, json=update, headers=headers) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(args.updates)))
+        ingest = time.perf_counter() - start
+        _report("фронт принял", args.updates, ingest, "updates")
+
+        target = sum(before["processed"]) + statuses.get(200, 0)
+        while True:
+            async with session.get(f"{url}/stats") as response:
+                stats = await response.json()
+            if sum(stats["processed"]) >= target or time.perf_counter() - start > args.timeout:
+                break
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        done = sum(stats["processed"]) - sum(before["processed"])
+        _report(f"воркеры обработали ({len(stats['processed'])} шт.)", done, elapsed, "updates")
+        print(f"HTTP-статусы: {statuses}; по воркерам: {[a - b for a, b in zip(stats['processed'], before['processed'])]}")
+
+
+# ========== keyboards: сборка клавиатур на каждый ответ против готовых ==========
+def _legacy_keyboards():
+    # Как было до кэширования: главное меню и меню костей собираются заново
+    from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🎮 ИГРАТЬ", callback_data="play_menu")
+    builder.button(text="💰 ПОПОЛНИТЬ", callback_data="deposit")
+    builder.button(text="💸 ВЫВОД", callback_data="withdraw")
+    builder.button(text="👤 ПРОФИЛЬ", callback_data="profile")
+    builder.button(text="🆘 ПОДДЕРЖКА", url=f"https://t.me/{config.SUPPORT_USERNAME}")
+    builder.adjust(2, 2, 1)
+    main_markup = builder.as_markup()
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔴 Больше 3.5 (x1.7)", callback_data="dice_over")
+    builder.button(text="🔵 Меньше 3.5 (x1.7)", callback_data="dice_under")
+    builder.button(text="🟢 Четное (x1.7)", callback_data="dice_even")
+    builder.button(text="🟡 Нечетное (x1.7)", callback_data="dice_odd")
+    builder.button(text="⚔️ Дуэль (x1.7)", callback_data="dice_duel")
+    builder.button(text="🔙 Назад", callback_data="play_menu")
+    builder.adjust(2, 2, 2, 1)
+    return main_markup, builder.as_markup()
+
+
+def _measure_keyboards(title: str, fn, count: int):
+    tracemalloc.start()
+    fn()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    peak = 0
+    for _ in range(200):
+        fn()
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.reset_peak()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    elapsed = time.perf_counter() - start
+    _report(title, count, elapsed, "updates")
+    print(f"{'':<32} {elapsed / count * 1e6:7.1f} мкс и до {peak / 1024:6.1f} КБ временной памяти на апдейт")
+
+
+async def bench_keyboards(args):
+    import main as bot_main
+
+    _measure_keyboards("сборка на каждый ответ", _legacy_keyboards, args.updates)
+    _measure_keyboards("готовые клавиатуры", lambda: (bot_main.MAIN_KEYBOARD, bot_main.DICE_TYPE_KEYBOARD), args.updates)
+
+
+# ========== cryptobot: голый AioCryptoPay против CryptoBotClient на медленном API ==========
+async def _measure_cryptobot(title: str, call, calls: int, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+    durations = []
+    outcomes = {}
+
+    async def one():
+        async with sem:
+            started = time.perf_counter()
+            try:
+                await call()
+                outcome = "ok"
+            except Exception as e:
+                outcome = type(e).__name__
+            durations.append(time.perf_counter() - started)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    _report(title, calls, time.perf_counter() - start, "calls")
+    durations.sort()
+    print(f"{'':<32} p50 {durations[len(durations) // 2]:6.2f} с, max {durations[-1]:6.2f} с; {outcomes}")
+
+
+async def bench_cryptobot(args):
+    from aiocryptopay import AioCryptoPay
+    from aiohttp import web
+
+    from cryptobot import CryptoBotClient
+    from fake_cryptobot import FakeCryptoBot
+
+    config.CRYPTOBOT_TIMEOUT = args.timeout
+    fake = FakeCryptoBot(config.API_CRYPTOBOT, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    runner = web.AppRunner(fake.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+    try:
+        raw = AioCryptoPay(token=config.API_CRYPTOBOT, network=url)
+        await _measure_cryptobot("AioCryptoPay без защиты", lambda: raw.get_invoices(count=10),
+                                 args.calls, args.concurrency)
+        await raw.close()
+        client = CryptoBotClient(network=url)
+        await _measure_cryptobot("CryptoBotClient", lambda: client.get_invoices(count=10),
+                                 args.calls, args.concurrency)
+        stats = client.stats()
+        print(f"{'':<32} автомат {stats['breaker']}, срабатываний {stats['trips']}, отклонено {stats['rejected']}")
+        await client.close()
+    finally:
+        await runner.cleanup()
+
+
+# ========== metrics: цена инструментирования горячих путей ==========
+async def _per_call(fn, calls: int) -> float:
+    """Среднее время await fn(), мкс."""
+    for _ in range(min(calls, 100)):
+        await fn()
+    start = time.perf_counter()
+    for _ in range(calls):
+        await fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+async def _compare(title: str, bare, instrumented, calls: int):
+    """Без метрик и с ними: поочерёдно, лучший из трёх прогонов, иначе разница тонет в шуме."""
+    timings = ([], [])
+    for _ in range(3):
+        for timing, fn in zip(timings, (bare, instrumented)):
+            timing.append(await _per_call(fn, calls))
+    bare, instrumented = min(timings[0]), min(timings[1])
+    print(f"{title:<32} {bare:8.2f} мкс -> {instrumented:8.2f} мкс  "
+          f"({instrumented - bare:+6.2f} мкс, {(instrumented / bare - 1) * 100:+5.1f}%)")
+
+
+async def bench_metrics(args):
+    from aiogram import Bot, Dispatcher
+    from aiogram.types import Update
+
+    import metrics
+    from bot_metrics import HandlerMetricsMiddleware
+
+    histogram = metrics.Histogram("bench_seconds", "", ("label",), registry=metrics.Registry())
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        histogram.observe(0.003, "label")
+    print(f"{'Histogram.observe':<32} {(time.perf_counter() - start) / args.calls * 1e9:8.0f} нс")
+
+    # Хелперы db.py: __wrapped__ — та же функция без замера
+    with tempfile.TemporaryDirectory() as tmp:
+        await db.init_db(os.path.join(tmp, "bench.db"), group_commit=False)
+        try:
+            await db.get_user(1)
+            await _compare("db.get_user (из кэша)", lambda: db.get_user.__wrapped__(1), lambda: db.get_user(1),
+                           args.calls)
+            await _compare("db.update_balance", lambda: db.update_balance.__wrapped__(1, 1, 'admin'),
+                           lambda: db.update_balance(1, 1, 'admin'), max(args.calls // 20, 1))
+        finally:
+            await db.close_db()
+
+    # Полный путь апдейта через Dispatcher до пустого хендлера
+    bot = Bot(token="42:BENCH")
+    update = Update.model_validate(_fake_update(1, 1))
+    dispatchers = []
+    for instrumented in (False, True):
+        dp = Dispatcher()
+
+        @dp.message()
+        async def noop(message):
+            pass
+
+        if instrumented:
+            dp.message.middleware(HandlerMetricsMiddleware())
+        dispatchers.append(dp)
+    bare, instrumented = dispatchers
+    await _compare("апдейт через Dispatcher", lambda: bare.feed_update(bot, update),
+                   lambda: instrumented.feed_update(bot, update), args.calls // 10)
+    await bot.session.close()
+
+    start = time.perf_counter()
+    text = await metrics.REGISTRY.render()
+    print(f"{'опрос /metrics':<32} {(time.perf_counter() - start) * 1000:8.2f} мс на "
+          f"{len(text.splitlines())} строк ({len(text) / 1024:.1f} КБ)")
+
+
+# ========== ЗАПУСК ==========
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("db", help="пропускная способность обработчиков: старые хелперы против db.py")
+    p.add_argument("--users", type=int, default=200, help="одновременных игроков")
+    p.add_argument("--rounds", type=int, default=10, help="ставок на игрока")
+    p.add_argument("--latency", type=float, default=0.005, help="имитация задержки Telegram, с")
+    p.set_defaults(func=bench_db)
+
+    p = sub.add_parser("groupcommit", help="ставок/с: коммит на каждую запись против группового коммита")
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--bets", type=int, default=5000)
+    p.add_argument("--concurrency", type=int, default=500, help="одновременных ставок")
+    p.add_argument("--sync", default="FULL", choices=("OFF", "NORMAL", "FULL"), help="PRAGMA synchronous")
+    p.add_argument("--delay-ms", type=float, default=5, help="DB_GROUP_COMMIT_MS")
+    p.add_argument("--max-ops", type=int, default=256, help="DB_GROUP_COMMIT_MAX_OPS")
+    p.set_defaults(func=bench_groupcommit)
+
+    p = sub.add_parser("webhook", help="нагрузка на запущенный кластер (RUN_MODE = 'webhook')")
+    p.add_argument("--url", default=f"http://127.0.0.1:{config.WEBHOOK_PORT}", help="адрес фронта")
+    p.add_argument("--updates", type=int, default=20000)
+    p.add_argument("--users", type=int, default=5000, help="разных пользователей")
+    p.add_argument("--concurrency", type=int, default=200, help="одновременных HTTP-запросов")
+    p.add_argument("--timeout", type=float, default=120, help="сколько ждать обработки, с")
+    p.set_defaults(func=bench_webhook)
+
+    p = sub.add_parser("keyboards", help="время и память на клавиатуры: сборка на каждый ответ против готовых")
+    p.add_argument("--updates", type=int, default=5000)
+    p.set_defaults(func=bench_keyboards)
+
+    p = sub.add_parser("cryptobot", help="задержки getInvoices на медленном и сбоящем fake_cryptobot")
+    p.add_argument("--calls", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=20)
+    p.add_argument("--latency", type=float, default=3, help="задержка ответов имитации, с")
+    p.add_argument("--jitter", type=float, default=0)
+    p.add_argument("--error-rate", type=float, default=0, help="доля ответов 500")
+    p.add_argument("--timeout", type=float, default=1, help="CRYPTOBOT_TIMEOUT, с")
+    p.set_defaults(func=bench_cryptobot)
+
+    p = sub.add_parser("metrics", help="накладные расходы метрик: хелперы db.py, хендлер, опрос /metrics")
+    p.add_argument("--calls", type=int, default=100000)
+    p.set_defaults(func=bench_metrics)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# bot_metrics.py
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from metrics import Counter, Histogram
+
+HANDLER_SECONDS = Histogram("casino_handler_seconds", "Время работы хендлера", ("handler",))
+HANDLER_ERRORS = Counter("casino_handler_errors_total", "Исключения в хендлерах", ("handler", "error"))
+API_SECONDS = Histogram("casino_telegram_request_seconds", "Запросы к Bot API", ("method",))
+API_ERRORS = Counter("casino_telegram_errors_total", "Ошибки запросов к Bot API", ("method", "error"))
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время и исключения каждого хендлера; метка — имя функции хендлера.
+
+    Inner-middleware: вызывается только для апдейтов, нашедших хендлер, и уже
+    после антифлуда, так что отброшенные апдейты сюда не попадают.
+    """
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.since(started, name)
+
+
+class BotApiMetricsMiddleware(BaseRequestMiddleware):
+    """Время и ошибки каждого вызова Bot API (sendMessage, sendDice, getChatMember...)."""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.since(started, name)
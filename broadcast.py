@@ -0,0 +1,256 @@
+# broadcast.py
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+
+import config
+import db
+from ratelimit import KeyedTokenBuckets, TokenBucket
+
+STATUS_LABELS = {
+    'running': "идёт",
+    'paused': "на паузе",
+    'done': "завершена",
+}
+
+
+def format_progress(job_id: int, status: str, total: int, sent: int, failed: int, blocked: int,
+                    unknown: int, speed: float = None) -> str:
+    text = (
+        f"📢 <b>Рассылка #{job_id}</b>: {STATUS_LABELS.get(status, status)}\n"
+        f"Обработано: {sent + failed + blocked + unknown} / {total}\n"
+        f"Успешно: {sent}\n"
+        f"Не удалось: {failed}\n"
+        f"Заблокировали бота: {blocked}"
+    )
+    if unknown:
+        text += f"\nПрервано перезапуском: {unknown}"
+    if speed is not None:
+        text += f"\nСкорость: {speed:.1f} сообщ./с"
+    return text
+
+def progress_from_row(row) -> str:
+    job_id, _, status, _, _, total, sent, failed, blocked, unknown, _, _ = row
+    return format_progress(job_id, status, total, sent, failed, blocked, unknown)
+
+
+class Broadcast:
+    """Одна рассылка, сохранённая в SQLite: пул воркеров, пауза и продолжение, прогресс.
+
+    Перед отправкой получатель помечается 'sending', после — итоговым статусом.
+    После перезапуска 'pending' отправляются заново, а 'sending' считаются
+    'unknown' и не повторяются: лучше недоставка, чем дубль.
+    """
+
+    def __init__(self, engine: "BroadcastEngine", row):
+        self.engine = engine
+        (self.job_id, self.text, self.status, self.admin_chat_id, self.status_message_id,
+         self.total, self.sent, self.failed, self.blocked, self.unknown, _, _) = row
+        self.started_at = time.monotonic()
+        self.started_processed = self.processed
+        self.finished_at = None
+        self.task: asyncio.Task | None = None
+        self._resume = asyncio.Event()
+        if self.status == 'running':
+            self._resume.set()
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed + self.blocked + self.unknown
+
+    @property
+    def finished(self) -> bool:
+        return self.status == 'done'
+
+    def apply_status(self, status: str):
+        """Применяет статус running/paused, выставленный в базе (возможно, другим процессом)."""
+        if status not in ('running', 'paused') or self.finished:
+            return
+        self.status = status
+        if status == 'running':
+            self._resume.set()
+        else:
+            self._resume.clear()
+
+    def progress_text(self) -> str:
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        done_now = self.processed - self.started_processed
+        speed = done_now / elapsed if elapsed > 0 else 0.0
+        return format_progress(self.job_id, self.status, self.total, self.sent, self.failed,
+                               self.blocked, self.unknown, speed)
+
+    async def run(self):
+        queue = asyncio.Queue(maxsize=config.BROADCAST_WORKERS * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(config.BROADCAST_WORKERS)]
+        reporter = asyncio.create_task(self._report_loop())
+        try:
+            # Сначала получатели, взятые до перезапуска, но ещё не отправленные
+            for user_id in await db.get_pending_recipients(self.job_id):
+                await queue.put(user_id)
+            while True:
+                chunk = await db.claim_broadcast_chunk(self.job_id, config.BROADCAST_CHUNK)
+                if not chunk:
+                    break
+                for user_id in chunk:
+                    await queue.put(user_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            self.status = 'done'
+            await db.set_broadcast_status(self.job_id, None, 'done')
+        except asyncio.CancelledError:
+            # Остановка бота: статус в базе не трогаем, задание продолжится при старте
+            for worker in workers:
+                worker.cancel()
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+            reporter.cancel()
+        await self.engine.report(self)
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(config.BROADCAST_PROGRESS_INTERVAL)
+            await self.engine.report(self)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            await self._resume.wait()
+            if not await db.mark_recipient_sending(self.job_id, user_id):
+                continue
+            result = await self._send(user_id)
+            await db.finish_recipient(self.job_id, user_id, result)
+            if result == 'sent':
+                self.sent += 1
+            elif result == 'blocked':
+                self.blocked += 1
+            else:
+                self.failed += 1
+
+    async def _send(self, chat_id: int) -> str:
+        for attempt in range(config.BROADCAST_MAX_RETRIES + 1):
+            await self._resume.wait()
+            await self.engine.global_bucket.acquire()
+            await self.engine.chat_buckets.acquire(chat_id)
+            try:
+                await self.engine.bot.send_message(chat_id, self.text)
+                return 'sent'
+            except TelegramRetryAfter as e:
+                # Флуд-лимит общий для бота: притормаживаем сразу всех воркеров
+                self.engine.global_bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return 'blocked'
+            except TelegramNetworkError:
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                print(f"Ошибка отправки пользователю {chat_id}: {e}")
+                return 'failed'
+        return 'failed'
+
+
+class BroadcastEngine:
+    """Выполняет рассылки в фоне с общим лимитом Telegram на все рассылки бота.
+
+    Создать рассылку или поставить её на паузу может любой процесс — это запись
+    в базе. Выполняет их только активный движок (процесс-лидер): он подхватывает
+    новые и осиротевшие задания и применяет паузы при очередном просмотре базы.
+    on_progress(job) вызывается периодически и по завершении рассылки.
+    """
+
+    def __init__(self, bot: Bot, on_progress=None):
+        self.bot = bot
+        self.on_progress = on_progress
+        self.global_bucket = TokenBucket(config.BROADCAST_RATE)
+        self.chat_buckets = KeyedTokenBuckets(config.BROADCAST_PER_CHAT_RATE, 1)
+        self.jobs = {}
+        # Номера, для которых _launch ещё ждёт базу: второй запуск того же задания не нужен
+        self._launching = set()
+        self.active = False
+        self._watch_task: asyncio.Task | None = None
+
+    async def _launch(self, job_id: int) -> Broadcast | None:
+        """Запускает задание; None — оно уже запущено, запускается или движок остановлен."""
+        if job_id in self.jobs or job_id in self._launching:
+            return None
+        self._launching.add(job_id)
+        try:
+            # Отправки 'sending' могли остаться только от упавшего прежнего исполнителя
+            row = await db.recover_broadcast(job_id)
+        finally:
+            self._launching.discard(job_id)
+        if not self.active:
+            return None
+        job = Broadcast(self, row)
+        job.task = asyncio.create_task(job.run())
+        job.task.add_done_callback(lambda _: self.jobs.pop(job.job_id, None))
+        self.jobs[job.job_id] = job
+        return job
+
+    async def start(self, text: str, admin_chat_id: int = None, status_message_id: int = None) -> int:
+        """Создаёт рассылку; возвращает её номер."""
+        row = await db.create_broadcast(text, admin_chat_id, status_message_id)
+        if self.active:
+            await self._launch(row[0])
+        return row[0]
+
+    async def set_status(self, job_id: int, old_status: str, status: str) -> bool:
+        if not await db.set_broadcast_status(job_id, old_status, status):
+            return False
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.apply_status(status)
+        return True
+
+    async def pause(self, job_id: int) -> bool:
+        return await self.set_status(job_id, 'running', 'paused')
+
+    async def resume(self, job_id: int) -> bool:
+        return await self.set_status(job_id, 'paused', 'running')
+
+    async def activate(self) -> int:
+        """Делает движок исполнителем: поднимает незавершённые рассылки и следит за новыми."""
+        self.active = True
+        launched = await self._sync()
+        self._watch_task = asyncio.create_task(self._watch())
+        return launched
+
+    async def _sync(self) -> int:
+        launched = 0
+        for row in await db.get_unfinished_broadcasts():
+            job = self.jobs.get(row[0])
+            if job is not None:
+                job.apply_status(row[2])
+            elif await self._launch(row[0]) is not None:
+                launched += 1
+        return launched
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(config.BROADCAST_WATCH_INTERVAL)
+            try:
+                await self._sync()
+            except Exception as e:
+                print(f"Ошибка синхронизации рассылок: {e}")
+
+    async def stop(self):
+        self.active = False
+        tasks = [job.task for job in self.jobs.values() if job.task and not job.task.done()]
+        if self._watch_task is not None:
+            tasks.append(self._watch_task)
+            self._watch_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def report(self, job: Broadcast):
+        if self.on_progress is None:
+            return
+        try:
+            await self.on_progress(job)
+        except Exception as e:
+            print(f"Ошибка обновления прогресса рассылки: {e}")
@@ -0,0 +1,261 @@
+# cluster.py
+"""Режим вебхука с несколькими процессами-воркерами на одном хосте.
+
+Фронт-процесс принимает апдейты Telegram по HTTP и раскладывает их по воркерам
+по user_id, так что апдейты одного пользователя всегда обрабатывает один
+воркер и в порядке поступления. Фоновые задачи (сверка инвойсов, рассылки и
+т. п.) выполняет единственный лидер, выбранный арендой в SQLite.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import time
+
+from aiogram import Bot
+from aiohttp import web
+
+import config
+import db
+import metrics
+
+# Поля апдейта, из которых берётся пользователь для маршрутизации
+EVENT_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "pre_checkout_query", "shipping_query", "chat_member", "my_chat_member", "chat_join_request",
+    "poll_answer", "message_reaction", "business_message", "channel_post", "edited_channel_post",
+)
+
+
+def route_key(update: dict) -> int:
+    """Ключ маршрутизации: id пользователя, иначе id чата, иначе update_id."""
+    for field in EVENT_FIELDS:
+        event = update.get(field)
+        if not event:
+            continue
+        if field == "chat_member":
+            # Меняет статус не всегда сам участник: ключ — тот, чья подписка изменилась
+            return event["new_chat_member"]["user"]["id"]
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return update.get("update_id", 0)
+
+
+# ========== ВЫБОР ЛИДЕРА ==========
+class LeaderElection:
+    """Держит аренду name в SQLite и запускает/останавливает фоновые задачи лидера."""
+
+    def __init__(self, name: str, on_elected, on_lost, ttl: float = None):
+        self.name = name
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.ttl = ttl or config.LEADER_LEASE_TTL
+        self.is_leader = False
+
+    async def run(self):
+        while True:
+            try:
+                acquired = await db.acquire_lease(self.name, self.owner, self.ttl)
+            except Exception as e:
+                print(f"Ошибка продления аренды {self.name}: {e}")
+                acquired = False
+            if acquired and not self.is_leader:
+                self.is_leader = True
+                print(f"{self.owner} стал лидером ({self.name})")
+                try:
+                    await self.on_elected()
+                except Exception as e:
+                    # Часть задач могла успеть запуститься: останавливаем их и отдаём аренду
+                    print(f"Ошибка запуска задач лидера ({self.name}): {e}")
+                    try:
+                        await self.release()
+                    except Exception as e:
+                        print(f"Ошибка остановки задач лидера ({self.name}): {e}")
+            elif not acquired and self.is_leader:
+                self.is_leader = False
+                print(f"{self.owner} потерял лидерство ({self.name})")
+                await self.on_lost()
+            await asyncio.sleep(self.ttl / 3)
+
+    async def release(self):
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await self.on_lost()
+            finally:
+                await db.release_lease(self.name, self.owner)
+
+
+# ========== ВОРКЕР ==========
+async def consume(updates, handle, processed=None, index: int = 0):
+    """Читает (key, raw) из очереди воркера и обрабатывает апдейты.
+
+    Апдейты одного ключа обрабатываются строго по очереди (FIFO-замок на ключ),
+    разных — параллельно. None в очереди — сигнал остановки.
+    """
+    loop = asyncio.get_running_loop()
+    locks = {}
+    waiting = {}
+    tasks = set()
+
+    async def handle_ordered(key: int, raw: bytes):
+        lock = locks.setdefault(key, asyncio.Lock())
+        waiting[key] = waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                await handle(json.loads(raw))
+        except Exception as e:
+            print(f"Ошибка обработки апдейта: {e}")
+        finally:
+            waiting[key] -= 1
+            if not waiting[key]:
+                del waiting[key]
+                del locks[key]
+            if processed is not None:
+                processed[index] += 1
+
+    while True:
+        item = await loop.run_in_executor(None, updates.get)
+        if item is None:
+            break
+        task = asyncio.create_task(handle_ordered(*item))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+
+
+def _worker_entry(target, index: int, updates, processed):
+    # Ctrl+C получает вся группа процессов; воркер останавливает фронт через None в очереди
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    target(index, updates, processed)
+
+
+# ========== ФРОНТ ==========
+class Front:
+    def __init__(self, worker_target, allowed_updates):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.worker_target = worker_target
+        self.allowed_updates = allowed_updates
+        self.workers = config.WEBHOOK_WORKERS
+        self.queues = [self.ctx.Queue(maxsize=config.WEBHOOK_QUEUE_SIZE) for _ in range(self.workers)]
+        self.processed = self.ctx.Array("q", self.workers)
+        self.forwarded = [0] * self.workers
+        self.rejected = 0
+        self.procs = [None] * self.workers
+        self.started_at = time.monotonic()
+        # Свой /metrics у фронта: он не обрабатывает апдейты, зато видит очереди всех воркеров
+        self.registry = metrics.Registry()
+        metrics.Counter("casino_webhook_forwarded_total", "Апдейты, переданные воркеру", ("worker",),
+                        collect=lambda: dict(enumerate(self.forwarded)), registry=self.registry)
+        metrics.Counter("casino_webhook_processed_total", "Апдейты, обработанные воркером", ("worker",),
+                        collect=lambda: dict(enumerate(self.processed)), registry=self.registry)
+        metrics.Counter("casino_webhook_rejected_total", "Апдейты, отклонённые с 503 из-за полной очереди",
+                        collect=lambda: self.rejected, registry=self.registry)
+        metrics.Gauge("casino_webhook_queue_depth", "Апдейты в очереди воркера", ("worker",),
+                      collect=lambda: {index: q.qsize() for index, q in enumerate(self.queues)}, registry=self.registry)
+        metrics.Gauge("casino_webhook_worker_up", "Жив ли процесс воркера", ("worker",),
+                      collect=lambda: {index: int(proc is not None and proc.is_alive())
+                                       for index, proc in enumerate(self.procs)},
+                      registry=self.registry)
+
+    def _spawn(self, index: int):
+        proc = self.ctx.Process(
+            target=_worker_entry,
+            args=(self.worker_target, index, self.queues[index], self.processed),
+            name=f"worker-{index}",
+            daemon=True,
+        )
+        proc.start()
+        self.procs[index] = proc
+
+    async def handle_update(self, request: web.Request):
+        if config.WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != config.WEBHOOK_SECRET:
+            return web.Response(status=401)
+        raw = await request.read()
+        try:
+            key = route_key(json.loads(raw))
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+        index = key % self.workers
+        try:
+            self.queues[index].put_nowait((key, raw))
+        except queue.Full:
+            # Telegram повторит доставку позже
+            self.rejected += 1
+            return web.Response(status=503)
+        self.forwarded[index] += 1
+        return web.Response()
+
+    async def handle_stats(self, request: web.Request):
+        return web.json_response({
+            "uptime": time.monotonic() - self.started_at,
+            "forwarded": self.forwarded,
+            "processed": list(self.processed),
+            "rejected": self.rejected,
+            "alive": [proc.is_alive() for proc in self.procs],
+        })
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(5)
+            for index, proc in enumerate(self.procs):
+                if not proc.is_alive():
+                    print(f"Воркер {index} завершился (код {proc.exitcode}), перезапускаю")
+                    self._spawn(index)
+
+    async def run(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        app = web.Application()
+        app.router.add_post(config.WEBHOOK_PATH, self.handle_update)
+        app.router.add_get("/stats", self.handle_stats)
+        if config.METRICS_ENABLED:
+            app.router.add_get("/metrics", metrics.metrics_handler(self.registry))
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT).start()
+        if config.WEBHOOK_URL:
+            async with Bot(token=config.TOKEN) as bot:
+                await bot.set_webhook(
+                    url=config.WEBHOOK_URL + config.WEBHOOK_PATH,
+                    secret_token=config.WEBHOOK_SECRET or None,
+                    allowed_updates=self.allowed_updates,
+                    max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                )
+        print(f"Вебхук слушает :{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}, воркеров: {self.workers}")
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopping.set)
+        monitor = asyncio.create_task(self._monitor())
+        try:
+            await stopping.wait()
+        finally:
+            monitor.cancel()
+            await runner.cleanup()
+
+    def stop(self):
+        for q in self.queues:
+            q.put(None)
+        for proc in self.procs:
+            if proc is not None:
+                proc.join(timeout=10)
+                if proc.is_alive():
+                    proc.terminate()
+
+
+def serve(worker_target, allowed_updates):
+    """Запускает фронт и воркеры; worker_target(index, updates, processed) — точка входа воркера."""
+    front = Front(worker_target, allowed_updates)
+    try:
+        asyncio.run(front.run())
+    finally:
+        front.stop()
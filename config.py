@@ -12,10 +12,13 @@ SUPPORT_USERNAME = "Save1012"                     # Юзернейм подде
 BOT_USERNAME = "saveludobot"                    # Юзернейм вашего бота (без @)
 WIN_IMAGE_URL = "https://i.postimg.cc/9f0DYZ2h/win.jpg"
 LOSE_IMAGE_URL = "https://i.postimg.cc/WzLtVykq/lose.jpg"
+WIN_IMAGE_PATH = "images/win.jpg"      # Локальные копии картинок (если есть, загружаются вместо URL)
+LOSE_IMAGE_PATH = "images/lose.jpg"    # file_id после первой загрузки хранится в базе
 
 # --- ЛИМИТЫ СТАВОК ---
 MIN_BET = 0.2      # Минимальная ставка (0.20 USDT)
 MAX_BET = 500       # Максимальная ставка
+BET_RECOVER_AFTER = 900  # Ставка, не рассчитанная за столько секунд (падение, перезапуск), возвращается
 
 # --- КОЭФФИЦИЕНТЫ ИГР ---
 COEF = {
@@ -27,8 +30,114 @@ COEF = {
     'football_miss': 1.7,
     'basketball_goal': 1.2,
     'basketball_miss': 1.7,
+    'duel_over': 1.7,
+    'duel_under': 1.7,
 }
 
+# --- ИСХОДЫ ИГР ---
+OUTCOME_ENGINE = 'dice'                # 'dice' — send_dice в канале; 'fair' — локальный provably fair (/fair), без запросов к API
+AUTOBET_MAX_ROUNDS = 100               # Максимум раундов в одной автоставке (броски серии всегда локальные, см. fair.py)
+
 # --- НАСТРОЙКИ ПОПОЛНЕНИЯ ЧЕРЕЗ ЗВЁЗДЫ ---
 STARS_PER_CENT = 2                     # 1 цент = 2 звезды
-MIN_STARS_DEPOSIT_CENTS = 20 
\ No newline at end of file
+MIN_STARS_DEPOSIT_CENTS = 20 
+
+# --- БАЗА ДАННЫХ ---
+DB_PATH = 'casino.db'                  # Файл SQLite (WAL-режим, одно постоянное соединение)
+DB_SYNCHRONOUS = 'NORMAL'              # PRAGMA synchronous: NORMAL или FULL (fsync на каждый коммит)
+DB_GROUP_COMMIT = False                # Групповой коммит записей одной транзакцией
+DB_GROUP_COMMIT_MS = 5                 # Максимальное ожидание пачки, мс
+DB_GROUP_COMMIT_MAX_OPS = 256          # Максимальный размер пачки
+USER_CACHE_SIZE = 10000                # Пользователей в памяти процесса (LRU, write-through)
+USER_CACHE_TTL = 30                    # Сек; в режиме вебхука баланс для показа всё равно читается из базы
+
+# --- ЖУРНАЛ ОПЕРАЦИЙ ---
+LEDGER_SNAPSHOT_INTERVAL = 300         # Как часто сворачивать новые проводки в снимки балансов и сверять их, сек
+LEDGER_SNAPSHOT_BATCH = 10000          # Проводок в одной транзакции снимка
+LEDGER_RECENT = 10                     # Сколько последних операций показывать в /checkprofile
+
+# --- КЭШ ПОДПИСКИ НА КАНАЛ ---
+SUB_CACHE_POSITIVE_TTL = 300           # Сколько секунд доверять статусу «подписан»
+SUB_CACHE_NEGATIVE_TTL = 15            # Сколько секунд доверять статусу «не подписан»
+SUB_CACHE_SIZE = 50000                 # Максимум записей (LRU)
+
+# --- СИНХРОНИЗАЦИЯ ИНВОЙСОВ CRYPTOBOT ---
+INVOICE_TTL = 3600                     # Срок жизни инвойса в CryptoBot (expires_in), сек
+INVOICE_EXPIRY_GRACE = 600             # Запас сверх срока жизни перед локальной пометкой expired, сек
+INVOICE_SYNC_BATCH = 100               # Инвойсов в одном запросе getInvoices
+INVOICE_POLL_MIN = 5                   # Интервал опроса, когда есть свежие инвойсы, сек
+INVOICE_POLL_MAX = 60                  # Интервал опроса в простое, сек
+INVOICE_FRESH_WINDOW = 900             # Инвойс «свежий», если создан не раньше, сек
+
+# --- ВЕБХУК CRYPTOBOT ---
+CRYPTOBOT_API_URL = 'https://pay.crypt.bot'   # Для тестов: адрес fake_cryptobot.py
+CRYPTOBOT_WEBHOOK_ENABLED = False      # Принимать invoice_paid вебхуком вместо частого опроса
+CRYPTOBOT_WEBHOOK_HOST = '0.0.0.0'
+CRYPTOBOT_WEBHOOK_PORT = 8081
+CRYPTOBOT_WEBHOOK_PATH = '/cryptobot'  # Этот путь (за HTTPS-прокси) указывается в настройках приложения CryptoBot
+INVOICE_RECONCILE_INTERVAL = 600       # Сверка ожидающих инвойсов в режиме вебхука, сек
+
+# --- КЛИЕНТ CRYPTOBOT ---
+CRYPTOBOT_TIMEOUT = 10                 # Дедлайн одного запроса к Crypto Pay API, сек
+CRYPTOBOT_RETRIES = 2                  # Повторы чтений (getInvoices) при таймауте, сетевой ошибке и 5xx
+CRYPTOBOT_RETRY_BASE = 0.5             # Пауза перед первым повтором, дальше удваивается (с джиттером), сек
+CRYPTOBOT_BREAKER_THRESHOLD = 5        # Сбоев подряд, после которых запросы отклоняются сразу
+CRYPTOBOT_BREAKER_RESET = 30           # Через сколько секунд пропустить пробный запрос, сек
+
+# --- ВЫВОД СРЕДСТВ ---
+WITHDRAW_CONCURRENCY = 4               # Одновременных запросов createCheck
+WITHDRAW_BATCH = 20                    # Заявок, которые воркер забирает за раз
+WITHDRAW_POLL_INTERVAL = 5             # Проверка очереди без сигнала (заявка из другого процесса), сек
+
+# --- АНТИФЛУД ---
+THROTTLE_QUEUE_SIZE = 3                # Апдейтов одного пользователя в работе и в очереди; лишние отбрасываются
+THROTTLE_RATES = {                     # Класс действия: (апдейтов в секунду, запас) на пользователя
+    'bets': (1, 3),
+    'payments': (0.5, 3),
+    'admin': (5, 10),
+    'other': (3, 10),
+}
+THROTTLE_WARN_INTERVAL = 10            # Не чаще раза в столько секунд писать «слишком много запросов», сек
+
+# --- РАССЫЛКИ ---
+BROADCAST_WORKERS = 20                 # Одновременных отправок
+BROADCAST_RATE = 25                    # Общий лимит, сообщений в секунду (Telegram: ~30)
+BROADCAST_PER_CHAT_RATE = 1            # Лимит на один чат, сообщений в секунду
+BROADCAST_CHUNK = 1000                 # Сколько id пользователей читать из базы за раз
+BROADCAST_MAX_RETRIES = 3              # Повторы при RetryAfter и сетевых ошибках
+BROADCAST_PROGRESS_INTERVAL = 5        # Как часто обновлять сообщение с прогрессом, сек
+BROADCAST_WATCH_INTERVAL = 5           # Как часто лидер проверяет новые рассылки и паузы, сек
+
+# --- ХРАНИЛИЩЕ FSM ---
+FSM_STORAGE = 'sqlite'                 # 'sqlite' (в DB_PATH), 'redis' (нужен пакет redis) или 'memory'
+REDIS_URL = 'redis://localhost:6379/0' # Для FSM_STORAGE = 'redis'
+FSM_TTL = 86400                        # Брошенное состояние удаляется через столько секунд
+FSM_CACHE_SIZE = 10000                 # Записей FSM в памяти процесса (LRU)
+FSM_PURGE_INTERVAL = 600               # Как часто чистить просроченные состояния, сек
+
+# --- РЕЖИМ ЗАПУСКА ---
+RUN_MODE = 'polling'                   # 'polling' — один процесс; 'webhook' — фронт + WEBHOOK_WORKERS процессов
+WEBHOOK_URL = ''                       # Публичный HTTPS-адрес (без пути); пусто — вебхук не регистрируется
+WEBHOOK_PATH = '/telegram'
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = 8080
+WEBHOOK_SECRET = ''                    # X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_WORKERS = 4                    # Процессов-обработчиков (апдейты пользователя всегда в одном)
+WEBHOOK_QUEUE_SIZE = 10000             # Очередь апдейтов на воркер; при переполнении отвечаем 503
+WEBHOOK_MAX_CONNECTIONS = 100
+LEADER_LEASE_TTL = 15                  # Аренда лидера фоновых задач, сек
+
+# --- ПУБЛИКАЦИИ В КАНАЛ ---
+CHANNEL_QUEUE_SIZE = 1000              # Очередь постов в канал; при переполнении пост отбрасывается
+CHANNEL_RATE = 20                      # Сообщений в минуту на канал (лимит Telegram ~20)
+CHANNEL_BURST = 3                      # Сколько постов можно отправить подряд без паузы
+CHANNEL_MAX_RETRIES = 3                # Повторы поста после RetryAfter
+CHANNEL_DICE_TIMEOUT = 60              # Сколько секунд ставка ждёт кубики в очереди канала, потом возврат
+CHANNEL_DIGEST_THRESHOLD = 5           # С такой глубины очереди анонсы склеиваются в дайджест (0 — никогда)
+CHANNEL_DIGEST_MAX = 10                # Анонсов в одном дайджесте
+LATENCY_WINDOW = 1000                  # Сколько последних ставок учитывать в /latency
+
+# --- МЕТРИКИ ---
+METRICS_ENABLED = False                # HTTP GET /metrics в формате Prometheus
+METRICS_HOST = '127.0.0.1'             # Только локально: снаружи метрики отдаёт прокси или агент
+METRICS_PORT = 9100                    # В режиме вебхука воркер i слушает METRICS_PORT + i, фронт — /metrics на WEBHOOK_PORT
@@ -0,0 +1,158 @@
+# cryptobot.py
+import asyncio
+import random
+import time
+from collections import Counter
+
+import aiohttp
+from aiocryptopay import AioCryptoPay
+from aiocryptopay.exceptions.factory import CodeErrorFactory
+
+import config
+import metrics
+
+REQUEST_SECONDS = metrics.Histogram("casino_cryptobot_request_seconds", "Запросы к CryptoBot API (каждая попытка)", ("method",))
+REQUEST_ERRORS = metrics.Counter("casino_cryptobot_errors_total", "Ошибки запросов к CryptoBot API", ("method", "error"))
+
+
+class CircuitOpen(Exception):
+    """CryptoBot отвечает с ошибками — запрос отклонён без обращения к API."""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"CryptoBot временно недоступен, попробуйте через {retry_in:.0f} с")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """После threshold сбоев подряд пропускает запросы только раз в reset_after секунд.
+
+    Закрыт — запросы идут как обычно. Открыт — отклоняются сразу. Когда
+    reset_after истекает, один пробный запрос решает: закрыться или ждать дальше.
+    """
+
+    def __init__(self, threshold: int, reset_after: float):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.retry_in() == 0 else "open"
+
+    def retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(self.opened_at + self.reset_after - time.monotonic(), 0.0)
+
+    def check(self):
+        if self.opened_at is None:
+            return
+        wait = self.retry_in()
+        if wait > 0:
+            raise CircuitOpen(wait)
+        # Пробный запрос: остальные ждут его исхода ещё один интервал
+        self.opened_at = time.monotonic()
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+
+
+def is_transient(error: Exception) -> bool:
+    """Сбой, после которого запрос имеет смысл повторить (и который считается для автомата)."""
+    if isinstance(error, CodeErrorFactory):
+        # Ошибка API с кодом (CryptoPayAPIError): повторяем только перегрузку и сбои сервера
+        return (error.code or 0) >= 500 or error.code == 429
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError))
+
+
+def is_rejected(error: Exception) -> bool:
+    """API ответило отказом по существу (4xx, кроме 429): запрос точно не выполнен."""
+    return isinstance(error, CodeErrorFactory) and 400 <= (error.code or 0) < 500 and error.code != 429
+
+
+class CryptoBotClient:
+    """Обёртка над AioCryptoPay: дедлайн на каждый вызов, повторы чтений и автомат.
+
+    Сессия aiohttp одна на клиента и живёт до close(), соединения переиспользуются.
+    Повторяются только идемпотентные чтения (getInvoices) — с экспонентой и
+    джиттером; создание инвойса и чека не повторяется, чтобы не создать дубль.
+    По каждому методу копятся задержки и ошибки по типам (stats()).
+    """
+
+    def __init__(self, token: str = None, network: str = None, timeout: float = None, retries: int = None):
+        self.api = AioCryptoPay(token=token or config.API_CRYPTOBOT, network=network or config.CRYPTOBOT_API_URL)
+        self.timeout = timeout or config.CRYPTOBOT_TIMEOUT
+        self.retries = config.CRYPTOBOT_RETRIES if retries is None else retries
+        self.breaker = CircuitBreaker(config.CRYPTOBOT_BREAKER_THRESHOLD, config.CRYPTOBOT_BREAKER_RESET)
+        self.latency: dict[str, metrics.LatencyRecorder] = {}
+        self.errors: dict[str, Counter] = {}
+        self.rejected = 0
+
+    async def _call(self, method: str, fn, *, idempotent: bool = False, **kwargs):
+        latency = self.latency.setdefault(method, metrics.LatencyRecorder(config.LATENCY_WINDOW))
+        errors = self.errors.setdefault(method, Counter())
+        attempts = 1 + (self.retries if idempotent else 0)
+        for attempt in range(attempts):
+            try:
+                self.breaker.check()
+            except CircuitOpen:
+                self.rejected += 1
+                raise
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(fn(**kwargs), self.timeout)
+            except Exception as e:
+                elapsed = time.perf_counter() - started
+                latency.observe(elapsed)
+                REQUEST_SECONDS.observe(elapsed, method)
+                errors[type(e).__name__] += 1
+                REQUEST_ERRORS.inc(method, type(e).__name__)
+                if not is_transient(e):
+                    # Ответ по существу (неверные параметры и т.п.): API живо
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(config.CRYPTOBOT_RETRY_BASE * 2 ** attempt * random.uniform(0.5, 1.5))
+                continue
+            elapsed = time.perf_counter() - started
+            latency.observe(elapsed)
+            REQUEST_SECONDS.observe(elapsed, method)
+            self.breaker.success()
+            return result
+
+    async def create_invoice(self, **kwargs):
+        return await self._call("createInvoice", self.api.create_invoice, **kwargs)
+
+    async def get_invoices(self, **kwargs):
+        return await self._call("getInvoices", self.api.get_invoices, idempotent=True, **kwargs)
+
+    async def create_check(self, **kwargs):
+        return await self._call("createCheck", self.api.create_check, **kwargs)
+
+    async def close(self):
+        await self.api.close()
+
+    def stats(self) -> dict:
+        return {
+            "breaker": self.breaker.state,
+            "trips": self.breaker.trips,
+            "rejected": self.rejected,
+            "methods": {
+                method: {**recorder.stats(), "errors": dict(self.errors.get(method, {}))}
+                for method, recorder in self.latency.items()
+            },
+        }
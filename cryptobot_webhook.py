@@ -0,0 +1,52 @@
+# cryptobot_webhook.py
+import hashlib
+import hmac
+import json
+
+from aiohttp import web
+
+import config
+
+
+def sign_body(token: str, body: bytes) -> str:
+    """Подпись тела апдейта: HMAC-SHA256 с ключом SHA256(токена приложения)."""
+    secret = hashlib.sha256(token.encode()).digest()
+    return hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+def check_signature(token: str, body: bytes, signature: str) -> bool:
+    return hmac.compare_digest(sign_body(token, body), signature or "")
+
+def create_app(on_invoice_paid, token: str = None, path: str = None) -> web.Application:
+    """aiohttp-приложение, принимающее апдейты CryptoBot.
+
+    on_invoice_paid(invoice: dict) вызывается для каждого invoice_paid. Ошибка
+    внутри него даёт ответ 500, и CryptoBot повторит доставку.
+    """
+    token = token or config.API_CRYPTOBOT
+
+    async def handle(request: web.Request):
+        body = await request.read()
+        if not check_signature(token, body, request.headers.get("crypto-pay-api-signature")):
+            return web.Response(status=401)
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        if update.get("update_type") == "invoice_paid":
+            try:
+                await on_invoice_paid(update["payload"])
+            except Exception as e:
+                print(f"Ошибка обработки вебхука CryptoBot: {e}")
+                return web.Response(status=500)
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_post(path or config.CRYPTOBOT_WEBHOOK_PATH, handle)
+    return app
+
+async def start_webhook_server(on_invoice_paid, host: str = None, port: int = None) -> web.AppRunner:
+    runner = web.AppRunner(create_app(on_invoice_paid))
+    await runner.setup()
+    site = web.TCPSite(runner, host or config.CRYPTOBOT_WEBHOOK_HOST, port or config.CRYPTOBOT_WEBHOOK_PORT)
+    await site.start()
+    return runner
@@ -0,0 +1,1173 @@
+# db.py
+import asyncio
+import functools
+import inspect
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import config
+import metrics
+import money
+from cache import TTLCache
+
+# Одно долгоживущее соединение и один выделенный поток: SQLite всё равно
+# сериализует запись, а event loop больше не блокируется на fsync.
+_conn: sqlite3.Connection | None = None
+_executor: ThreadPoolExecutor | None = None
+
+# Групповой коммит (config.DB_GROUP_COMMIT): записи копятся в очереди,
+# единственный писатель сбрасывает их одной транзакцией.
+_write_queue: asyncio.Queue | None = None
+_writer_task: asyncio.Task | None = None
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA foreign_keys = ON",
+)
+
+# ========== СЛУЖЕБНОЕ ==========
+async def _run(fn, *args):
+    """Выполняет синхронную функцию в потоке базы данных."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, fn, *args)
+
+def _transaction(fn, *args):
+    """Выполняет fn(cur, *args) в одной транзакции BEGIN IMMEDIATE ... COMMIT."""
+    cur = _conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn(cur, *args)
+    except BaseException:
+        cur.execute("ROLLBACK")
+        raise
+    cur.execute("COMMIT")
+    return result
+
+async def _write(fn, *args):
+    """Выполняет запись fn(cur, *args); возвращает управление после COMMIT."""
+    if _write_queue is None:
+        return await _run(_transaction, fn, *args)
+    future = asyncio.get_running_loop().create_future()
+    await _write_queue.put((fn, args, future))
+    return await future
+
+def _apply_batch(batch):
+    """Применяет пачку записей одной транзакцией, каждую — в своём SAVEPOINT.
+
+    Ошибка одной операции откатывает только её, остальные коммитятся.
+    """
+    cur = _conn.cursor()
+    results = []
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        for fn, args in batch:
+            cur.execute("SAVEPOINT op")
+            try:
+                results.append((True, fn(cur, *args)))
+            except Exception as e:
+                cur.execute("ROLLBACK TO op")
+                results.append((False, e))
+            cur.execute("RELEASE op")
+    except BaseException:
+        cur.execute("ROLLBACK")
+        raise
+    cur.execute("COMMIT")
+    return results
+
+async def _writer_loop(max_delay: float, max_ops: int):
+    """Единственный писатель: собирает пачку за max_delay или до max_ops операций.
+
+    None в очереди — сигнал остановки после сброса уже собранных записей.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        item = await _write_queue.get()
+        if item is None:
+            return
+        batch = [item]
+        deadline = loop.time() + max_delay
+        while len(batch) < max_ops:
+            if _write_queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(_write_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = _write_queue.get_nowait()
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        try:
+            results = await _run(_apply_batch, [(fn, args) for fn, args, _ in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        for (_, _, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+def write_queue_depth() -> int:
+    """Сколько записей ждут группового коммита (0 без него)."""
+    return _write_queue.qsize() if _write_queue is not None else 0
+
+def _fetchone(sql: str, params=()):
+    return _conn.execute(sql, params).fetchone()
+
+def _fetchall(sql: str, params=()):
+    return _conn.execute(sql, params).fetchall()
+
+# ========== ИНИЦИАЛИЗАЦИЯ ==========
+# Таблицы с деньгами: DDL (с местом под имя таблицы) и денежные колонки.
+# Все суммы — INTEGER в микро-USDT (см. money.py).
+MONEY_TABLES = {
+    "users": ("""
+        CREATE TABLE IF NOT EXISTS {} (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER DEFAULT 0,
+            total_bets INTEGER DEFAULT 0,
+            total_wins INTEGER DEFAULT 0,
+            registered_date TEXT,
+            blocked INTEGER NOT NULL DEFAULT 0
+        )
+    """, ("balance",)),
+    "invoices": ("""
+        CREATE TABLE IF NOT EXISTS {} (
+            invoice_id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            amount INTEGER,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP
+        )
+    """, ("amount",)),
+    "bets": ("""
+        CREATE TABLE IF NOT EXISTS {} (
+            bet_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            game TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            coef REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'reserved',
+            payout INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            settled_at TEXT,
+            roll TEXT
+        )
+    """, ("amount", "payout")),
+}
+
+def _migrate_money(cur):
+    """REAL (USDT) -> INTEGER (микро-USDT) в денежных колонках.
+
+    SQLite не меняет тип колонки, поэтому таблица пересоздаётся и копируется
+    одной транзакцией; индексы создаются заново после миграций.
+    """
+    for table, (ddl, money_columns) in MONEY_TABLES.items():
+        columns = [row[1] for row in cur.execute(f"PRAGMA table_info({table})")]
+        select = ", ".join(
+            f"CAST(ROUND({column} * {money.MICRO}) AS INTEGER)" if column in money_columns else column
+            for column in columns
+        )
+        cur.execute(ddl.format(f"{table}_new"))
+        cur.execute(f"INSERT INTO {table}_new ({', '.join(columns)}) SELECT {select} FROM {table}")
+        cur.execute(f"DROP TABLE {table}")
+        cur.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+def _open_ledger(cur):
+    """Балансы, накопленные до появления журнала, — одной проводкой 'opening'."""
+    cur.execute(
+        "INSERT INTO ledger (user_id, kind, amount, balance, created_at) "
+        "SELECT user_id, 'opening', balance, balance, ? FROM users WHERE balance != 0",
+        (datetime.now().isoformat(),)
+    )
+
+def _backfill_payments(cur):
+    """Уже оплаченные инвойсы CryptoBot — в payments, чтобы их нельзя было зачислить повторно."""
+    cur.execute(
+        "INSERT OR IGNORE INTO payments (provider, payment_id, user_id, amount, created_at) "
+        "SELECT 'cryptobot', invoice_id, user_id, amount, created_at FROM invoices WHERE status = 'paid'"
+    )
+
+def _invoice_expiry(cur):
+    """Срок жизни инвойса (expires_at); у старых инвойсов он неизвестен и остаётся NULL."""
+    # _migrate_money пересоздаёт invoices уже в последней схеме, с этой колонкой
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(invoices)")}
+    if "expires_at" not in columns:
+        cur.execute("ALTER TABLE invoices ADD COLUMN expires_at TIMESTAMP")
+
+# MIGRATIONS[i] переводит базу из PRAGMA user_version = i в i + 1
+MIGRATIONS = (_migrate_money, _open_ledger, _backfill_payments, _invoice_expiry)
+
+def _apply_migration(cur, version: int, migration):
+    # Другой процесс мог применить миграцию, пока мы ждали блокировку
+    if cur.execute("PRAGMA user_version").fetchone()[0] != version:
+        return
+    migration(cur)
+    cur.execute(f"PRAGMA user_version = {version + 1}")
+
+def _migrate():
+    if _conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS):
+        return
+    # Свежая база сразу создаётся в последней схеме
+    fresh = not _conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'users'").fetchone()
+    for table, (ddl, _) in MONEY_TABLES.items():
+        _conn.execute(ddl.format(table))
+    if fresh:
+        _conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        return
+    for version, migration in enumerate(MIGRATIONS):
+        _transaction(_apply_migration, version, migration)
+
+def _open(path: str):
+    global _conn
+    # isolation_level=None: транзакциями управляем сами через _transaction
+    _conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    for pragma in PRAGMAS:
+        _conn.execute(pragma)
+    _conn.execute(f"PRAGMA synchronous = {config.DB_SYNCHRONOUS}")
+    _conn.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            provider TEXT NOT NULL,
+            payment_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (provider, payment_id)
+        ) WITHOUT ROWID
+    ''')
+    _conn.execute('''
+        CREATE TABLE IF NOT EXISTS withdrawals (
+            withdrawal_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            check_id TEXT,
+            check_url TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    _conn.execute("CREATE INDEX IF NOT EXISTS idx_withdrawals_status ON withdrawals(status, withdrawal_id)")
+    _conn.execute('''
+        CREATE TABLE IF NOT EXISTS ledger (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            ref TEXT,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    _conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger(user_id, entry_id)")
+    for action in ("UPDATE", "DELETE"):
+        _conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS ledger_no_{action.lower()} BEFORE {action} ON ledger
+            BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END
+        ''')
+    _conn.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_snapshots (
+            user_id INTEGER PRIMARY KEY,
+            entry_id INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    _migrate()
+    _conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_status ON invoices(status, created_at)")
+    _conn.execute("CREATE INDEX IF NOT EXISTS idx_bets_user ON bets(user_id, bet_id)")
+    _conn.execute("CREATE INDEX IF NOT EXISTS idx_bets_reserved ON bets(created_at) WHERE status = 'reserved'")
+    _conn.execute('''
+        CREATE TABLE IF NOT EXISTS fair_seeds (
+            user_id INTEGER PRIMARY KEY,
+            server_seed TEXT NOT NULL,
+            client_seed TEXT NOT NULL,
+            nonce INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    _conn.execute('''
+        CREATE TABLE IF NOT EXISTS fsm (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    _conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_expires ON fsm(expires_at)")
+    _conn.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    _conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            admin_chat_id INTEGER,
+            status_message_id INTEGER,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            unknown INTEGER NOT NULL DEFAULT 0,
+            cursor INTEGER NOT NULL DEFAULT -9223372036854775808,
+            created_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+    ''')
+    _conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            job_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            PRIMARY KEY (job_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    _conn.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+def _close():
+    global _conn
+    if _conn is not None:
+        _conn.execute("PRAGMA optimize")
+        _conn.close()
+        _conn = None
+
+async def init_db(path: str = None, group_commit: bool = None):
+    global _executor, _write_queue, _writer_task
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+    await _run(_open, path or config.DB_PATH)
+    if group_commit is None:
+        group_commit = config.DB_GROUP_COMMIT
+    if group_commit and _writer_task is None:
+        _write_queue = asyncio.Queue()
+        _writer_task = asyncio.create_task(_writer_loop(
+            config.DB_GROUP_COMMIT_MS / 1000, config.DB_GROUP_COMMIT_MAX_OPS
+        ))
+
+async def close_db():
+    global _executor, _write_queue, _writer_task
+    if _executor is None:
+        return
+    if _writer_task is not None:
+        # Писатель сбрасывает всё, что уже стоит в очереди, и завершается
+        await _write_queue.put(None)
+        await _writer_task
+        _writer_task = None
+        _write_queue = None
+    await _run(_close)
+    _executor.shutdown(wait=True)
+    _executor = None
+
+# ========== ПОЛЬЗОВАТЕЛИ ==========
+USER_COLUMNS = "user_id, balance, total_bets, total_wins, registered_date"
+
+class UserRecord:
+    """Компактная запись пользователя. Общая для всех читателей кэша — не изменяйте её."""
+
+    __slots__ = ("user_id", "balance", "total_bets", "total_wins", "registered_date")
+
+    def __init__(self, user_id: int, balance: int, total_bets: int, total_wins: int, registered_date: str):
+        self.user_id = user_id
+        self.balance = balance
+        self.total_bets = total_bets
+        self.total_wins = total_wins
+        self.registered_date = registered_date
+
+# Горячие пользователи в памяти. Все записи в users этого процесса возвращают
+# строку (RETURNING) и обновляют кэш (write-through). Изменения из других
+# процессов (режим вебхука) становятся видны не позже чем через USER_CACHE_TTL.
+_user_cache = TTLCache(maxsize=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)
+
+def _cache_user(row) -> UserRecord | None:
+    if row is None:
+        return None
+    user = UserRecord(*row)
+    _user_cache.set(user.user_id, user)
+    return user
+
+def user_cache_stats() -> dict:
+    return _user_cache.stats()
+
+def _get_user(user_id: int):
+    row = _fetchone(f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?", (user_id,))
+    if row is None:
+        row = _fetchone(
+            f"INSERT INTO users (user_id, balance, registered_date) VALUES (?, 0, ?) "
+            f"ON CONFLICT(user_id) DO NOTHING RETURNING {USER_COLUMNS}",
+            (user_id, datetime.now().isoformat())
+        ) or _fetchone(f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?", (user_id,))
+    return row
+
+async def get_user(user_id: int, fresh: bool = False) -> UserRecord:
+    """Возвращает пользователя (из кэша, если fresh=False), регистрируя его при первом обращении."""
+    if not fresh:
+        user = _user_cache.get(user_id)
+        if user is not None:
+            return user
+    return _cache_user(await _run(_get_user, user_id))
+
+def _update_balance(cur, user_id: int, amount: int, kind: str, ref: str = None):
+    cur.execute(
+        f"UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING {USER_COLUMNS}",
+        (amount, user_id)
+    )
+    return _journal(cur, cur.fetchone(), amount, kind, ref)
+
+async def update_balance(user_id: int, amount: int, kind: str, ref: str = None) -> UserRecord | None:
+    """Меняет баланс и пишет проводку kind в журнал (см. раздел ЖУРНАЛ ОПЕРАЦИЙ)."""
+    return _cache_user(await _write(_update_balance, user_id, amount, kind, ref))
+
+def _debit_balance(cur, user_id: int, amount: int, kind: str, ref: str = None):
+    user = _debit(cur, user_id, amount)
+    if user is None:
+        return None
+    return _journal(cur, user, -amount, kind, ref)
+
+async def debit_balance(user_id: int, amount: int, kind: str, ref: str = None) -> UserRecord | None:
+    """Списывает amount, только если хватает баланса (проверка и списание — один UPDATE); иначе None."""
+    return _cache_user(await _write(_debit_balance, user_id, amount, kind, ref))
+
+def _update_stats(cur, user_id: int, win: bool):
+    cur.execute(
+        "UPDATE users SET total_bets = total_bets + 1, total_wins = total_wins + ? "
+        f"WHERE user_id = ? RETURNING {USER_COLUMNS}",
+        (1 if win else 0, user_id)
+    )
+    return cur.fetchone()
+
+async def update_stats(user_id: int, win: bool):
+    _cache_user(await _write(_update_stats, user_id, win))
+
+async def count_reachable_users() -> int:
+    row = await _run(_fetchone, "SELECT COUNT(*) FROM users WHERE blocked = 0")
+    return row[0]
+
+def _set_user_blocked(cur, user_id: int, blocked: bool):
+    cur.execute("UPDATE users SET blocked = ? WHERE user_id = ? AND blocked != ?", (int(blocked), user_id, int(blocked)))
+
+async def set_user_blocked(user_id: int, blocked: bool):
+    """Отмечает, что пользователь заблокировал бота (рассылки его пропускают)."""
+    await _write(_set_user_blocked, user_id, blocked)
+
+# ========== ПЛАТЕЖИ ==========
+# Все зачисления извне проходят через _credit_payment: строка payments с ключом
+# (provider, payment_id) вставляется в одной транзакции с зачислением, поэтому
+# повтор того же платежа (опрос, вебхук, кнопка «Я оплатил», повторный
+# successful_payment) ничего не меняет, в каком бы процессе он ни случился.
+PAYMENT_KINDS = {'cryptobot': 'deposit', 'stars': 'stars'}
+
+def _credit_payment(cur, provider: str, payment_id: str, user_id: int, amount: int):
+    now = datetime.now().isoformat()
+    cur.execute(
+        "INSERT INTO payments (provider, payment_id, user_id, amount, created_at) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(provider, payment_id) DO NOTHING",
+        (provider, payment_id, user_id, amount, now)
+    )
+    if cur.rowcount == 0:
+        return None
+    cur.execute(
+        "INSERT INTO users (user_id, balance, registered_date) VALUES (?, 0, ?) ON CONFLICT(user_id) DO NOTHING",
+        (user_id, now)
+    )
+    return _update_balance(cur, user_id, amount, PAYMENT_KINDS[provider], f"{provider}:{payment_id}")
+
+async def credit_payment(provider: str, payment_id: str, user_id: int, amount: int) -> UserRecord | None:
+    """Зачисляет платёж ровно один раз; None, если он уже был зачислен."""
+    return _cache_user(await _write(_credit_payment, provider, str(payment_id), user_id, amount))
+
+# ========== ИНВОЙСЫ ==========
+def _save_invoice(cur, invoice_id: str, user_id: int, amount: int, expires_in: int = None):
+    cur.execute(
+        "INSERT INTO invoices (invoice_id, user_id, amount, expires_at) VALUES (?, ?, ?, datetime('now', ?))",
+        (invoice_id, user_id, amount, None if expires_in is None else f"+{int(expires_in)} seconds")
+    )
+
+async def save_invoice(invoice_id: str, user_id: int, amount: int, expires_in: int = None):
+    """expires_in — срок жизни, переданный CryptoBot при создании; None — неизвестен."""
+    await _write(_save_invoice, str(invoice_id), user_id, amount, expires_in)
+
+async def get_pending_invoices(grace: int = 0):
+    """Ожидающие инвойсы: (invoice_id, user_id, amount, истёк ли срок жизни + grace секунд).
+
+    Без известного срока жизни (инвойсы, созданные до expires_at) — всегда False.
+    """
+    return await _run(
+        _fetchall,
+        "SELECT invoice_id, user_id, amount, COALESCE(expires_at < datetime('now', ?), 0) "
+        "FROM invoices WHERE status = 'pending'",
+        (f"-{int(grace)} seconds",)
+    )
+
+def _mark_invoice_paid(cur, invoice_id: str):
+    cur.execute(
+        "UPDATE invoices SET status = 'paid' WHERE invoice_id = ? AND status IN ('pending', 'expired') "
+        "RETURNING user_id, amount",
+        (invoice_id,)
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    user = _credit_payment(cur, 'cryptobot', invoice_id, row[0], row[1])
+    if user is None:
+        return None
+    return row[0], row[1], user
+
+async def mark_invoice_paid(invoice_id: str):
+    """Переводит инвойс в 'paid' и зачисляет сумму одной транзакцией.
+
+    Идемпотентно: повторный вызов (опрос, вебхук, кнопка) вернёт None.
+    Иначе возвращает (user_id, amount).
+    """
+    paid = await _write(_mark_invoice_paid, str(invoice_id))
+    if paid is None:
+        return None
+    _cache_user(paid[2])
+    return paid[0], paid[1]
+
+def _mark_invoice_expired(cur, invoice_id: str):
+    cur.execute("UPDATE invoices SET status = 'expired' WHERE invoice_id = ? AND status = 'pending'", (invoice_id,))
+
+async def mark_invoice_expired(invoice_id: str):
+    await _write(_mark_invoice_expired, str(invoice_id))
+
+async def count_pending_invoices() -> int:
+    row = await _run(_fetchone, "SELECT COUNT(*) FROM invoices WHERE status = 'pending'")
+    return row[0]
+
+async def count_fresh_invoices(window: int) -> int:
+    row = await _run(
+        _fetchone,
+        "SELECT COUNT(*) FROM invoices WHERE status = 'pending' AND created_at >= datetime('now', ?)",
+        (f"-{int(window)} seconds",)
+    )
+    return row[0]
+
+# ========== ВЫВОДЫ ==========
+# Заявка на вывод: pending (сумма уже списана) -> processing (воркер создаёт чек)
+# -> done (чек создан) | refunded (CryptoBot отказал, сумма возвращена) | review
+# (исход неизвестен: таймаут или падение во время запроса, решает администратор).
+WITHDRAWAL_COLUMNS = "withdrawal_id, user_id, amount, status, check_id, check_url, error, created_at"
+
+def _reserve_withdrawal(cur, user_id: int, amount: int):
+    user = _debit(cur, user_id, amount)
+    if user is None:
+        return None, None
+    now = datetime.now().isoformat()
+    cur.execute(
+        "INSERT INTO withdrawals (user_id, amount, created_at, updated_at) VALUES (?, ?, ?, ?) RETURNING withdrawal_id",
+        (user_id, amount, now, now)
+    )
+    withdrawal_id = cur.fetchone()[0]
+    _journal(cur, user, -amount, 'withdraw', f"withdrawal:{withdrawal_id}")
+    return withdrawal_id, user
+
+async def reserve_withdrawal(user_id: int, amount: int):
+    """Списывает сумму и ставит заявку в очередь одной транзакцией. Возвращает withdrawal_id или None."""
+    withdrawal_id, user = await _write(_reserve_withdrawal, user_id, amount)
+    _cache_user(user)
+    return withdrawal_id
+
+def _claim_withdrawals(cur, limit: int):
+    cur.execute(
+        "UPDATE withdrawals SET status = 'processing', updated_at = ? WHERE withdrawal_id IN "
+        "(SELECT withdrawal_id FROM withdrawals WHERE status = 'pending' ORDER BY withdrawal_id LIMIT ?) "
+        f"RETURNING {WITHDRAWAL_COLUMNS}",
+        (datetime.now().isoformat(), limit)
+    )
+    return sorted(cur.fetchall())
+
+async def claim_withdrawals(limit: int):
+    """Забирает до limit ожидающих заявок в обработку (pending -> processing)."""
+    return await _write(_claim_withdrawals, limit)
+
+def _set_withdrawal_status(cur, withdrawal_id: int, old_statuses: tuple, status: str,
+                           check_id: str = None, check_url: str = None, error: str = None):
+    placeholders = ", ".join("?" * len(old_statuses))
+    cur.execute(
+        "UPDATE withdrawals SET status = ?, check_id = COALESCE(?, check_id), check_url = COALESCE(?, check_url), "
+        f"error = COALESCE(?, error), updated_at = ? WHERE withdrawal_id = ? AND status IN ({placeholders}) "
+        "RETURNING user_id, amount",
+        (status, check_id, check_url, error, datetime.now().isoformat(), withdrawal_id, *old_statuses)
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None, None
+    if status == 'refunded':
+        return row, _update_balance(cur, row[0], row[1], 'withdraw_refund', f"withdrawal:{withdrawal_id}")
+    return row, None
+
+async def set_withdrawal_status(withdrawal_id: int, old_statuses: tuple, status: str,
+                                check_id: str = None, check_url: str = None, error: str = None):
+    """Переводит заявку из old_statuses в status; в 'refunded' — вместе с возвратом суммы.
+
+    Возвращает (user_id, amount) или None, если заявка уже в другом статусе.
+    """
+    row, user = await _write(_set_withdrawal_status, withdrawal_id, tuple(old_statuses), status,
+                             check_id, check_url, error)
+    _cache_user(user)
+    return row
+
+def _recover_withdrawals(cur):
+    cur.execute(
+        "UPDATE withdrawals SET status = 'review', error = 'прервано во время создания чека', updated_at = ? "
+        "WHERE status = 'processing'",
+        (datetime.now().isoformat(),)
+    )
+    return cur.rowcount
+
+async def recover_withdrawals() -> int:
+    """После падения: заявки, застрявшие в processing, — на проверку (чек мог успеть создаться)."""
+    return await _write(_recover_withdrawals)
+
+async def get_withdrawals(status: str, limit: int):
+    return await _run(
+        _fetchall,
+        f"SELECT {WITHDRAWAL_COLUMNS} FROM withdrawals WHERE status = ? ORDER BY withdrawal_id LIMIT ?",
+        (status, limit)
+    )
+
+async def count_withdrawals() -> dict:
+    """{статус: число заявок} по всем статусам."""
+    return dict(await _run(_fetchall, "SELECT status, COUNT(*) FROM withdrawals GROUP BY status"))
+
+# ========== СТАВКИ ==========
+# Ставка проходит ровно два коммита: резерв (условное списание) и расчёт.
+def _debit(cur, user_id: int, amount: int):
+    cur.execute(
+        f"UPDATE users SET balance = balance - ? WHERE user_id = ? AND balance >= ? RETURNING {USER_COLUMNS}",
+        (amount, user_id, amount)
+    )
+    return cur.fetchone()
+
+def _reserve_bet(cur, user_id: int, game: str, amount: int, coef: float):
+    user = _debit(cur, user_id, amount)
+    if user is None:
+        return None, None
+    cur.execute(
+        "INSERT INTO bets (user_id, game, amount, coef, created_at) VALUES (?, ?, ?, ?, ?)",
+        (user_id, game, amount, coef, datetime.now().isoformat())
+    )
+    _journal(cur, user, -amount, 'bet', f"bet:{cur.lastrowid}")
+    return cur.lastrowid, user
+
+async def reserve_bet(user_id: int, game: str, amount: int, coef: float):
+    """Списывает ставку, только если хватает баланса. Возвращает bet_id или None."""
+    bet_id, user = await _write(_reserve_bet, user_id, game, amount, coef)
+    _cache_user(user)
+    return bet_id
+
+def _settle_bet(cur, bet_id: int, win: bool, payout: int, roll: str = None):
+    cur.execute(
+        "UPDATE bets SET status = ?, payout = ?, settled_at = ?, roll = ? "
+        "WHERE bet_id = ? AND status = 'reserved' RETURNING user_id",
+        ('won' if win else 'lost', payout, datetime.now().isoformat(), roll, bet_id)
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    cur.execute(
+        "UPDATE users SET balance = balance + ?, total_bets = total_bets + 1, total_wins = total_wins + ? "
+        f"WHERE user_id = ? RETURNING {USER_COLUMNS}",
+        (payout, 1 if win else 0, row[0])
+    )
+    return _journal(cur, cur.fetchone(), payout, 'payout', f"bet:{bet_id}")
+
+async def settle_bet(bet_id: int, win: bool, payout: int, roll: str = None):
+    """Начисляет выигрыш и обновляет статистику одной транзакцией.
+
+    roll — данные для проверки исхода provably fair (хэш сида:client_seed:nonce).
+    """
+    return _cache_user(await _write(_settle_bet, bet_id, win, payout, roll)) is not None
+
+def _refund_bet(cur, bet_id: int):
+    cur.execute(
+        "UPDATE bets SET status = 'refunded', settled_at = ? "
+        "WHERE bet_id = ? AND status = 'reserved' RETURNING user_id, amount",
+        (datetime.now().isoformat(), bet_id)
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    return _update_balance(cur, row[0], row[1], 'refund', f"bet:{bet_id}")
+
+async def refund_bet(bet_id: int):
+    """Возвращает зарезервированную ставку, если игра не состоялась."""
+    return _cache_user(await _write(_refund_bet, bet_id)) is not None
+
+def _recover_bets(cur, max_age: int):
+    cutoff = (datetime.now() - timedelta(seconds=max_age)).isoformat()
+    cur.execute("SELECT bet_id FROM bets WHERE status = 'reserved' AND created_at < ?", (cutoff,))
+    return [_refund_bet(cur, bet_id) for bet_id, in cur.fetchall()]
+
+async def recover_bets(max_age: int) -> int:
+    """После падения: ставки, зависшие в reserved дольше max_age секунд, возвращаются."""
+    users = await _write(_recover_bets, max_age)
+    for user in users:
+        _cache_user(user)
+    return len(users)
+
+def _reserve_series(cur, user_id: int, game: str, amount: int, coef: float, rounds: int):
+    user = _debit(cur, user_id, amount * rounds)
+    if user is None:
+        return None, None
+    now = datetime.now().isoformat()
+    bet_ids = [
+        cur.execute(
+            "INSERT INTO bets (user_id, game, amount, coef, created_at) VALUES (?, ?, ?, ?, ?) RETURNING bet_id",
+            (user_id, game, amount, coef, now)
+        ).fetchone()[0]
+        for _ in range(rounds)
+    ]
+    _journal_many(cur, user, [(-amount, 'bet', f"bet:{bet_id}") for bet_id in bet_ids])
+    return bet_ids, user
+
+async def reserve_series(user_id: int, game: str, amount: int, coef: float, rounds: int):
+    """Резервирует серию из rounds одинаковых ставок одной транзакцией. Возвращает bet_id или None."""
+    bet_ids, user = await _write(_reserve_series, user_id, game, amount, coef, rounds)
+    _cache_user(user)
+    return bet_ids
+
+def _settle_series(cur, user_id: int, results):
+    now = datetime.now().isoformat()
+    entries = []
+    played = wins = 0
+    for bet_id, status, payout, roll in results:
+        cur.execute(
+            "UPDATE bets SET status = ?, payout = ?, settled_at = ?, roll = ? "
+            "WHERE bet_id = ? AND user_id = ? AND status = 'reserved' RETURNING amount",
+            (status, payout, now, roll, bet_id, user_id)
+        )
+        row = cur.fetchone()
+        if not row:
+            continue
+        if status == 'refunded':
+            entries.append((row[0], 'refund', f"bet:{bet_id}"))
+        else:
+            entries.append((payout, 'payout', f"bet:{bet_id}"))
+            played += 1
+            wins += status == 'won'
+    credit = sum(amount for amount, _, _ in entries)
+    cur.execute(
+        "UPDATE users SET balance = balance + ?, total_bets = total_bets + ?, total_wins = total_wins + ? "
+        f"WHERE user_id = ? RETURNING {USER_COLUMNS}",
+        (credit, played, wins, user_id)
+    )
+    return credit, _journal_many(cur, cur.fetchone(), entries)
+
+async def settle_series(user_id: int, results):
+    """Рассчитывает серию одной транзакцией.
+
+    results — [(bet_id, 'won' | 'lost' | 'refunded', payout, roll)]; несыгранные
+    раунды возвращаются. Возвращает сумму, зачисленную на баланс.
+    """
+    credit, user = await _write(_settle_series, user_id, results)
+    _cache_user(user)
+    return credit
+
+# ========== ЖУРНАЛ ОПЕРАЦИЙ ==========
+# Каждое изменение users.balance в той же транзакции дописывает проводку в
+# ledger: kind — 'opening', 'deposit', 'stars', 'withdraw', 'withdraw_refund',
+# 'bet', 'payout', 'refund', 'admin'; amount — изменение, balance — баланс после.
+# Журнал только дописывается (UPDATE и DELETE запрещены триггерами), а
+# users.balance — его материализованный итог. Запись в SQLite сериализована,
+# поэтому entry_id растут в порядке коммитов и снимки можно строить по курсору.
+LEDGER_COLUMNS = "entry_id, kind, amount, balance, ref, created_at"
+LEDGER_CURSOR_KEY = "ledger:cursor"
+
+def _journal(cur, user, amount: int, kind: str, ref: str = None):
+    """Проводка по строке пользователя user, уже изменённой на amount. Возвращает user."""
+    return _journal_many(cur, user, [(amount, kind, ref)])
+
+def _journal_many(cur, user, entries):
+    """Проводки [(amount, kind, ref)], уже применённые к балансу user подряд."""
+    if user is None:
+        return None
+    balance = user[1] - sum(amount for amount, _, _ in entries)
+    now = datetime.now().isoformat()
+    rows = []
+    for amount, kind, ref in entries:
+        if amount:
+            balance += amount
+            rows.append((user[0], kind, amount, balance, ref, now))
+    cur.executemany(
+        "INSERT INTO ledger (user_id, kind, amount, balance, ref, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    return user
+
+async def recent_ledger(user_id: int, limit: int):
+    """Последние проводки пользователя, новые первыми."""
+    return await _run(
+        _fetchall,
+        f"SELECT {LEDGER_COLUMNS} FROM ledger WHERE user_id = ? ORDER BY entry_id DESC LIMIT ?",
+        (user_id, limit)
+    )
+
+def _ledger_balance(cur, user_id: int) -> int:
+    # Снимок + хвост журнала после него: поиск по индексу (user_id, entry_id)
+    cur.execute("SELECT balance, entry_id FROM ledger_snapshots WHERE user_id = ?", (user_id,))
+    balance, entry_id = cur.fetchone() or (0, 0)
+    cur.execute(
+        "SELECT COALESCE(SUM(amount), 0) FROM ledger WHERE user_id = ? AND entry_id > ?", (user_id, entry_id)
+    )
+    return balance + cur.fetchone()[0]
+
+def _verify_balance(user_id: int):
+    cur = _conn.cursor()
+    cur.execute("BEGIN")
+    try:
+        row = cur.execute("SELECT COALESCE(balance, 0) FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return (row[0] if row else 0), _ledger_balance(cur, user_id)
+    finally:
+        cur.execute("COMMIT")
+
+async def verify_balance(user_id: int):
+    """(users.balance, баланс по журналу) из одного снимка базы; должны совпадать."""
+    return await _run(_verify_balance, user_id)
+
+def _snapshot_ledger(cur, batch: int):
+    row = cur.execute("SELECT value FROM settings WHERE key = ?", (LEDGER_CURSOR_KEY,)).fetchone()
+    cursor = int(row[0]) if row else 0
+    cur.execute(
+        "SELECT MAX(entry_id) FROM (SELECT entry_id FROM ledger WHERE entry_id > ? ORDER BY entry_id LIMIT ?)",
+        (cursor, batch)
+    )
+    high = cur.fetchone()[0]
+    if high is None:
+        return 0, []
+    cur.execute(
+        "SELECT user_id, SUM(amount), MAX(entry_id), COUNT(*) FROM ledger "
+        "WHERE entry_id > ? AND entry_id <= ? GROUP BY user_id",
+        (cursor, high)
+    )
+    touched = cur.fetchall()
+    now = datetime.now().isoformat()
+    mismatches = []
+    for user_id, delta, last_entry, _ in touched:
+        snapshot = cur.execute("SELECT balance FROM ledger_snapshots WHERE user_id = ?", (user_id,)).fetchone()
+        balance = (snapshot[0] if snapshot else 0) + delta
+        cur.execute(
+            "INSERT INTO ledger_snapshots (user_id, entry_id, balance, created_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET entry_id = excluded.entry_id, balance = excluded.balance, "
+            "created_at = excluded.created_at",
+            (user_id, last_entry, balance, now)
+        )
+        actual = cur.execute("SELECT COALESCE(balance, 0) FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        expected = _ledger_balance(cur, user_id)
+        if actual is None or actual[0] != expected:
+            mismatches.append((user_id, actual[0] if actual else None, expected))
+    cur.execute(
+        "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (LEDGER_CURSOR_KEY, str(high))
+    )
+    return sum(count for *_, count in touched), mismatches
+
+async def snapshot_ledger(batch: int):
+    """Сворачивает до batch новых проводок в снимки балансов и сверяет затронутых пользователей.
+
+    Возвращает (обработано проводок, [(user_id, users.balance, баланс по журналу)] расхождений).
+    """
+    return await _write(_snapshot_ledger, batch)
+
+# ========== РАССЫЛКИ ==========
+# Получатели берутся из users порциями по курсору (users.user_id > cursor) и
+# материализуются в broadcast_recipients. Счётчики ведутся в строке broadcasts,
+# так что статус рассылки читается без обхода таблицы получателей.
+BROADCAST_COLUMNS = (
+    "job_id, text, status, admin_chat_id, status_message_id, "
+    "total, sent, failed, blocked, unknown, created_at, finished_at"
+)
+
+def _create_broadcast(cur, text: str, admin_chat_id: int, status_message_id: int):
+    cur.execute("SELECT COUNT(*) FROM users WHERE blocked = 0")
+    total = cur.fetchone()[0]
+    cur.execute(
+        "INSERT INTO broadcasts (text, admin_chat_id, status_message_id, total, created_at) "
+        f"VALUES (?, ?, ?, ?, ?) RETURNING {BROADCAST_COLUMNS}",
+        (text, admin_chat_id, status_message_id, total, datetime.now().isoformat())
+    )
+    return cur.fetchone()
+
+async def create_broadcast(text: str, admin_chat_id: int = None, status_message_id: int = None):
+    """Создаёт задание рассылки и возвращает его строку."""
+    return await _write(_create_broadcast, text, admin_chat_id, status_message_id)
+
+def _set_broadcast_status(cur, job_id: int, old_status: str, status: str):
+    finished_at = datetime.now().isoformat() if status == 'done' else None
+    cur.execute(
+        "UPDATE broadcasts SET status = ?, finished_at = ? WHERE job_id = ? AND status = COALESCE(?, status)",
+        (status, finished_at, job_id, old_status)
+    )
+    return cur.rowcount == 1
+
+async def set_broadcast_status(job_id: int, old_status: str | None, status: str) -> bool:
+    """Переводит рассылку из old_status (None — из любого) в status.
+
+    False, если рассылка сейчас в другом статусе.
+    """
+    return await _write(_set_broadcast_status, job_id, old_status, status)
+
+async def get_broadcast(job_id: int):
+    return await _run(_fetchone, f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE job_id = ?", (job_id,))
+
+def _claim_broadcast_chunk(cur, job_id: int, chunk_size: int):
+    cur.execute("SELECT cursor FROM broadcasts WHERE job_id = ?", (job_id,))
+    cursor = cur.fetchone()[0]
+    cur.execute(
+        "SELECT user_id FROM users WHERE user_id > ? AND blocked = 0 ORDER BY user_id LIMIT ?",
+        (cursor, chunk_size)
+    )
+    user_ids = [row[0] for row in cur.fetchall()]
+    if user_ids:
+        cur.executemany(
+            "INSERT OR IGNORE INTO broadcast_recipients (job_id, user_id) VALUES (?, ?)",
+            [(job_id, user_id) for user_id in user_ids]
+        )
+        cur.execute("UPDATE broadcasts SET cursor = ? WHERE job_id = ?", (user_ids[-1], job_id))
+    return user_ids
+
+async def claim_broadcast_chunk(job_id: int, chunk_size: int):
+    """Берёт следующую порцию получателей после курсора и сдвигает курсор."""
+    return await _write(_claim_broadcast_chunk, job_id, chunk_size)
+
+async def get_pending_recipients(job_id: int):
+    rows = await _run(
+        _fetchall,
+        "SELECT user_id FROM broadcast_recipients WHERE job_id = ? AND status = 'pending' ORDER BY user_id",
+        (job_id,)
+    )
+    return [row[0] for row in rows]
+
+def _mark_recipient_sending(cur, job_id: int, user_id: int):
+    cur.execute(
+        "UPDATE broadcast_recipients SET status = 'sending' WHERE job_id = ? AND user_id = ? AND status = 'pending'",
+        (job_id, user_id)
+    )
+    return cur.rowcount == 1
+
+async def mark_recipient_sending(job_id: int, user_id: int) -> bool:
+    """Отмечает начало отправки. False — получатель уже обработан, слать нельзя."""
+    return await _write(_mark_recipient_sending, job_id, user_id)
+
+def _finish_recipient(cur, job_id: int, user_id: int, result: str):
+    cur.execute(
+        "UPDATE broadcast_recipients SET status = ? WHERE job_id = ? AND user_id = ? AND status = 'sending'",
+        (result, job_id, user_id)
+    )
+    if cur.rowcount == 0:
+        return
+    counter = {'sent': 'sent', 'failed': 'failed', 'blocked': 'blocked'}[result]
+    cur.execute(f"UPDATE broadcasts SET {counter} = {counter} + 1 WHERE job_id = ?", (job_id,))
+    if result == 'blocked':
+        _set_user_blocked(cur, user_id, True)
+
+async def finish_recipient(job_id: int, user_id: int, result: str):
+    """Сохраняет итог отправки ('sent', 'failed', 'blocked') и обновляет счётчики."""
+    await _write(_finish_recipient, job_id, user_id, result)
+
+def _recover_broadcast(cur, job_id: int):
+    # Отправки, прерванные перезапуском, могли дойти: не повторяем их, чтобы не было дублей
+    cur.execute(
+        "UPDATE broadcast_recipients SET status = 'unknown' WHERE job_id = ? AND status = 'sending'",
+        (job_id,)
+    )
+    cur.execute("UPDATE broadcasts SET unknown = unknown + ? WHERE job_id = ?", (cur.rowcount, job_id))
+    cur.execute(f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE job_id = ?", (job_id,))
+    return cur.fetchone()
+
+async def recover_broadcast(job_id: int):
+    return await _write(_recover_broadcast, job_id)
+
+async def get_unfinished_broadcasts():
+    return await _run(
+        _fetchall,
+        f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE status IN ('running', 'paused') ORDER BY job_id"
+    )
+
+async def get_broadcasts(limit: int = 10):
+    return await _run(_fetchall, f"SELECT {BROADCAST_COLUMNS} FROM broadcasts ORDER BY job_id DESC LIMIT ?", (limit,))
+
+# ========== FSM ==========
+# Пустые записи (без состояния и данных) удаляются сразу, просроченные — fsm_purge.
+async def fsm_get(key: str, now: int):
+    """Возвращает (state, data_json, expires_at) или None, если записи нет или она просрочена."""
+    return await _run(
+        _fetchone, "SELECT state, data, expires_at FROM fsm WHERE key = ? AND expires_at > ?", (key, now)
+    )
+
+def _fsm_set(cur, key: str, column: str, value, expires_at: int):
+    cur.execute(
+        f"INSERT INTO fsm (key, {column}, expires_at) VALUES (?, ?, ?) "
+        f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}, expires_at = excluded.expires_at",
+        (key, value, expires_at)
+    )
+    cur.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data IS NULL", (key,))
+
+async def fsm_set_state(key: str, state: str, expires_at: int):
+    await _write(_fsm_set, key, "state", state, expires_at)
+
+async def fsm_set_data(key: str, data: str, expires_at: int):
+    await _write(_fsm_set, key, "data", data, expires_at)
+
+async def fsm_state_counts(now: int) -> dict:
+    """{состояние: число пользователей в нём} по непросроченным записям."""
+    return dict(await _run(
+        _fetchall,
+        "SELECT state, COUNT(*) FROM fsm WHERE state IS NOT NULL AND expires_at > ? GROUP BY state",
+        (now,)
+    ))
+
+def _fsm_purge(cur, now: int):
+    cur.execute("DELETE FROM fsm WHERE expires_at <= ?", (now,))
+    return cur.rowcount
+
+async def fsm_purge(now: int) -> int:
+    """Удаляет брошенные состояния с истёкшим TTL."""
+    return await _write(_fsm_purge, now)
+
+# ========== АРЕНДА (ВЫБОР ЛИДЕРА) ==========
+def _acquire_lease(cur, name: str, owner: str, ttl: float):
+    now = time.time()
+    cur.execute(
+        "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+        "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+        (name, owner, now + ttl, now)
+    )
+    return cur.rowcount == 1
+
+async def acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    """Захватывает или продлевает аренду name. True — owner держит её ещё ttl секунд."""
+    return await _write(_acquire_lease, name, owner, ttl)
+
+def _release_lease(cur, name: str, owner: str):
+    cur.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+async def release_lease(name: str, owner: str):
+    await _write(_release_lease, name, owner)
+
+# ========== PROVABLY FAIR ==========
+async def fair_get(user_id: int):
+    """Возвращает (server_seed, client_seed, nonce) игрока или None."""
+    return await _run(_fetchone, "SELECT server_seed, client_seed, nonce FROM fair_seeds WHERE user_id = ?", (user_id,))
+
+def _fair_create(cur, user_id: int, server_seed: str, client_seed: str) -> bool:
+    cur.execute(
+        "INSERT OR IGNORE INTO fair_seeds (user_id, server_seed, client_seed) VALUES (?, ?, ?)",
+        (user_id, server_seed, client_seed)
+    )
+    return cur.rowcount == 1
+
+async def fair_create(user_id: int, server_seed: str, client_seed: str) -> bool:
+    """Заводит сиды игроку, если их ещё нет. True — записаны именно эти."""
+    return await _write(_fair_create, user_id, server_seed, client_seed)
+
+def _fair_next(cur, user_id: int, server_seed: str, client_seed: str, count: int):
+    cur.execute(
+        "INSERT OR IGNORE INTO fair_seeds (user_id, server_seed, client_seed) VALUES (?, ?, ?)",
+        (user_id, server_seed, client_seed)
+    )
+    cur.execute(
+        "UPDATE fair_seeds SET nonce = nonce + ? WHERE user_id = ? RETURNING server_seed, client_seed, nonce",
+        (count, user_id)
+    )
+    return cur.fetchone()
+
+async def fair_next(user_id: int, server_seed: str, client_seed: str, count: int = 1):
+    """Берёт следующие count номеров ставок игрока (сиды из аргументов — если их ещё нет).
+
+    Возвращает (server_seed, client_seed, последний nonce).
+    """
+    return await _write(_fair_next, user_id, server_seed, client_seed, count)
+
+def _fair_rotate(cur, user_id: int, server_seed: str, client_seed: str, keep_client_seed: bool):
+    old = cur.execute(
+        "SELECT server_seed, client_seed, nonce FROM fair_seeds WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    if old is not None and keep_client_seed:
+        client_seed = old[1]
+    cur.execute(
+        "INSERT INTO fair_seeds (user_id, server_seed, client_seed) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET server_seed = excluded.server_seed, "
+        "client_seed = excluded.client_seed, nonce = 0",
+        (user_id, server_seed, client_seed)
+    )
+    return old
+
+async def fair_rotate(user_id: int, server_seed: str, client_seed: str, keep_client_seed: bool = False):
+    """Ставит новый server_seed и обнуляет nonce. Возвращает прежние (server_seed, client_seed, nonce) или None."""
+    return await _write(_fair_rotate, user_id, server_seed, client_seed, keep_client_seed)
+
+# ========== НАСТРОЙКИ ==========
+async def get_setting(key: str):
+    row = await _run(_fetchone, "SELECT value FROM settings WHERE key = ?", (key,))
+    return row[0] if row else None
+
+def _set_setting(cur, key: str, value: str):
+    cur.execute(
+        "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, value)
+    )
+
+async def set_setting(key: str, value: str):
+    await _write(_set_setting, key, value)
+
+def _delete_setting(cur, key: str, value: str = None):
+    if value is None:
+        cur.execute("DELETE FROM settings WHERE key = ?", (key,))
+    else:
+        cur.execute("DELETE FROM settings WHERE key = ? AND value = ?", (key, value))
+
+async def delete_setting(key: str, value: str = None):
+    """Удаляет настройку; с value — только если она всё ещё равна value."""
+    await _write(_delete_setting, key, value)
+
+# ========== МЕТРИКИ ==========
+# Каждый публичный async-хелпер модуля оборачивается замером: время от вызова
+# до результата, включая ожидание потока базы и группового коммита.
+CALL_SECONDS = metrics.Histogram("casino_db_call_seconds", "Вызовы хелперов db.py", ("helper",))
+CALL_ERRORS = metrics.Counter("casino_db_errors_total", "Исключения в хелперах db.py", ("helper", "error"))
+
+def _instrument(name: str, fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            CALL_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            CALL_SECONDS.since(started, name)
+    return wrapper
+
+for _name, _fn in list(globals().items()):
+    if (not _name.startswith("_") and inspect.iscoroutinefunction(_fn) and _fn.__module__ == __name__
+            and _name not in ("init_db", "close_db")):
+        globals()[_name] = _instrument(_name, _fn)
@@ -0,0 +1,90 @@
+# fair.py
+"""Provably fair исходы ставок без send_dice (commit-reveal).
+
+Для каждого игрока заранее выбирается случайный server_seed, а показывается
+только его SHA-256. Бросок ставки с номером nonce — число 1..sides из
+HMAC-SHA256(server_seed, "client_seed:nonce:index:round"), где index — номер
+кубика в ставке (в дуэли 0 — игрок, 1 — бот). Слова по 4 байта берутся по
+порядку с отбраковкой, чтобы распределение было равномерным. После смены
+сида старый server_seed раскрывается, и игрок может пересчитать свои ставки.
+Хэш первого сида игрок видит до первой ставки (commitment), а не задним числом.
+"""
+import hashlib
+import hmac
+import secrets
+
+import db
+from games import DICE_SIDES
+
+# Игроки, у которых сиды уже есть (хэш им показан раньше); сиды не удаляются
+_seeded = set()
+
+
+def new_server_seed() -> str:
+    return secrets.token_hex(32)
+
+
+def new_client_seed() -> str:
+    return secrets.token_hex(8)
+
+
+def seed_hash(server_seed: str) -> str:
+    return hashlib.sha256(server_seed.encode()).hexdigest()
+
+
+def roll(server_seed: str, client_seed: str, nonce: int, sides: int, index: int = 0) -> int:
+    """Равномерное число 1..sides, детерминированное сидами и nonce."""
+    limit = 2 ** 32 - 2 ** 32 % sides
+    round_ = 0
+    while True:
+        message = f"{client_seed}:{nonce}:{index}:{round_}".encode()
+        digest = hmac.new(server_seed.encode(), message, hashlib.sha256).digest()
+        for offset in range(0, len(digest), 4):
+            value = int.from_bytes(digest[offset:offset + 4], "big")
+            if value < limit:
+                return value % sides + 1
+        round_ += 1
+
+
+async def get_seeds(user_id: int):
+    """Текущие (server_seed, client_seed, nonce) игрока; создаёт сиды при первом обращении."""
+    row = await db.fair_get(user_id)
+    if row is None:
+        await db.fair_create(user_id, new_server_seed(), new_client_seed())
+        row = await db.fair_get(user_id)
+    return row
+
+
+async def commitment(user_id: int):
+    """Перед первой ставкой заводит игроку сиды и возвращает (хэш server_seed, client_seed).
+
+    Их нужно показать игроку до броска. None — сиды уже были, хэш виден в /fair.
+    """
+    if user_id in _seeded:
+        return None
+    server_seed, client_seed = new_server_seed(), new_client_seed()
+    created = await db.fair_create(user_id, server_seed, client_seed)
+    _seeded.add(user_id)
+    return (seed_hash(server_seed), client_seed) if created else None
+
+
+async def rotate(user_id: int, client_seed: str = None):
+    """Меняет server_seed (и client_seed, если задан); возвращает прежние сиды или None."""
+    return await db.fair_rotate(user_id, new_server_seed(), client_seed or new_client_seed(), client_seed is None)
+
+
+async def roll_for(user_id: int, emoji: str, count: int = 1):
+    """Бросает count кубиков для следующей ставки игрока. Возвращает (значения, доказательство)."""
+    return (await roll_series(user_id, emoji, count, 1))[0]
+
+
+async def roll_series(user_id: int, emoji: str, count: int, rounds: int):
+    """Броски для rounds ставок подряд (по count кубиков): [(значения, доказательство)]."""
+    server_seed, client_seed, last = await db.fair_next(user_id, new_server_seed(), new_client_seed(), rounds)
+    sides = DICE_SIDES[emoji]
+    hashed = seed_hash(server_seed)
+    return [
+        ([roll(server_seed, client_seed, nonce, sides, index) for index in range(count)],
+         f"{hashed}:{client_seed}:{nonce}")
+        for nonce in range(last - rounds + 1, last + 1)
+    ]
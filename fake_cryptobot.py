@@ -0,0 +1,164 @@
+# fake_cryptobot.py
+"""Локальная имитация Crypto Pay API для ручной проверки без реальных платежей.
+
+    python fake_cryptobot.py --port 8090 --webhook http://127.0.0.1:8081/cryptobot
+
+В config.py укажите CRYPTOBOT_API_URL = 'http://127.0.0.1:8090'. Оплатить инвойс:
+    curl -X POST http://127.0.0.1:8090/fake/pay/<invoice_id>
+Сервер пометит его оплаченным и отправит подписанный апдейт invoice_paid на --webhook.
+Медленный и сбоящий API для проверки таймаутов и автомата (cryptobot.py):
+    python fake_cryptobot.py --latency 2 --jitter 1 --error-rate 0.3
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+from collections import Counter
+from datetime import datetime, timezone
+
+import aiohttp
+from aiohttp import web
+
+import config
+from cryptobot_webhook import sign_body
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeCryptoBot:
+    def __init__(self, token: str, webhook_url: str = None, latency: float = 0, jitter: float = 0,
+                 error_rate: float = 0):
+        self.token = token
+        self.webhook_url = webhook_url
+        self.latency = latency          # задержка каждого ответа API, с
+        self.jitter = jitter            # плюс случайная добавка 0..jitter, с
+        self.error_rate = error_rate    # доля ответов 500 INTERNAL_ERROR
+        self.invoices = {}
+        self.checks = {}
+        self.calls = Counter()          # запросов по методам, включая отклонённые
+        self._ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+
+    def _ok(self, result):
+        return web.json_response({"ok": True, "result": result})
+
+    def _error(self, code: int, name: str):
+        return web.json_response({"ok": False, "error": {"code": code, "name": name}}, status=code)
+
+    async def _dispatch(self, request: web.Request):
+        self.calls[request.match_info["method"]] += 1
+        if request.headers.get("Crypto-Pay-API-Token") != self.token:
+            return self._error(401, "UNAUTHORIZED")
+        handler = getattr(self, f"api_{request.match_info['method']}", None)
+        if handler is None:
+            return self._error(405, "METHOD_NOT_FOUND")
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if random.random() < self.error_rate:
+            return self._error(500, "INTERNAL_ERROR")
+        return await handler(dict(request.query))
+
+    # ---- Crypto Pay API ----
+    async def api_getMe(self, params):
+        return self._ok({"app_id": 1, "name": "fake", "payment_processing_bot_username": "CryptoTestnetBot"})
+
+    async def api_createInvoice(self, params):
+        invoice_id = next(self._ids)
+        url = f"https://t.me/CryptoTestnetBot?start=IV{invoice_id}"
+        invoice = {
+            "invoice_id": invoice_id,
+            "hash": f"IV{invoice_id}",
+            "status": "active",
+            "currency_type": params.get("currency_type", "crypto"),
+            "asset": params.get("asset", "USDT"),
+            "amount": params["amount"],
+            "bot_invoice_url": url,
+            "web_app_invoice_url": url,
+            "mini_app_invoice_url": url,
+            "description": params.get("description"),
+            "payload": params.get("payload"),
+            "created_at": _now(),
+            "allow_comments": True,
+            "allow_anonymous": True,
+        }
+        self.invoices[invoice_id] = invoice
+        return self._ok(invoice)
+
+    async def api_getInvoices(self, params):
+        items = list(self.invoices.values())
+        if params.get("invoice_ids"):
+            wanted = {int(x) for x in params["invoice_ids"].split(",")}
+            items = [inv for inv in items if inv["invoice_id"] in wanted]
+        if params.get("status"):
+            items = [inv for inv in items if inv["status"] == params["status"]]
+        offset = int(params.get("offset", 0))
+        count = int(params.get("count", 100))
+        return self._ok({"items": items[offset:offset + count]})
+
+    async def api_createCheck(self, params):
+        check_id = next(self._ids)
+        check = {
+            "check_id": check_id,
+            "hash": f"CQ{check_id}",
+            "asset": params["asset"],
+            "amount": params["amount"],
+            "bot_check_url": f"https://t.me/CryptoTestnetBot?start=CQ{check_id}",
+            "status": "active",
+            "created_at": _now(),
+        }
+        self.checks[check_id] = check
+        return self._ok(check)
+
+    # ---- Управление имитацией ----
+    async def fake_pay(self, request: web.Request):
+        invoice = self.invoices.get(int(request.match_info["invoice_id"]))
+        if invoice is None:
+            return self._error(404, "INVOICE_NOT_FOUND")
+        invoice["status"] = "paid"
+        invoice["paid_at"] = _now()
+        delivered = None
+        if self.webhook_url:
+            delivered = await self.deliver("invoice_paid", invoice)
+        return web.json_response({"invoice": invoice, "webhook_status": delivered})
+
+    async def deliver(self, update_type: str, payload: dict) -> int:
+        body = json.dumps({
+            "update_id": next(self._update_ids),
+            "update_type": update_type,
+            "request_date": _now(),
+            "payload": payload,
+        }).encode()
+        headers = {
+            "Content-Type": "application/json",
+            "crypto-pay-api-signature": sign_body(self.token, body),
+        }
+        async with aiohttp.ClientSession() as session:
+            async with session.post(self.webhook_url, data=body, headers=headers) as response:
+                return response.status
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/api/{method}", self._dispatch)
+        app.router.add_post("/fake/pay/{invoice_id}", self.fake_pay)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--webhook", default=None, help="URL вебхука бота для invoice_paid")
+    parser.add_argument("--token", default=config.API_CRYPTOBOT)
+    parser.add_argument("--latency", type=float, default=0, help="задержка ответов API, с")
+    parser.add_argument("--jitter", type=float, default=0, help="случайная добавка к задержке, с")
+    parser.add_argument("--error-rate", type=float, default=0, help="доля ответов 500 (0..1)")
+    args = parser.parse_args()
+    fake = FakeCryptoBot(args.token, args.webhook, args.latency, args.jitter, args.error_rate)
+    web.run_app(fake.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# fsm_storage.py
+import asyncio
+import json
+import time
+from collections import Counter
+from collections.abc import Mapping
+from typing import Any
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import config
+import db
+from cache import TTLCache
+
+
+def dumps(data: Mapping[str, Any]) -> str:
+    """Компактный JSON: без пробелов и \\u-экранирования кириллицы."""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в таблице fsm основной базы SQLite.
+
+    Состояние и данные живут config.FSM_TTL секунд с последней записи, после
+    чего считаются брошенными и вычищаются purge_loop. Перед базой стоит
+    ограниченный LRU-кэш (write-through): при маршрутизации апдейтов
+    пользователя в один воркер он согласован между процессами. Запись в кэше
+    истекает не позже строки в базе, поэтому вычищенное состояние из кэша
+    не вернётся.
+    """
+
+    def __init__(self, ttl: int = None, cache_size: int = None, key_builder: KeyBuilder = None):
+        self.ttl = ttl or config.FSM_TTL
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._cache = TTLCache(maxsize=cache_size or config.FSM_CACHE_SIZE, ttl=self.ttl)
+
+    def _remember(self, key: str, record: tuple, expires_at: int):
+        # TTL кэша считается от срока строки в базе, а не от момента чтения
+        self._cache.set(key, record, ttl=expires_at - time.time())
+
+    async def _load(self, key: str):
+        record = self._cache.get(key)
+        if record is None:
+            row = await db.fsm_get(key, int(time.time()))
+            if row is None:
+                record = (None, {})
+                self._cache.set(key, record)
+            else:
+                record = (row[0], json.loads(row[1]) if row[1] else {})
+                self._remember(key, record, row[2])
+        return record
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        storage_key = self.key_builder.build(key)
+        _, data = await self._load(storage_key)
+        expires_at = int(time.time()) + self.ttl
+        await db.fsm_set_state(storage_key, state, expires_at)
+        self._remember(storage_key, (state, data), expires_at)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            msg = f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            raise DataNotDictLikeError(msg)
+        storage_key = self.key_builder.build(key)
+        state, _ = await self._load(storage_key)
+        expires_at = int(time.time()) + self.ttl
+        await db.fsm_set_data(storage_key, dumps(data) if data else None, expires_at)
+        self._remember(storage_key, (state, data.copy()), expires_at)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._load(self.key_builder.build(key))
+        return data.copy()
+
+    async def purge_loop(self):
+        while True:
+            await asyncio.sleep(config.FSM_PURGE_INTERVAL)
+            try:
+                await db.fsm_purge(int(time.time()))
+            except Exception as e:
+                print(f"Ошибка очистки FSM: {e}")
+
+    async def close(self) -> None:
+        self._cache.clear()
+
+
+async def state_counts(storage: BaseStorage) -> dict:
+    """{состояние: сколько пользователей в нём}; у Redis не считается — пустой словарь."""
+    if isinstance(storage, SQLiteStorage):
+        return await db.fsm_state_counts(int(time.time()))
+    if isinstance(storage, MemoryStorage):
+        return dict(Counter(record.state for record in storage.storage.values() if record.state))
+    return {}
+
+def create_storage() -> BaseStorage:
+    """Хранилище FSM по config.FSM_STORAGE: 'sqlite', 'redis' или 'memory'."""
+    if config.FSM_STORAGE == "sqlite":
+        return SQLiteStorage()
+    if config.FSM_STORAGE == "redis":
+        # Необязательная зависимость: pip install redis. Подойдёт любой Redis-совместимый
+        # сервер (Redis, Valkey, KeyDB, Dragonfly), для проверки — локальный экземпляр.
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(
+            config.REDIS_URL,
+            key_builder=DefaultKeyBuilder(with_destiny=True),
+            state_ttl=config.FSM_TTL,
+            data_ttl=config.FSM_TTL,
+            json_dumps=dumps,
+        )
+    return MemoryStorage()
@@ -0,0 +1,76 @@
+# games.py
+"""Реестр игр: эмодзи, условие выигрыша, коэффициент и название объявляются один раз.
+
+Исходы всех игр зависят только от выпавших значений, поэтому при импорте для
+каждой игры заранее считается таблица «значения кубиков → (выигрыш, текст)».
+Расчёт ставки — один поиск в словаре. Новая игра добавляется вызовом register()
+и записью в config.COEF, обработчик ставки при этом не меняется.
+"""
+import itertools
+from typing import Callable, NamedTuple
+
+import config
+
+# Сколько значений у анимации Telegram send_dice
+DICE_SIDES = {"🎲": 6, "⚽": 5, "🏀": 5}
+
+
+class Game(NamedTuple):
+    key: str
+    emoji: str
+    name: str
+    coef: float
+    dice: int                   # кубиков за ставку: 1, у дуэли 2 (игрок и бот)
+    results: dict               # (значения кубиков) -> (выигрыш, текст результата)
+
+
+GAMES: dict[str, Game] = {}
+
+
+def register(key: str, emoji: str, name: str, outcome: Callable[..., tuple], dice: int = 1) -> Game:
+    """Регистрирует игру. outcome(*значения) -> (выигрыш, текст результата)."""
+    values = range(1, DICE_SIDES[emoji] + 1)
+    results = {combo: outcome(*combo) for combo in itertools.product(values, repeat=dice)}
+    game = GAMES[key] = Game(key, emoji, name, config.COEF[key], dice, results)
+    return game
+
+
+def football_is_goal(value: int) -> bool:
+    return value in (3, 4, 5)
+
+def basketball_is_goal(value: int) -> bool:
+    return value in (4, 5)
+
+
+def _dice(predicate, win_label: str, lose_label: str):
+    def outcome(value: int):
+        win = predicate(value)
+        return win, f"Выпало {value} ({win_label if win else lose_label})"
+    return outcome
+
+def _goal(is_goal, hit: str, bet_on_goal: bool):
+    def outcome(value: int):
+        goal = is_goal(value)
+        return goal == bet_on_goal, f"{hit if goal else 'ПРОМАХ'} (выпало {value})"
+    return outcome
+
+def _duel(predicate):
+    def outcome(user_value: int, bot_value: int):
+        text = f"Ваш кубик: {user_value}, кубик бота: {bot_value}"
+        if user_value == bot_value:
+            return False, text + " — ничья, вы проиграли."
+        win = predicate(user_value, bot_value)
+        return win, text + f" — {'вы победили' if win else 'вы проиграли'}."
+    return outcome
+
+
+register('dice_over', "🎲", "Кости: больше 3.5", _dice(lambda v: v > 3.5, "больше 3.5", "меньше или равно 3.5"))
+register('dice_under', "🎲", "Кости: меньше 3.5", _dice(lambda v: v < 3.5, "меньше 3.5", "больше или равно 3.5"))
+register('dice_even', "🎲", "Кости: четное", _dice(lambda v: v % 2 == 0, "четное", "нечетное"))
+register('dice_odd', "🎲", "Кости: нечетное", _dice(lambda v: v % 2 != 0, "нечетное", "четное"))
+register('duel_over', "🎲", "Дуэль: больше (против бота)", _duel(lambda user, bot: user > bot), dice=2)
+register('duel_under', "🎲", "Дуэль: меньше (против бота)", _duel(lambda user, bot: user < bot), dice=2)
+register('football_goal', "⚽", "Футбол: гол", _goal(football_is_goal, "ГОЛ", True))
+register('football_miss', "⚽", "Футбол: промах", _goal(football_is_goal, "ГОЛ", False))
+register('basketball_goal', "🏀", "Баскетбол: попадание", _goal(basketball_is_goal, "ПОПАДАНИЕ", True))
+register('basketball_miss', "🏀", "Баскетбол: промах", _goal(basketball_is_goal, "ПОПАДАНИЕ", False))
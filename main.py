@@ -1,123 +1,75 @@
 # main.py
 import asyncio
+import functools
 import random
-import sqlite3
-from datetime import datetime
+import re
+import time
 
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.client.default import DefaultBotProperties
 from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice, PreCheckoutQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiocryptopay import AioCryptoPay, Networks
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 
 import config
+import db
+import fair
+import metrics
+import money
+from games import GAMES
+from bot_metrics import BotApiMetricsMiddleware, HandlerMetricsMiddleware
+from broadcast import STATUS_LABELS, BroadcastEngine, progress_from_row
+from cache import TTLCache
+from cluster import LeaderElection, consume, serve
+from cryptobot import CircuitOpen, CryptoBotClient, is_rejected
+from cryptobot_webhook import start_webhook_server
+from fsm_storage import SQLiteStorage, create_storage, state_counts
+from media import CachedPhoto
+from publisher import PRIORITY_RESULT, ChannelPublisher
+from throttling import UserThrottleMiddleware
 
 # ========== ИНИЦИАЛИЗАЦИЯ ==========
 bot = Bot(token=config.TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
-storage = MemoryStorage()
+storage = create_storage()
 dp = Dispatcher(storage=storage)
 
 crypto = None  # будет инициализирован в main()
 
-# ========== БАЗА ДАННЫХ ==========
-def init_db():
-    conn = sqlite3.connect('casino.db')
-    cur = conn.cursor()
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            balance REAL DEFAULT 0,
-            total_bets INTEGER DEFAULT 0,
-            total_wins INTEGER DEFAULT 0,
-            registered_date TEXT
-        )
-    ''')
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS invoices (
-            invoice_id TEXT PRIMARY KEY,
-            user_id INTEGER,
-            amount REAL,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def get_user(user_id: int):
-    conn = sqlite3.connect('casino.db')
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-    user = cur.fetchone()
-    if not user:
-        cur.execute('''
-            INSERT INTO users (user_id, balance, registered_date) 
-            VALUES (?, ?, ?)
-        ''', (user_id, 0, datetime.now().isoformat()))
-        conn.commit()
-        cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        user = cur.fetchone()
-    conn.close()
-    return user
-
-def update_balance(user_id: int, amount: float):
-    conn = sqlite3.connect('casino.db')
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, user_id))
-    conn.commit()
-    conn.close()
-
-def update_stats(user_id: int, win: bool):
-    conn = sqlite3.connect('casino.db')
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET total_bets = total_bets + 1 WHERE user_id = ?", (user_id,))
-    if win:
-        cur.execute("UPDATE users SET total_wins = total_wins + 1 WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
-
-def save_invoice(invoice_id: str, user_id: int, amount: float):
-    conn = sqlite3.connect('casino.db')
-    cur = conn.cursor()
-    cur.execute("INSERT INTO invoices (invoice_id, user_id, amount) VALUES (?, ?, ?)",
-                (invoice_id, user_id, amount))
-    conn.commit()
-    conn.close()
-
-def get_pending_invoices():
-    conn = sqlite3.connect('casino.db')
-    cur = conn.cursor()
-    cur.execute("SELECT invoice_id, user_id, amount FROM invoices WHERE status = 'pending'")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def mark_invoice_paid(invoice_id: str):
-    conn = sqlite3.connect('casino.db')
-    cur = conn.cursor()
-    cur.execute("UPDATE invoices SET status = 'paid' WHERE invoice_id = ?", (invoice_id,))
-    conn.commit()
-    conn.close()
-
-def get_all_users():
-    conn = sqlite3.connect('casino.db')
-    cur = conn.cursor()
-    cur.execute("SELECT user_id FROM users")
-    rows = cur.fetchall()
-    conn.close()
-    return [row[0] for row in rows]
+# Статус подписки: user_id -> bool. Отдельные TTL для подписанных и неподписанных,
+# обновляется сразу по апдейтам chat_member из канала.
+subscription_cache = TTLCache(maxsize=config.SUB_CACHE_SIZE, ttl=config.SUB_CACHE_POSITIVE_TTL)
+SUBSCRIBED_STATUSES = ("member", "administrator", "creator")
+
+# Суммы в коде — целые микро-USDT (money.py); в config лимиты записаны в USDT
+MIN_BET = money.parse(config.MIN_BET)
+MAX_BET = money.parse(config.MAX_BET)
+MIN_PAYMENT = money.parse(1)        # пополнение и вывод через CryptoBot
+MAX_PAYMENT = money.parse(1000)
+
+# В режиме вебхука баланс меняют и другие процессы (админ-команды в чужом воркере,
+# лидер — выводы и возврат ставок), поэтому показываемый баланс читается из базы
+FRESH_BALANCE = config.RUN_MODE == "webhook"
+
 
 # ========== ПРОВЕРКА ПОДПИСКИ ==========
-async def check_subscription(user_id: int) -> bool:
-    """Проверяет, подписан ли пользователь на канал."""
+def cache_subscription(user_id: int, subscribed: bool):
+    ttl = config.SUB_CACHE_POSITIVE_TTL if subscribed else config.SUB_CACHE_NEGATIVE_TTL
+    subscription_cache.set(user_id, subscribed, ttl)
+
+async def check_subscription(user_id: int, use_cache: bool = True) -> bool:
+    """Проверяет, подписан ли пользователь на канал (с кэшем по TTL)."""
+    if use_cache:
+        cached = subscription_cache.get(user_id)
+        if cached is not None:
+            return cached
     try:
         member = await bot.get_chat_member(chat_id=f"@{config.CHANNEL_USERNAME}", user_id=user_id)
-        return member.status in ("member", "administrator", "creator")
+        subscribed = member.status in SUBSCRIBED_STATUSES
+        cache_subscription(user_id, subscribed)
+        return subscribed
     except TelegramBadRequest as e:
         print(f"Ошибка проверки подписки: {e}")
         return False
@@ -125,8 +77,17 @@ async def check_subscription(user_id: int) -> bool:
         print(f"Неизвестная ошибка: {e}")
         return False
 
+SUBSCRIBE_TEXT = (
+    "❌ Вы должны подписаться на канал, чтобы пользоваться ботом.\n\n"
+    "Подпишитесь и нажмите «ПРОВЕРИТЬ ПОДПИСКУ»."
+)
+
+async def ask_to_subscribe(message: types.Message):
+    await message.answer(SUBSCRIBE_TEXT, reply_markup=SUBSCRIBE_KEYBOARD)
+
 def subscription_required(handler):
     """Декоратор для проверки подписки перед выполнением хендлера."""
+    @functools.wraps(handler)
     async def wrapper(event, *args, **kwargs):
         user_id = None
         if isinstance(event, types.CallbackQuery):
@@ -136,27 +97,21 @@ def subscription_required(handler):
         if not user_id:
             return
         if not await check_subscription(user_id):
-            markup = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="📢 Канал", url=f"https://t.me/{config.CHANNEL_USERNAME}")],
-                [InlineKeyboardButton(text="✅ ПРОВЕРИТЬ ПОДПИСКУ", callback_data="check_sub")]
-            ])
             if isinstance(event, types.CallbackQuery):
-                await event.message.answer(
-                    "❌ Вы должны подписаться на канал, чтобы пользоваться ботом.\n\n"
-                    "Подпишитесь и нажмите «ПРОВЕРИТЬ ПОДПИСКУ».",
-                    reply_markup=markup
-                )
+                await ask_to_subscribe(event.message)
                 await event.answer()
             else:
-                await event.answer(
-                    "❌ Вы должны подписаться на канал, чтобы пользоваться ботом.\n\n"
-                    "Подпишитесь и нажмите «ПРОВЕРИТЬ ПОДПИСКУ».",
-                    reply_markup=markup
-                )
+                await ask_to_subscribe(event)
             return
         return await handler(event, *args, **kwargs)
     return wrapper
 
+# Бот должен быть администратором канала, чтобы получать chat_member;
+# start_polling сам подписывается на используемые типы апдейтов.
+@dp.chat_member(F.chat.id == config.CHANNEL_ID)
+async def on_channel_member_update(update: types.ChatMemberUpdated):
+    cache_subscription(update.new_chat_member.user.id, update.new_chat_member.status in SUBSCRIBED_STATUSES)
+
 # ========== FSM СОСТОЯНИЯ ==========
 class GameStates(StatesGroup):
     choosing_game = State()
@@ -165,75 +120,162 @@ class GameStates(StatesGroup):
     waiting_withdraw = State()
     waiting_deposit_custom = State()
     waiting_stars_deposit = State()
+    waiting_autobet = State()
+
+# ========== АНТИФЛУД ==========
+BET_STATES = {GameStates.waiting_bet.state, GameStates.waiting_autobet.state}
+PAYMENT_STATES = {
+    GameStates.waiting_deposit_custom.state, GameStates.waiting_stars_deposit.state, GameStates.waiting_withdraw.state
+}
+# Кнопки с запросом к CryptoBot: сумма пополнения создаёт инвойс, «Я оплатил» его проверяет.
+# Меню пополнения и вывода — обычная навигация и лимит платежей не тратит
+PAYMENT_CALLBACKS = re.compile(r"deposit_\d+|check_invoice_.+")
+
+async def classify_action(event: types.Message | types.CallbackQuery, data: dict) -> str | None:
+    """Класс действия для лимитов config.THROTTLE_RATES; None — без ограничений."""
+    if isinstance(event, types.CallbackQuery):
+        if event.data == "autobet":
+            return 'bets'
+        if PAYMENT_CALLBACKS.fullmatch(event.data or ""):
+            return 'payments'
+        return 'other'
+    if event.successful_payment:
+        # Звёзды уже списаны — такой апдейт нельзя отбросить
+        return None
+    if (event.text or "").startswith("/") and event.from_user.id in config.ADMIN_IDS:
+        return 'admin'
+    state = await data["state"].get_state() if "state" in data else None
+    if state in BET_STATES:
+        return 'bets'
+    if state in PAYMENT_STATES:
+        return 'payments'
+    return 'other'
+
+throttle = UserThrottleMiddleware(classify_action)
+dp.message.outer_middleware(throttle)
+dp.callback_query.outer_middleware(throttle)
 
 # ========== КЛАВИАТУРЫ ==========
-def main_keyboard():
+# Статичные клавиатуры собираются один раз при импорте и переиспользуются во всех
+# ответах. Объекты общие — не изменяйте их, для вариаций собирайте новую клавиатуру.
+def coef_label(*games: str) -> str:
+    """Подпись коэффициента из config.COEF: «x1.7» или «x1.2–1.7», если у игр он разный."""
+    coefs = sorted({GAMES[game].coef for game in games})
+    return f"x{coefs[0]:g}" if len(coefs) == 1 else f"x{coefs[0]:g}–{coefs[-1]:g}"
+
+def build_keyboard(buttons, *sizes) -> InlineKeyboardMarkup:
+    """buttons — пары (текст, callback_data или https-ссылка)."""
     builder = InlineKeyboardBuilder()
-    builder.button(text="🎮 ИГРАТЬ", callback_data="play_menu")
-    builder.button(text="💰 ПОПОЛНИТЬ", callback_data="deposit")
-    builder.button(text="💸 ВЫВОД", callback_data="withdraw")
-    builder.button(text="👤 ПРОФИЛЬ", callback_data="profile")
-    builder.button(text="🆘 ПОДДЕРЖКА", url=f"https://t.me/{config.SUPPORT_USERNAME}")
-    builder.adjust(2, 2, 1)
-    return builder.as_markup()
-
-def play_menu_keyboard():
-    builder = InlineKeyboardBuilder()
-    builder.button(text="🎲 Кости", callback_data="game_dice")
-    builder.button(text="⚽ Футбол", callback_data="game_football")
-    builder.button(text="🏀 Баскетбол", callback_data="game_basketball")
-    builder.button(text="🔙 Назад", callback_data="back_to_main")
-    builder.adjust(2, 1)
-    return builder.as_markup()
-
-def dice_type_keyboard():
-    builder = InlineKeyboardBuilder()
-    builder.button(text="🔴 Больше 3.5 (x1.7)", callback_data="dice_over")
-    builder.button(text="🔵 Меньше 3.5 (x1.7)", callback_data="dice_under")
-    builder.button(text="🟢 Четное (x1.7)", callback_data="dice_even")
-    builder.button(text="🟡 Нечетное (x1.7)", callback_data="dice_odd")
-    builder.button(text="⚔️ Дуэль (x1.7)", callback_data="dice_duel")
-    builder.button(text="🔙 Назад", callback_data="play_menu")
-    builder.adjust(2, 2, 2, 1)
-    return builder.as_markup()
-
-def duel_choice_keyboard():
-    builder = InlineKeyboardBuilder()
-    builder.button(text="🔴 Больше (чем бот)", callback_data="duel_over")
-    builder.button(text="🔵 Меньше (чем бот)", callback_data="duel_under")
-    builder.button(text="🔙 Назад", callback_data="game_dice")
-    builder.adjust(2, 1)
-    return builder.as_markup()
-
-def back_keyboard():
-    builder = InlineKeyboardBuilder()
-    builder.button(text="🔙 Назад", callback_data="back_to_main")
+    for text, data in buttons:
+        if data.startswith("https://"):
+            builder.button(text=text, url=data)
+        else:
+            builder.button(text=text, callback_data=data)
+    if sizes:
+        builder.adjust(*sizes)
     return builder.as_markup()
 
-def play_again_keyboard():
-    builder = InlineKeyboardBuilder()
-    builder.button(text="💎 СДЕЛАТЬ СТАВКУ", url=f"https://t.me/{config.BOT_USERNAME}")
-    return builder.as_markup()
+MAIN_KEYBOARD = build_keyboard([
+    ("🎮 ИГРАТЬ", "play_menu"),
+    ("💰 ПОПОЛНИТЬ", "deposit"),
+    ("💸 ВЫВОД", "withdraw"),
+    ("👤 ПРОФИЛЬ", "profile"),
+    ("🆘 ПОДДЕРЖКА", f"https://t.me/{config.SUPPORT_USERNAME}"),
+], 2, 2, 1)
+
+PLAY_MENU_KEYBOARD = build_keyboard([
+    ("🎲 Кости", "game_dice"),
+    ("⚽ Футбол", "game_football"),
+    ("🏀 Баскетбол", "game_basketball"),
+    ("🔙 Назад", "back_to_main"),
+], 2, 1)
+
+DICE_TYPE_KEYBOARD = build_keyboard([
+    (f"🔴 Больше 3.5 ({coef_label('dice_over')})", "dice_over"),
+    (f"🔵 Меньше 3.5 ({coef_label('dice_under')})", "dice_under"),
+    (f"🟢 Четное ({coef_label('dice_even')})", "dice_even"),
+    (f"🟡 Нечетное ({coef_label('dice_odd')})", "dice_odd"),
+    (f"⚔️ Дуэль ({coef_label('duel_over', 'duel_under')})", "dice_duel"),
+    ("🔙 Назад", "play_menu"),
+], 2, 2, 2, 1)
+
+DUEL_CHOICE_KEYBOARD = build_keyboard([
+    ("🔴 Больше (чем бот)", "duel_over"),
+    ("🔵 Меньше (чем бот)", "duel_under"),
+    ("🔙 Назад", "game_dice"),
+], 2, 1)
+
+FOOTBALL_KEYBOARD = build_keyboard([
+    (f"⚽ Гол ({coef_label('football_goal')})", "football_goal"),
+    (f"🥅 Промах ({coef_label('football_miss')})", "football_miss"),
+    ("🔙 Назад", "play_menu"),
+], 2, 1)
+
+BASKETBALL_KEYBOARD = build_keyboard([
+    (f"🏀 Попадание ({coef_label('basketball_goal')})", "basketball_goal"),
+    (f"🧱 Промах ({coef_label('basketball_miss')})", "basketball_miss"),
+    ("🔙 Назад", "play_menu"),
+], 2, 1)
+
+BACK_KEYBOARD = build_keyboard([("🔙 Назад", "back_to_main")])
+
+BET_KEYBOARD = build_keyboard([
+    ("🔁 Автоставка", "autobet"),
+    ("🔙 Назад", "back_to_main"),
+], 1)
+
+PLAY_AGAIN_KEYBOARD = build_keyboard([("💎 СДЕЛАТЬ СТАВКУ", f"https://t.me/{config.BOT_USERNAME}")])
+
+SUBSCRIBE_KEYBOARD = build_keyboard([
+    ("📢 Канал", f"https://t.me/{config.CHANNEL_USERNAME}"),
+    ("✅ ПРОВЕРИТЬ ПОДПИСКУ", "check_sub"),
+], 1)
+
+DEPOSIT_KEYBOARD = build_keyboard([
+    ("💎 Пополнить Stars", "deposit_stars"),
+    ("💳 Пополнить USDT (CryptoBot)", "deposit_usdt"),
+    ("🔙 Назад", "back_to_main"),
+], 2, 1)
+
+DEPOSIT_USDT_KEYBOARD = build_keyboard(
+    [(f"{amount} USDT", f"deposit_{amount}") for amount in (5, 10, 25, 50, 100)]
+    + [("🔢 Другая сумма", "deposit_custom"), ("🔙 Назад", "deposit")],
+    3, 2, 1, 1
+)
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ДЛЯ КАНАЛА ==========
-async def send_to_channel(game_emoji: str, user_name: str, bet: float, game_name: str, coef: float):
+# Все посты в канал идут через одну очередь с лимитом Telegram (~20 сообщений в минуту
+# на канал); в режиме вебхука лимит делится между воркерами. Игрок ждёт только бросок.
+publisher = ChannelPublisher(
+    bot, rate=config.CHANNEL_RATE / (config.WEBHOOK_WORKERS if config.RUN_MODE == "webhook" else 1)
+)
+# Картинки результата: загружаются один раз, дальше отправляются по file_id
+win_photo = CachedPhoto("win", config.WIN_IMAGE_URL, config.WIN_IMAGE_PATH)
+lose_photo = CachedPhoto("lose", config.LOSE_IMAGE_URL, config.LOSE_IMAGE_PATH)
+# Время от сообщения со ставкой до ответа с результатом
+bet_latency = metrics.LatencyRecorder(config.LATENCY_WINDOW)
+BET_SECONDS = metrics.Histogram("casino_bet_seconds", "Ставка: от сообщения до ответа с результатом")
+DEPOSITS = metrics.Counter("casino_deposits_total", "Зачисленные пополнения", ("source",))
+BACKGROUND_ERRORS = metrics.Counter("casino_background_errors_total", "Ошибки фоновых задач", ("task",))
+
+def send_to_channel(game_emoji: str, user_name: str, bet: int, game_name: str, coef: float):
     text = (
         f"{game_emoji} <b>Новая ставка!</b>\n"
         f"Игрок: {user_name}\n"
         f"Игра: {game_name}\n"
-        f"Ставка: <b>{bet:.2f} USDT</b>\n"
+        f"Ставка: <b>{money.fmt(bet)} USDT</b>\n"
         f"Коэффициент: {coef}x\n"
-        f"Возможный выигрыш: <b>{bet * coef:.2f} USDT</b>"
+        f"Возможный выигрыш: <b>{money.fmt(money.multiply(bet, coef))} USDT</b>"
     )
-    try:
-        await bot.send_message(config.CHANNEL_ID, text)
-    except Exception as e:
-        print(f"Ошибка отправки в канал: {e}")
+    if not publisher.announce(text):
+        print("Очередь канала переполнена, анонс ставки пропущен")
 
-async def send_result_to_channel(bet_msg_id: int, user_name: str, result_text: str, win_amount: float, win: bool):
-    photo_url = config.WIN_IMAGE_URL if win else config.LOSE_IMAGE_URL
+async def roll_dice(emoji: str) -> types.Message:
+    return await bot.send_dice(config.CHANNEL_ID, emoji=emoji)
+
+async def send_result_to_channel(bet_msg_id: int, user_name: str, result_text: str, win_amount: int, win: bool):
     if win:
-        result_line = f"💰 Выигрыш: {win_amount:.2f} USDT"
+        result_line = f"💰 Выигрыш: {money.fmt(win_amount)} USDT"
     else:
         result_line = "💸 Проигрыш"
     caption = (
@@ -242,15 +284,18 @@ async def send_result_to_channel(bet_msg_id: int, user_name: str, result_text: s
         f"{result_text}\n"
         f"{result_line}"
     )
-    keyboard = play_again_keyboard()
+    keyboard = PLAY_AGAIN_KEYBOARD
     try:
-        await bot.send_photo(
-            chat_id=config.CHANNEL_ID,
-            photo=photo_url,
+        await (win_photo if win else lose_photo).send(
+            bot,
+            config.CHANNEL_ID,
             caption=caption,
             reply_markup=keyboard,
             reply_to_message_id=bet_msg_id
         )
+    except TelegramRetryAfter:
+        # Очередь канала подождёт и повторит пост целиком
+        raise
     except Exception as e:
         print(f"Ошибка отправки результата с фото: {e}. Отправляю текст.")
         try:
@@ -260,58 +305,296 @@ async def send_result_to_channel(bet_msg_id: int, user_name: str, result_text: s
                 reply_markup=keyboard,
                 reply_to_message_id=bet_msg_id
             )
+        except TelegramRetryAfter:
+            raise
         except Exception as e2:
             print(f"Критическая ошибка отправки результата в канал: {e2}")
 
+async def send_series_to_channel(user_name: str, summary: str):
+    # Одна сводка вместо поста на каждый раунд автоставки
+    await bot.send_message(
+        config.CHANNEL_ID,
+        f"🔁 <b>Автоставка</b>\nИгрок: {user_name}\n{summary}",
+        reply_markup=PLAY_AGAIN_KEYBOARD
+    )
+
 # ========== ФОНОВАЯ ЗАДАЧА ПРОВЕРКИ ИНВОЙСОВ (CRYPTOBOT) ==========
-async def check_invoices_background():
+# Будит фоновую задачу сразу после создания нового инвойса
+invoice_created = asyncio.Event()
+
+async def sync_invoices() -> int:
+    """Один проход: пакетная сверка ожидающих инвойсов с CryptoBot.
+
+    Просроченным инвойс становится, только если так ответил CryptoBot или, когда
+    CryptoBot его не вернул, если истёк известный срок жизни плюс INVOICE_EXPIRY_GRACE.
+    Возвращает количество зачисленных платежей.
+    """
     global crypto
+    rows = await db.get_pending_invoices(config.INVOICE_EXPIRY_GRACE)
+    ids = [str(invoice_id) for invoice_id, _, _, _ in rows]
+    overdue = {str(invoice_id) for invoice_id, _, _, expired in rows if expired}
+    credited = 0
+    for i in range(0, len(ids), config.INVOICE_SYNC_BATCH):
+        page = ids[i:i + config.INVOICE_SYNC_BATCH]
+        invoices = await crypto.get_invoices(invoice_ids=[int(x) for x in page], count=len(page))
+        if invoices is None:
+            continue
+        if not isinstance(invoices, list):
+            invoices = [invoices]
+        answered = {str(invoice.invoice_id) for invoice in invoices}
+        for invoice_id in overdue.intersection(page) - answered:
+            await db.mark_invoice_expired(invoice_id)
+        for invoice in invoices:
+            invoice_id = str(invoice.invoice_id)
+            if invoice_id not in page:
+                continue
+            if invoice.status == 'expired':
+                await db.mark_invoice_expired(invoice_id)
+                continue
+            if invoice.status != 'paid':
+                continue
+            paid = await db.mark_invoice_paid(invoice_id)
+            if paid:
+                credited += 1
+                DEPOSITS.inc("poll")
+                await notify_deposit(*paid)
+    return credited
+
+async def notify_deposit(user_id: int, amount: int):
+    try:
+        await bot.send_message(
+            user_id,
+            f"✅ Ваш платёж на {money.fmt(amount)} USDT подтверждён!\nБаланс пополнен."
+        )
+    except:
+        pass
+
+async def on_invoice_paid(invoice: dict):
+    """Апдейт invoice_paid из вебхука CryptoBot: зачисление тем же путём, что и при опросе."""
+    paid = await db.mark_invoice_paid(str(invoice["invoice_id"]))
+    if paid:
+        DEPOSITS.inc("webhook")
+        await notify_deposit(*paid)
+
+async def check_invoices_background(reconcile_only: bool = False):
+    # Адаптивный интервал: часто, пока есть свежие инвойсы, и с удвоением до максимума в простое.
+    # В режиме вебхука опрос остаётся только редкой сверкой на случай потерянных апдейтов.
+    interval = config.INVOICE_POLL_MIN
     while True:
+        if reconcile_only:
+            await asyncio.sleep(config.INVOICE_RECONCILE_INTERVAL)
+            try:
+                await sync_invoices()
+            except Exception as e:
+                print(f"Ошибка в фоновой сверке: {e}")
+                BACKGROUND_ERRORS.inc("invoices")
+            continue
         try:
-            pending = get_pending_invoices()
-            for invoice_id, user_id, amount in pending:
-                invoices = await crypto.get_invoices(invoice_ids=invoice_id)
-                if invoices and invoices[0].status == 'paid':
-                    update_balance(user_id, amount)
-                    mark_invoice_paid(invoice_id)
-                    try:
-                        await bot.send_message(
-                            user_id,
-                            f"✅ Ваш платёж на {amount:.2f} USDT подтверждён!\nБаланс пополнен."
-                        )
-                    except:
-                        pass
+            credited = await sync_invoices()
+            if credited or await db.count_fresh_invoices(config.INVOICE_FRESH_WINDOW):
+                interval = config.INVOICE_POLL_MIN
+            else:
+                interval = min(interval * 2, config.INVOICE_POLL_MAX)
         except Exception as e:
             print(f"Ошибка в фоновой проверке: {e}")
-        await asyncio.sleep(60)
+            BACKGROUND_ERRORS.inc("invoices")
+            interval = config.INVOICE_POLL_MAX
+        invoice_created.clear()
+        try:
+            await asyncio.wait_for(invoice_created.wait(), timeout=interval)
+            # Новый инвойс: даём время на оплату и сверяем через минимальный интервал
+            await asyncio.sleep(config.INVOICE_POLL_MIN)
+        except asyncio.TimeoutError:
+            pass
+
+# ========== СНИМКИ ЖУРНАЛА ОПЕРАЦИЙ ==========
+LEDGER_MISMATCHES = metrics.Counter("casino_ledger_mismatches_total", "Балансы, не сошедшиеся с журналом при снимке")
+
+async def ledger_snapshot_background():
+    # Новые проводки сворачиваются в снимки балансов; затронутые пользователи сверяются
+    # по снимку и хвосту журнала, без повторного прохода по всей истории.
+    while True:
+        try:
+            while True:
+                processed, mismatches = await db.snapshot_ledger(config.LEDGER_SNAPSHOT_BATCH)
+                for user_id, balance, expected in mismatches:
+                    LEDGER_MISMATCHES.inc()
+                    print(f"⚠️ Баланс пользователя {user_id} не сходится с журналом: "
+                          f"{balance} против {expected} микро-USDT")
+                if processed < config.LEDGER_SNAPSHOT_BATCH:
+                    break
+        except Exception as e:
+            print(f"Ошибка снимка журнала: {e}")
+            BACKGROUND_ERRORS.inc("ledger")
+        await asyncio.sleep(config.LEDGER_SNAPSHOT_INTERVAL)
+
+# ========== ЗАВИСШИЕ СТАВКИ ==========
+async def recover_bets():
+    recovered = await db.recover_bets(config.BET_RECOVER_AFTER)
+    if recovered:
+        print(f"Возвращено прерванных ставок: {recovered}")
+
+async def stale_bets_background():
+    # При старте процесса ставки проверяются сразу (main/worker_main); лидер повторяет
+    # проверку, чтобы ставки упавшего воркера не ждали следующего перезапуска
+    while True:
+        await asyncio.sleep(config.BET_RECOVER_AFTER)
+        try:
+            await recover_bets()
+        except Exception as e:
+            print(f"Ошибка возврата зависших ставок: {e}")
+            BACKGROUND_ERRORS.inc("bets")
+
+# ========== ВОРКЕР ВЫВОДОВ ==========
+# Будит воркер сразу после новой заявки в этом процессе
+withdrawal_requested = asyncio.Event()
+
+async def notify_withdrawal(user_id: int, text: str, check_url: str = None):
+    markup = None
+    if check_url:
+        markup = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="💸 Получить чек", url=check_url)]])
+    try:
+        await bot.send_message(user_id, text, reply_markup=markup)
+    except Exception:
+        pass
+
+async def process_withdrawal(withdrawal_id: int, user_id: int, amount: int) -> bool:
+    """Создаёт чек по заявке в статусе processing. False — заявка возвращена в очередь."""
+    try:
+        check = await crypto.create_check(asset='USDT', amount=money.fmt(amount), pin_to_user_id=user_id)
+    except CircuitOpen:
+        # Запрос не отправлялся: заявка подождёт, пока CryptoBot оживёт
+        await db.set_withdrawal_status(withdrawal_id, ('processing',), 'pending')
+        return False
+    except Exception as e:
+        error = str(e).strip() or type(e).__name__
+        if is_rejected(e):
+            await db.set_withdrawal_status(withdrawal_id, ('processing',), 'refunded', error=error)
+            await notify_withdrawal(user_id, f"❌ CryptoBot отклонил вывод #{withdrawal_id}: {error}\n"
+                                             f"{money.fmt(amount)} USDT возвращены на баланс.")
+        else:
+            # Таймаут, сбой сервера или ошибка разбора ответа: чек мог создаться, повторять нельзя
+            await db.set_withdrawal_status(withdrawal_id, ('processing',), 'review', error=error)
+            print(f"Вывод #{withdrawal_id} на проверке: {error}")
+            await notify_withdrawal(user_id, f"⏳ Заявка #{withdrawal_id} на вывод {money.fmt(amount)} USDT "
+                                             f"на проверке у администратора.")
+        return True
+    check_url = (
+        getattr(check, 'bot_check_url', None) or
+        getattr(check, 'web_app_check_url', None) or
+        getattr(check, 'mini_app_check_url', None) or
+        getattr(check, 'pay_url', None) or
+        getattr(check, 'url', None)
+    )
+    await db.set_withdrawal_status(withdrawal_id, ('processing',), 'done',
+                                   check_id=str(check.check_id), check_url=check_url)
+    await notify_withdrawal(
+        user_id,
+        f"✅ Чек на {money.fmt(amount)} USDT создан!\nНажмите кнопку ниже, чтобы активировать его в CryptoBot.",
+        check_url
+    )
+    return True
+
+async def withdrawals_background():
+    # Заявки забираются пачками, чеки создаются не больше WITHDRAW_CONCURRENCY одновременно.
+    # Прерванные на полпути (падение, смена лидера) при старте уходят на проверку.
+    recovered = await db.recover_withdrawals()
+    if recovered:
+        print(f"Выводов на проверке после перезапуска: {recovered}")
+    sem = asyncio.Semaphore(config.WITHDRAW_CONCURRENCY)
+
+    async def run(row):
+        async with sem:
+            return await process_withdrawal(*row[:3])
+
+    while True:
+        withdrawal_requested.clear()
+        try:
+            batch = await db.claim_withdrawals(config.WITHDRAW_BATCH)
+            if batch:
+                results = await asyncio.gather(*(run(row) for row in batch), return_exceptions=True)
+                for row, result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        print(f"Ошибка обработки вывода #{row[0]}: {result}")
+                        BACKGROUND_ERRORS.inc("withdrawal")
+                if len(batch) == config.WITHDRAW_BATCH and all(result is True for result in results):
+                    continue
+        except Exception as e:
+            print(f"Ошибка воркера выводов: {e}")
+            BACKGROUND_ERRORS.inc("withdrawals")
+        try:
+            await asyncio.wait_for(withdrawal_requested.wait(), timeout=config.WITHDRAW_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
 
 # ========== ОБРАБОТЧИКИ КОМАНД ==========
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
     user_id = message.from_user.id
     if await check_subscription(user_id):
-        get_user(user_id)
+        await db.get_user(user_id)
+        await db.set_user_blocked(user_id, False)
         await message.answer(
             f"👋 Привет, {message.from_user.first_name}!\nДобро пожаловать в казино!",
-            reply_markup=main_keyboard()
+            reply_markup=MAIN_KEYBOARD
         )
     else:
-        markup = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📢 Канал", url=f"https://t.me/{config.CHANNEL_USERNAME}")],
-            [InlineKeyboardButton(text="✅ ПРОВЕРИТЬ ПОДПИСКУ", callback_data="check_sub")]
-        ])
-        await message.answer(
-            "❌ Вы должны подписаться на канал, чтобы пользоваться ботом.\n\n"
-            "Подпишитесь и нажмите «ПРОВЕРИТЬ ПОДПИСКУ».",
-            reply_markup=markup
-        )
+        await ask_to_subscribe(message)
 
 @dp.message(Command("profile"))
 @subscription_required
 async def cmd_profile(message: types.Message, **kwargs):
     await show_profile(message)
 
+@dp.message(Command("fair"))
+@subscription_required
+async def cmd_fair(message: types.Message, command: CommandObject, **kwargs):
+    user_id = message.from_user.id
+    args = (command.args or "").split(maxsplit=1)
+    text = ""
+    if args and args[0] in ("new", "seed"):
+        client_seed = None
+        if args[0] == "seed":
+            client_seed = args[1].strip() if len(args) > 1 else ""
+            if not 0 < len(client_seed) <= 64 or not all(c.isalnum() or c in "-_" for c in client_seed):
+                await message.answer("Использование: /fair seed <до 64 букв, цифр, - и _>")
+                return
+        old = await fair.rotate(user_id, client_seed)
+        if old is not None:
+            text = (
+                f"🔓 <b>Прежний сид раскрыт</b>\n"
+                f"Server seed: <code>{old[0]}</code>\n"
+                f"SHA-256: <code>{fair.seed_hash(old[0])}</code>\n"
+                f"Client seed: <code>{old[1]}</code>\n"
+                f"Ставок на нём: {old[2]}\n\n"
+            )
+    server_seed, client_seed, nonce = await fair.get_seeds(user_id)
+    text += (
+        f"🔐 <b>Честная игра</b>\n"
+        f"SHA-256 server seed: <code>{fair.seed_hash(server_seed)}</code>\n"
+        f"Client seed: <code>{client_seed}</code>\n"
+        f"Ставок на этом сиде: {nonce}\n\n"
+        f"Кубик ставки N: HMAC-SHA256(server_seed, \"client_seed:N:кубик:раунд\"), слова по 4 байта "
+        f"с отбраковкой → 1..6 для 🎲, 1..5 для ⚽ и 🏀. В дуэли кубик 0 — ваш, 1 — бота.\n\n"
+        f"/fair new — раскрыть server seed и начать новый\n"
+        f"/fair seed &lt;строка&gt; — свой client seed (тоже меняет server seed)"
+    )
+    await message.answer(text)
+
 # ---- АДМИН-КОМАНДЫ ----
+# Виды проводок журнала (db.py, раздел ЖУРНАЛ ОПЕРАЦИЙ)
+LEDGER_LABELS = {
+    'opening': "Входящий остаток",
+    'deposit': "Пополнение",
+    'stars': "Пополнение звёздами",
+    'withdraw': "Вывод",
+    'withdraw_refund': "Возврат вывода",
+    'bet': "Ставка",
+    'payout': "Выигрыш",
+    'refund': "Возврат ставки",
+    'admin': "Администратор",
+}
+
 @dp.message(Command("checkprofile"))
 @subscription_required
 async def cmd_checkprofile(message: types.Message, command: CommandObject, **kwargs):
@@ -327,13 +610,23 @@ async def cmd_checkprofile(message: types.Message, command: CommandObject, **kwa
     except ValueError:
         await message.answer("❌ ID должен быть числом.")
         return
-    user = get_user(target_id)
+    user = await db.get_user(target_id, fresh=True)
+    balance, ledger_balance = await db.verify_balance(target_id)
     text = (
         f"👤 <b>Профиль пользователя {target_id}</b>\n"
-        f"💰 Баланс: <b>{user[1]:.2f} USDT</b>\n"
-        f"🎲 Всего игр: {user[2]}\n"
-        f"🏆 Побед: {user[3]}"
+        f"💰 Баланс: <b>{money.fmt(user.balance)} USDT</b>\n"
+        f"🎲 Всего игр: {user.total_bets}\n"
+        f"🏆 Побед: {user.total_wins}\n"
+        + ("📒 Журнал: ✅ сходится" if balance == ledger_balance
+           else f"📒 Журнал: ⚠️ по журналу {money.fmt(ledger_balance)} USDT")
     )
+    entries = await db.recent_ledger(target_id, config.LEDGER_RECENT)
+    if entries:
+        text += "\n\n<b>Последние операции:</b>\n" + "\n".join(
+            f"{created_at[:16].replace('T', ' ')} {LEDGER_LABELS.get(kind, kind)}: "
+            f"{'+' if amount > 0 else ''}{money.fmt(amount)} → {money.fmt(after)}"
+            for _, kind, amount, after, _, created_at in entries
+        )
     await message.answer(text)
 
 @dp.message(Command("takemoney"))
@@ -352,22 +645,21 @@ async def cmd_takemoney(message: types.Message, command: CommandObject, **kwargs
         return
     try:
         target_id = int(parts[0])
-        amount = float(parts[1])
+        amount = money.parse(parts[1])
     except ValueError:
         await message.answer("❌ ID и сумма должны быть числами.")
         return
     if amount <= 0:
         await message.answer("❌ Сумма должна быть положительной.")
         return
-    user = get_user(target_id)
-    current_balance = user[1]
-    if current_balance < amount:
-        await message.answer(f"❌ Недостаточно средств на балансе пользователя. Доступно: {current_balance:.2f} USDT")
+    user = await db.debit_balance(target_id, amount, 'admin', f"admin:{message.from_user.id}")
+    if user is None:
+        user = await db.get_user(target_id, fresh=True)
+        await message.answer(f"❌ Недостаточно средств на балансе пользователя. Доступно: {money.fmt(user.balance)} USDT")
         return
-    update_balance(target_id, -amount)
-    await message.answer(f"✅ С баланса пользователя {target_id} списано {amount:.2f} USDT. Новый баланс: {current_balance - amount:.2f} USDT")
+    await message.answer(f"✅ С баланса пользователя {target_id} списано {money.fmt(amount)} USDT. Новый баланс: {money.fmt(user.balance)} USDT")
     try:
-        await bot.send_message(target_id, f"💰 Администратор списал с вашего баланса {amount:.2f} USDT.")
+        await bot.send_message(target_id, f"💰 Администратор списал с вашего баланса {money.fmt(amount)} USDT.")
     except:
         pass
 
@@ -386,7 +678,7 @@ async def cmd_addmoney(message: types.Message, command: CommandObject, **kwargs)
         await message.answer("Неверный формат. Нужно: /addmoney <сумма> <ID>")
         return
     try:
-        amount = float(parts[0])
+        amount = money.parse(parts[0])
         user_id = int(parts[1])
     except ValueError:
         await message.answer("Сумма должна быть числом, ID — целым числом.")
@@ -394,14 +686,117 @@ async def cmd_addmoney(message: types.Message, command: CommandObject, **kwargs)
     if amount <= 0:
         await message.answer("Сумма должна быть положительной.")
         return
-    get_user(user_id)
-    update_balance(user_id, amount)
-    await message.answer(f"✅ Добавлено {amount:.2f} USDT пользователю {user_id}.")
+    await db.get_user(user_id, fresh=True)
+    user = await db.update_balance(user_id, amount, 'admin', f"admin:{message.from_user.id}")
+    await message.answer(f"✅ Добавлено {money.fmt(amount)} USDT пользователю {user_id}. Новый баланс: {money.fmt(user.balance)} USDT")
     try:
-        await bot.send_message(user_id, f"💰 Вам начислено {amount:.2f} USDT администратором.")
+        await bot.send_message(user_id, f"💰 Вам начислено {money.fmt(amount)} USDT администратором.")
     except:
         pass
 
+@dp.message(Command("cachestats"))
+@subscription_required
+async def cmd_cachestats(message: types.Message, **kwargs):
+    if message.from_user.id not in config.ADMIN_IDS:
+        await message.answer("⛔ У вас нет прав администратора.")
+        return
+    lines = []
+    for title, stats in (("Кэш подписок", subscription_cache.stats()), ("Кэш пользователей", db.user_cache_stats())):
+        lines.append(
+            f"📊 <b>{title}</b>\n"
+            f"Записей: {stats['size']} / {stats['maxsize']}\n"
+            f"Попаданий: {stats['hits']}\n"
+            f"Промахов: {stats['misses']}\n"
+            f"Вытеснено: {stats['evictions']}\n"
+            f"Hit ratio: {stats['hit_ratio']:.1%}"
+        )
+    await message.answer("\n\n".join(lines))
+
+@dp.message(Command("withdrawals"))
+@subscription_required
+async def cmd_withdrawals(message: types.Message, **kwargs):
+    if message.from_user.id not in config.ADMIN_IDS:
+        await message.answer("⛔ У вас нет прав администратора.")
+        return
+    rows = await db.get_withdrawals('review', 20)
+    if not rows:
+        await message.answer("✅ Выводов на проверке нет.")
+        return
+    lines = [
+        f"#{withdrawal_id}: пользователь {user_id}, {money.fmt(amount)} USDT, {created_at[:16].replace('T', ' ')} — {error}"
+        for withdrawal_id, user_id, amount, _, _, _, error, created_at in rows
+    ]
+    await message.answer(
+        "⏳ <b>Выводы на проверке</b>\n" + "\n".join(lines) +
+        "\n\nПроверьте чеки в CryptoBot и закройте заявку: /resolve &lt;ID&gt; done | refund"
+    )
+
+@dp.message(Command("resolve"))
+@subscription_required
+async def cmd_resolve(message: types.Message, command: CommandObject, **kwargs):
+    if message.from_user.id not in config.ADMIN_IDS:
+        await message.answer("⛔ У вас нет прав администратора.")
+        return
+    parts = (command.args or "").split()
+    if len(parts) != 2 or not parts[0].isdigit() or parts[1] not in ("done", "refund"):
+        await message.answer("Использование: /resolve &lt;ID вывода&gt; done | refund")
+        return
+    withdrawal_id = int(parts[0])
+    status = 'done' if parts[1] == "done" else 'refunded'
+    row = await db.set_withdrawal_status(withdrawal_id, ('review',), status, error=f"решено администратором {message.from_user.id}")
+    if row is None:
+        await message.answer("❌ Заявка не найдена или уже не на проверке.")
+        return
+    user_id, amount = row
+    if status == 'done':
+        await message.answer(f"✅ Вывод #{withdrawal_id} отмечен выполненным.")
+    else:
+        await message.answer(f"✅ Вывод #{withdrawal_id} отменён, {money.fmt(amount)} USDT возвращены пользователю {user_id}.")
+        await notify_withdrawal(user_id, f"💰 Вывод #{withdrawal_id} отменён, {money.fmt(amount)} USDT возвращены на баланс.")
+
+@dp.message(Command("latency"))
+@subscription_required
+async def cmd_latency(message: types.Message, **kwargs):
+    if message.from_user.id not in config.ADMIN_IDS:
+        await message.answer("⛔ У вас нет прав администратора.")
+        return
+    latency = bet_latency.stats()
+    channel = publisher.stats()
+    await message.answer(
+        f"⏱ <b>Ставка → результат</b> (последние {latency['window']} из {latency['count']})\n"
+        f"p50: {latency['p50'] * 1000:.0f} мс\n"
+        f"p99: {latency['p99'] * 1000:.0f} мс\n"
+        f"max: {latency['max'] * 1000:.0f} мс\n\n"
+        f"📣 <b>Очередь канала</b>\n"
+        f"В очереди: {channel['depth']} (анонсы и кубики {channel['by_priority']['bet']}, "
+        f"результаты {channel['by_priority']['result']})\n"
+        f"Опубликовано: {channel['published']}\n"
+        f"Повторов после RetryAfter: {channel['retried']}\n"
+        f"Дайджестов: {channel['digests']} (анонсов в них: {channel['coalesced']})\n"
+        f"Ошибок: {channel['failed']}\n"
+        f"Отброшено: {channel['dropped']}"
+    )
+    flood = throttle.stats()
+    lines = [
+        f"🚦 <b>Антифлуд</b>: пользователей в обработке {flood['active_users']}, ждут {flood['waiting']}, "
+        f"ждали очереди {flood['queued']}",
+        f"Пропущено: {flood['passed']}",
+        f"Отброшено по лимиту: {flood['limited']}, по переполнению очереди: {flood['overflowed']}",
+        "",
+    ]
+    cryptobot = crypto.stats()
+    lines += [
+        f"💳 <b>CryptoBot</b>: автомат {cryptobot['breaker']}, срабатываний {cryptobot['trips']}, "
+        f"отклонено сразу {cryptobot['rejected']}"
+    ]
+    for method, stats in cryptobot['methods'].items():
+        errors = ", ".join(f"{name} {count}" for name, count in stats['errors'].items()) or "нет"
+        lines.append(
+            f"{method}: {stats['count']} вызовов, p50 {stats['p50'] * 1000:.0f} мс, "
+            f"p99 {stats['p99'] * 1000:.0f} мс; ошибки: {errors}"
+        )
+    await message.answer("\n".join(lines))
+
 @dp.message(Command("sendnote"))
 @subscription_required
 async def cmd_sendnote(message: types.Message, command: CommandObject, **kwargs):
@@ -412,29 +807,100 @@ async def cmd_sendnote(message: types.Message, command: CommandObject, **kwargs)
     if not text:
         await message.answer("❌ Укажите сообщение для рассылки.\nИспользование: /sendnote Текст сообщения")
         return
-    users = get_all_users()
-    if not users:
+    total = await db.count_reachable_users()
+    if not total:
         await message.answer("❌ Нет пользователей в базе.")
         return
-    sent = 0
-    failed = 0
-    await message.answer(f"📢 Начинаю рассылку... Всего пользователей: {len(users)}")
-    for uid in users:
-        try:
-            await bot.send_message(uid, f"📢 <b>Рассылка от администратора:</b>\n\n{text}")
-            sent += 1
-        except Exception as e:
-            failed += 1
-            print(f"Ошибка отправки пользователю {uid}: {e}")
-        await asyncio.sleep(0.05)
-    await message.answer(f"✅ Рассылка завершена.\nУспешно: {sent}\nНе удалось: {failed}")
+    status_message = await message.answer(f"📢 Начинаю рассылку... Всего пользователей: {total}")
+    job_id = await broadcasts.start(
+        f"📢 <b>Рассылка от администратора:</b>\n\n{text}",
+        admin_chat_id=message.chat.id,
+        status_message_id=status_message.message_id
+    )
+    await message.answer(f"Рассылка #{job_id} идёт в фоне. Пауза: /bcpause {job_id}, продолжить: /bcresume {job_id}")
+
+async def report_broadcast(job):
+    """Обновляет у админа сообщение с прогрессом рассылки (в том числе после перезапуска)."""
+    if not job.admin_chat_id or not job.status_message_id:
+        return
+    try:
+        await bot.edit_message_text(
+            job.progress_text(),
+            chat_id=job.admin_chat_id,
+            message_id=job.status_message_id
+        )
+    except TelegramBadRequest:
+        pass  # текст не изменился
+
+broadcasts = BroadcastEngine(bot, on_progress=report_broadcast)
+
+async def _broadcast_from_args(command: CommandObject):
+    """Строка рассылки по номеру из аргументов; без номера — последней незавершённой."""
+    args = (command.args or "").strip()
+    if args:
+        return await db.get_broadcast(int(args)) if args.isdigit() else None
+    rows = await db.get_unfinished_broadcasts()
+    return rows[-1] if rows else None
+
+@dp.message(Command("bcpause"))
+@subscription_required
+async def cmd_bcpause(message: types.Message, command: CommandObject, **kwargs):
+    if message.from_user.id not in config.ADMIN_IDS:
+        await message.answer("⛔ У вас нет прав администратора.")
+        return
+    row = await _broadcast_from_args(command)
+    if row is None:
+        await message.answer("❌ Рассылка не найдена.")
+        return
+    job_id, status = row[0], row[2]
+    if await broadcasts.pause(job_id):
+        await message.answer(f"⏸ Рассылка #{job_id} приостановлена.\n\n{progress_from_row(await db.get_broadcast(job_id))}")
+    else:
+        await message.answer(f"❌ Рассылка #{job_id} сейчас {STATUS_LABELS.get(status, status)}.")
+
+@dp.message(Command("bcresume"))
+@subscription_required
+async def cmd_bcresume(message: types.Message, command: CommandObject, **kwargs):
+    if message.from_user.id not in config.ADMIN_IDS:
+        await message.answer("⛔ У вас нет прав администратора.")
+        return
+    row = await _broadcast_from_args(command)
+    if row is None:
+        await message.answer("❌ Рассылка не найдена.")
+        return
+    job_id, status = row[0], row[2]
+    if await broadcasts.resume(job_id):
+        await message.answer(f"▶️ Рассылка #{job_id} продолжена.")
+    else:
+        await message.answer(f"❌ Рассылка #{job_id} сейчас {STATUS_LABELS.get(status, status)}.")
+
+@dp.message(Command("broadcasts"))
+@subscription_required
+async def cmd_broadcasts(message: types.Message, **kwargs):
+    if message.from_user.id not in config.ADMIN_IDS:
+        await message.answer("⛔ У вас нет прав администратора.")
+        return
+    rows = await db.get_broadcasts(10)
+    if not rows:
+        await message.answer("📢 Рассылок ещё не было.")
+        return
+    lines = ["📢 <b>Последние рассылки</b>"]
+    for job_id, _, status, _, _, total, sent, failed, blocked, unknown, created_at, _ in rows:
+        processed = sent + failed + blocked + unknown
+        lines.append(
+            f"#{job_id} — {STATUS_LABELS.get(status, status)}, {processed}/{total} "
+            f"(✅ {sent}, ❌ {failed}, 🚫 {blocked}"
+            + (f", ❔ {unknown}" if unknown else "")
+            + f") — {created_at[:16].replace('T', ' ')}"
+        )
+    await message.answer("\n".join(lines))
 
 # ========== ОБРАБОТЧИКИ КОЛЛБЭКОВ ==========
 @dp.callback_query(F.data == "back_to_main")
 @subscription_required
 async def back_to_main(callback: types.CallbackQuery, state: FSMContext, **kwargs):
     await state.clear()
-    await callback.message.edit_text("🎰 Главное меню:", reply_markup=main_keyboard())
+    await callback.message.edit_text("🎰 Главное меню:", reply_markup=MAIN_KEYBOARD)
     await callback.answer()
 
 @dp.callback_query(F.data == "profile")
@@ -446,32 +912,27 @@ async def show_profile(callback_or_message, **kwargs):
     else:
         user_id = callback_or_message.from_user.id
         message = callback_or_message
-    user = get_user(user_id)
+    user = await db.get_user(user_id, fresh=FRESH_BALANCE)
     text = (
         f"👤 <b>Ваш профиль</b>\n"
         f"ID: {user_id}\n"
-        f"💰 Баланс: <b>{user[1]:.2f} USDT</b>\n"
-        f"🎲 Всего игр: {user[2]}\n"
-        f"🏆 Побед: {user[3]}"
+        f"💰 Баланс: <b>{money.fmt(user.balance)} USDT</b>\n"
+        f"🎲 Всего игр: {user.total_bets}\n"
+        f"🏆 Побед: {user.total_wins}"
     )
     if isinstance(callback_or_message, types.CallbackQuery):
-        await message.edit_text(text, reply_markup=back_keyboard())
+        await message.edit_text(text, reply_markup=BACK_KEYBOARD)
         await callback_or_message.answer()
     else:
-        await message.answer(text, reply_markup=back_keyboard())
+        await message.answer(text, reply_markup=BACK_KEYBOARD)
 
 # --- ПОПОЛНЕНИЕ (общее меню) ---
 @dp.callback_query(F.data == "deposit")
 @subscription_required
 async def deposit(callback: types.CallbackQuery, **kwargs):
-    builder = InlineKeyboardBuilder()
-    builder.button(text="💎 Пополнить Stars", callback_data="deposit_stars")
-    builder.button(text="💳 Пополнить USDT (CryptoBot)", callback_data="deposit_usdt")
-    builder.button(text="🔙 Назад", callback_data="back_to_main")
-    builder.adjust(2, 1)
     await callback.message.edit_text(
         "💰 <b>Выберите способ пополнения:</b>",
-        reply_markup=builder.as_markup()
+        reply_markup=DEPOSIT_KEYBOARD
     )
     await callback.answer()
 
@@ -479,15 +940,9 @@ async def deposit(callback: types.CallbackQuery, **kwargs):
 @dp.callback_query(F.data == "deposit_usdt")
 @subscription_required
 async def deposit_usdt(callback: types.CallbackQuery, **kwargs):
-    builder = InlineKeyboardBuilder()
-    for amount in [5, 10, 25, 50, 100]:
-        builder.button(text=f"{amount} USDT", callback_data=f"deposit_{amount}")
-    builder.button(text="🔢 Другая сумма", callback_data="deposit_custom")
-    builder.button(text="🔙 Назад", callback_data="deposit")
-    builder.adjust(3, 2, 1, 1)
     await callback.message.edit_text(
         "💰 <b>Пополнение через CryptoBot</b>\n\nВыберите сумму в USDT или введите свою:",
-        reply_markup=builder.as_markup()
+        reply_markup=DEPOSIT_USDT_KEYBOARD
     )
     await callback.answer()
 
@@ -496,7 +951,7 @@ async def deposit_usdt(callback: types.CallbackQuery, **kwargs):
 async def deposit_custom(callback: types.CallbackQuery, state: FSMContext, **kwargs):
     await callback.message.edit_text(
         "💰 Введите сумму пополнения в USDT (минимум 1 USDT, целое число):",
-        reply_markup=back_keyboard()
+        reply_markup=BACK_KEYBOARD
     )
     await state.set_state(GameStates.waiting_deposit_custom)
     await callback.answer()
@@ -505,19 +960,19 @@ async def deposit_custom(callback: types.CallbackQuery, state: FSMContext, **kwa
 @subscription_required
 async def process_deposit_custom(message: types.Message, state: FSMContext, **kwargs):
     try:
-        amount = float(message.text)
+        amount = money.parse(message.text)
     except ValueError:
         await message.answer("❌ Введите число!")
         return
-    if amount < 1:
-        await message.answer("❌ Минимальная сумма пополнения 1 USDT")
+    if amount < MIN_PAYMENT:
+        await message.answer(f"❌ Минимальная сумма пополнения {money.fmt(MIN_PAYMENT)} USDT")
         return
-    if amount > 1000:
-        await message.answer("❌ Максимальная сумма пополнения 1000 USDT")
+    if amount > MAX_PAYMENT:
+        await message.answer(f"❌ Максимальная сумма пополнения {money.fmt(MAX_PAYMENT)} USDT")
         return
     await process_deposit_amount(message, state, amount)
 
-async def process_deposit_amount(event: types.CallbackQuery | types.Message, state: FSMContext, amount: float):
+async def process_deposit_amount(event: types.CallbackQuery | types.Message, state: FSMContext, amount: int):
     global crypto
     if isinstance(event, types.CallbackQuery):
         user_id = event.from_user.id
@@ -530,11 +985,12 @@ async def process_deposit_amount(event: types.CallbackQuery | types.Message, sta
 
     try:
         invoice = await crypto.create_invoice(
-            amount=amount,
+            amount=money.fmt(amount),
             currency_type='crypto',
             asset='USDT',
             description="Пополнение счёта в казино",
-            payload=str(user_id)
+            payload=str(user_id),
+            expires_in=config.INVOICE_TTL
         )
         if not invoice:
             raise Exception("Не удалось создать инвойс (пустой ответ)")
@@ -549,7 +1005,8 @@ async def process_deposit_amount(event: types.CallbackQuery | types.Message, sta
         if not pay_url:
             raise Exception(f"Не найдена ссылка на оплату в ответе: {invoice}")
 
-        save_invoice(invoice.invoice_id, user_id, amount)
+        await db.save_invoice(invoice.invoice_id, user_id, amount, expires_in=config.INVOICE_TTL)
+        invoice_created.set()
 
         markup = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="💳 Оплатить", url=pay_url)],
@@ -558,7 +1015,7 @@ async def process_deposit_amount(event: types.CallbackQuery | types.Message, sta
         ])
 
         success_text = (
-            f"💰 <b>Счёт на {amount} USDT создан!</b>\n\n"
+            f"💰 <b>Счёт на {money.fmt(amount)} USDT создан!</b>\n\n"
             f"1. Нажмите «Оплатить» и завершите платёж в CryptoBot.\n"
             f"2. После оплаты нажмите «✅ Я оплатил» для проверки.\n"
             f"Средства будут зачислены автоматически в течение минуты."
@@ -573,11 +1030,11 @@ async def process_deposit_amount(event: types.CallbackQuery | types.Message, sta
         error_text = f"❌ Ошибка создания счёта: {str(e)}"
         if is_callback:
             try:
-                await target_message.edit_text(error_text, reply_markup=back_keyboard())
+                await target_message.edit_text(error_text, reply_markup=BACK_KEYBOARD)
             except:
-                await target_message.answer(error_text, reply_markup=back_keyboard())
+                await target_message.answer(error_text, reply_markup=BACK_KEYBOARD)
         else:
-            await target_message.answer(error_text, reply_markup=back_keyboard())
+            await target_message.answer(error_text, reply_markup=BACK_KEYBOARD)
         print(f"Ошибка создания инвойса: {e}")
 
     if is_callback:
@@ -589,7 +1046,7 @@ async def process_deposit_amount(event: types.CallbackQuery | types.Message, sta
 @subscription_required
 async def deposit_button_handler(callback: types.CallbackQuery, **kwargs):
     parts = callback.data.split("_")
-    amount = float(parts[1])
+    amount = money.parse(parts[1])
     await process_deposit_amount(callback, None, amount)
 
 @dp.callback_query(F.data.startswith("check_invoice_"))
@@ -597,28 +1054,21 @@ async def deposit_button_handler(callback: types.CallbackQuery, **kwargs):
 async def check_invoice(callback: types.CallbackQuery, **kwargs):
     global crypto
     invoice_id = callback.data.replace("check_invoice_", "")
-    user_id = callback.from_user.id
     try:
         invoices = await crypto.get_invoices(invoice_ids=invoice_id)
         if invoices and invoices[0].status == 'paid':
-            conn = sqlite3.connect('casino.db')
-            cur = conn.cursor()
-            cur.execute("SELECT status FROM invoices WHERE invoice_id = ?", (invoice_id,))
-            row = cur.fetchone()
-            if row and row[0] == 'pending':
-                update_balance(user_id, invoices[0].amount)
-                cur.execute("UPDATE invoices SET status = 'paid' WHERE invoice_id = ?", (invoice_id,))
-                conn.commit()
+            paid = await db.mark_invoice_paid(invoice_id)
+            if paid:
+                DEPOSITS.inc("button")
                 await callback.message.edit_text(
-                    f"✅ Платёж подтверждён! Ваш баланс пополнен на {invoices[0].amount} USDT.",
-                    reply_markup=back_keyboard()
+                    f"✅ Платёж подтверждён! Ваш баланс пополнен на {money.fmt(paid[1])} USDT.",
+                    reply_markup=BACK_KEYBOARD
                 )
             else:
                 await callback.message.edit_text(
                     "✅ Этот платёж уже был обработан ранее.",
-                    reply_markup=back_keyboard()
+                    reply_markup=BACK_KEYBOARD
                 )
-            conn.close()
         else:
             await callback.answer("❌ Счёт ещё не оплачен. Попробуйте позже или проверьте статус в CryptoBot.", show_alert=True)
     except Exception as e:
@@ -636,7 +1086,7 @@ async def deposit_stars(callback: types.CallbackQuery, state: FSMContext, **kwar
         f"(= {config.MIN_STARS_DEPOSIT_CENTS * config.STARS_PER_CENT} звёзд)\n\n"
         f"Отправьте число — сколько центов хотите пополнить (целое число):\n"
         f"Например: 20",
-        reply_markup=back_keyboard()
+        reply_markup=BACK_KEYBOARD
     )
     await state.set_state(GameStates.waiting_stars_deposit)
     await callback.answer()
@@ -660,7 +1110,7 @@ async def process_stars_deposit(message: types.Message, state: FSMContext, **kwa
     prices = [LabeledPrice(label="Пополнение баланса казино", amount=stars)]
     await message.answer_invoice(
         title="Пополнение через ⭐️ Звёзды",
-        description=f"Пополнение баланса на {cents} центов (эквивалент {cents/100:.2f} USDT)",
+        description=f"Пополнение баланса на {cents} центов (эквивалент {money.fmt(money.from_cents(cents))} USDT)",
         prices=prices,
         provider_token="",
         payload=f"stars:{user_id}:{cents}",
@@ -676,15 +1126,19 @@ async def pre_checkout_handler(pre: PreCheckoutQuery):
 # --- Обработка успешного платежа ---
 @dp.message(F.successful_payment)
 async def successful_payment(message: types.Message):
-    payload = message.successful_payment.invoice_payload
+    payment = message.successful_payment
+    payload = payment.invoice_payload
     if payload.startswith("stars:"):
         parts = payload.split(":")
-        if len(parts) == 3:
+        if len(parts) == 3 and payment.currency == "XTR" and payment.total_amount == int(parts[2]) * config.STARS_PER_CENT:
             user_id = int(parts[1])
-            cents = int(parts[2])
-            amount_usd = cents / 100.0
-            update_balance(user_id, amount_usd)
-            await message.answer(f"✅ Баланс пополнен на {amount_usd:.2f} USDT через звёзды.")
+            amount = money.from_cents(int(parts[2]))
+            # Telegram может прислать successful_payment повторно — зачисляем по charge_id один раз
+            if await db.credit_payment('stars', payment.telegram_payment_charge_id, user_id, amount):
+                DEPOSITS.inc("stars")
+                await message.answer(f"✅ Баланс пополнен на {money.fmt(amount)} USDT через звёзды.")
+            else:
+                await message.answer("✅ Этот платёж уже был зачислен ранее.")
             return
     await message.answer("❌ Не удалось обработать платёж. Обратитесь в поддержку.")
 
@@ -692,13 +1146,13 @@ async def successful_payment(message: types.Message):
 @dp.callback_query(F.data == "withdraw")
 @subscription_required
 async def withdraw(callback: types.CallbackQuery, state: FSMContext, **kwargs):
-    user = get_user(callback.from_user.id)
-    if user[1] <= 0:
+    user = await db.get_user(callback.from_user.id, fresh=FRESH_BALANCE)
+    if user.balance <= 0:
         await callback.answer("❌ У вас нет средств для вывода!", show_alert=True)
         return
     await callback.message.edit_text(
         "💸 <b>Вывод средств</b>\n\nВведите сумму в USDT (минимум 1, целое число):",
-        reply_markup=back_keyboard()
+        reply_markup=BACK_KEYBOARD
     )
     await state.set_state(GameStates.waiting_withdraw)
     await callback.answer()
@@ -706,71 +1160,64 @@ async def withdraw(callback: types.CallbackQuery, state: FSMContext, **kwargs):
 @dp.message(GameStates.waiting_withdraw)
 @subscription_required
 async def process_withdraw(message: types.Message, state: FSMContext, **kwargs):
-    global crypto
     try:
-        amount = float(message.text)
+        amount = money.parse(message.text)
     except ValueError:
         await message.answer("❌ Введите число!")
         return
-    if amount < 1:
-        await message.answer("❌ Минимальная сумма вывода 1 USDT")
+    if amount < MIN_PAYMENT:
+        await message.answer(f"❌ Минимальная сумма вывода {money.fmt(MIN_PAYMENT)} USDT")
         return
-    if amount > 1000:
-        await message.answer("❌ Максимальная сумма вывода 1000 USDT")
+    if amount > MAX_PAYMENT:
+        await message.answer(f"❌ Максимальная сумма вывода {money.fmt(MAX_PAYMENT)} USDT")
         return
-    user = get_user(message.from_user.id)
-    if user[1] < amount:
+    await state.clear()
+    # Сумма списывается сразу, чек создаёт воркер выводов
+    withdrawal_id = await db.reserve_withdrawal(message.from_user.id, amount)
+    if withdrawal_id is None:
         await message.answer("❌ Недостаточно средств!")
-        await state.clear()
         return
-    try:
-        check = await crypto.create_check(
-            asset='USDT',
-            amount=amount,
-            pin_to_user_id=message.from_user.id
-        )
-        check_url = (
-            getattr(check, 'bot_check_url', None) or
-            getattr(check, 'web_app_check_url', None) or
-            getattr(check, 'mini_app_check_url', None) or
-            getattr(check, 'pay_url', None) or
-            getattr(check, 'url', None)
-        )
-        if not check_url:
-            raise Exception("Не удалось получить ссылку на чек")
-        update_balance(message.from_user.id, -amount)
-        markup = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="💸 Получить чек", url=check_url)]
-        ])
+    withdrawal_requested.set()
+    await message.answer(
+        f"✅ Заявка #{withdrawal_id} на вывод {money.fmt(amount)} USDT принята.\n"
+        f"Чек CryptoBot придёт сюда в течение минуты."
+    )
+
+# --- ИГРЫ (с корректной фильтрацией) ---
+async def show_fair_commitment(message: types.Message):
+    """Первая честная ставка игрока: сначала хэш его server seed, потом бросок."""
+    committed = await fair.commitment(message.from_user.id)
+    if committed is not None:
         await message.answer(
-            f"✅ Чек на {amount:.2f} USDT создан!\nНажмите кнопку ниже, чтобы активировать его в CryptoBot.",
-            reply_markup=markup
+            f"🔐 Ваши ставки бросаются по сиду с SHA-256 <code>{committed[0]}</code> "
+            f"и client seed <code>{committed[1]}</code>. Сам сид раскроется по /fair new."
         )
-    except Exception as e:
-        await message.answer(f"❌ Ошибка создания чека: {e}")
-        update_balance(message.from_user.id, amount)
-    finally:
-        await state.clear()
 
-# --- ИГРЫ (с корректной фильтрацией) ---
-def football_is_goal(value: int) -> bool:
-    return value in (3, 4, 5)
+async def roll_outcome(user_id: int, emoji: str, count: int):
+    """Бросает count кубиков движком config.OUTCOME_ENGINE.
 
-def basketball_is_goal(value: int) -> bool:
-    return value in (4, 5)
+    Возвращает (значения, id сообщения в канале для ответа с результатом, доказательство).
+    'dice' — анимации send_dice в канале, 'fair' — локальный provably fair без запросов к API.
+    """
+    if config.OUTCOME_ENGINE == "fair":
+        values, proof = await fair.roll_for(user_id, emoji, count)
+        return values, None, proof
+    # Ставка ждёт кубики не дольше CHANNEL_DICE_TIMEOUT, иначе TimeoutError и возврат
+    dice = await publisher.call_many([(roll_dice, (emoji,))] * count, timeout=config.CHANNEL_DICE_TIMEOUT)
+    return [msg.dice.value for msg in dice], dice[0].message_id, None
 
 @dp.callback_query(F.data == "play_menu")
 @subscription_required
 async def play_menu(callback: types.CallbackQuery, state: FSMContext, **kwargs):
     await state.set_state(GameStates.choosing_game)
-    await callback.message.edit_text("🎮 Выберите игру:", reply_markup=play_menu_keyboard())
+    await callback.message.edit_text("🎮 Выберите игру:", reply_markup=PLAY_MENU_KEYBOARD)
     await callback.answer()
 
 @dp.callback_query(F.data == "game_dice", GameStates.choosing_game)
 @subscription_required
 async def choose_dice(callback: types.CallbackQuery, state: FSMContext, **kwargs):
     await state.set_state(GameStates.choosing_dice_type)
-    await callback.message.edit_text("🎲 Выберите тип игры в кости:", reply_markup=dice_type_keyboard())
+    await callback.message.edit_text("🎲 Выберите тип игры в кости:", reply_markup=DICE_TYPE_KEYBOARD)
     await callback.answer()
 
 # Обработчики для обычных игр в кости (кроме дуэли)
@@ -781,15 +1228,15 @@ async def choose_dice_type(callback: types.CallbackQuery, state: FSMContext, **k
     if game_type == "dice_duel":
         await callback.message.edit_text(
             "⚔️ Выберите условие победы над ботом:",
-            reply_markup=duel_choice_keyboard()
+            reply_markup=DUEL_CHOICE_KEYBOARD
         )
         await state.set_state(GameStates.choosing_dice_type)
         await callback.answer()
         return
-    await state.update_data(game=game_type, emoji="🎲", duel=False)
+    await state.update_data(game=game_type)
     await callback.message.edit_text(
         f"🎲 Введите сумму ставки (мин. {config.MIN_BET} USDT, макс. {config.MAX_BET}):",
-        reply_markup=back_keyboard()
+        reply_markup=BET_KEYBOARD
     )
     await state.set_state(GameStates.waiting_bet)
     await callback.answer()
@@ -799,10 +1246,10 @@ async def choose_dice_type(callback: types.CallbackQuery, state: FSMContext, **k
 @subscription_required
 async def choose_duel_direction(callback: types.CallbackQuery, state: FSMContext, **kwargs):
     direction = callback.data
-    await state.update_data(game=direction, emoji="🎲", duel=True)
+    await state.update_data(game=direction)
     await callback.message.edit_text(
         f"⚔️ Введите сумму ставки на дуэль (мин. {config.MIN_BET} USDT, макс. {config.MAX_BET}):",
-        reply_markup=back_keyboard()
+        reply_markup=BET_KEYBOARD
     )
     await state.set_state(GameStates.waiting_bet)
     await callback.answer()
@@ -810,22 +1257,17 @@ async def choose_duel_direction(callback: types.CallbackQuery, state: FSMContext
 @dp.callback_query(F.data == "game_football", GameStates.choosing_game)
 @subscription_required
 async def choose_football(callback: types.CallbackQuery, state: FSMContext, **kwargs):
-    builder = InlineKeyboardBuilder()
-    builder.button(text="⚽ Гол (x1.2)", callback_data="football_goal")
-    builder.button(text="🥅 Промах (x1.7)", callback_data="football_miss")
-    builder.button(text="🔙 Назад", callback_data="play_menu")
-    builder.adjust(2, 1)
-    await callback.message.edit_text("⚽ На что ставим?", reply_markup=builder.as_markup())
+    await callback.message.edit_text("⚽ На что ставим?", reply_markup=FOOTBALL_KEYBOARD)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("football_"))
 @subscription_required
 async def choose_football_outcome(callback: types.CallbackQuery, state: FSMContext, **kwargs):
     outcome = callback.data
-    await state.update_data(game=outcome, emoji="⚽", duel=False)
+    await state.update_data(game=outcome)
     await callback.message.edit_text(
         f"⚽ Введите сумму ставки (мин. {config.MIN_BET} USDT, макс. {config.MAX_BET}):",
-        reply_markup=back_keyboard()
+        reply_markup=BET_KEYBOARD
     )
     await state.set_state(GameStates.waiting_bet)
     await callback.answer()
@@ -833,22 +1275,17 @@ async def choose_football_outcome(callback: types.CallbackQuery, state: FSMConte
 @dp.callback_query(F.data == "game_basketball", GameStates.choosing_game)
 @subscription_required
 async def choose_basketball(callback: types.CallbackQuery, state: FSMContext, **kwargs):
-    builder = InlineKeyboardBuilder()
-    builder.button(text="🏀 Попадание (x1.2)", callback_data="basketball_goal")
-    builder.button(text="🧱 Промах (x1.7)", callback_data="basketball_miss")
-    builder.button(text="🔙 Назад", callback_data="play_menu")
-    builder.adjust(2, 1)
-    await callback.message.edit_text("🏀 На что ставим?", reply_markup=builder.as_markup())
+    await callback.message.edit_text("🏀 На что ставим?", reply_markup=BASKETBALL_KEYBOARD)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("basketball_"))
 @subscription_required
 async def choose_basketball_outcome(callback: types.CallbackQuery, state: FSMContext, **kwargs):
     outcome = callback.data
-    await state.update_data(game=outcome, emoji="🏀", duel=False)
+    await state.update_data(game=outcome)
     await callback.message.edit_text(
         f"🏀 Введите сумму ставки (мин. {config.MIN_BET} USDT, макс. {config.MAX_BET}):",
-        reply_markup=back_keyboard()
+        reply_markup=BET_KEYBOARD
     )
     await state.set_state(GameStates.waiting_bet)
     await callback.answer()
@@ -856,153 +1293,328 @@ async def choose_basketball_outcome(callback: types.CallbackQuery, state: FSMCon
 @dp.message(GameStates.waiting_bet)
 @subscription_required
 async def process_bet(message: types.Message, state: FSMContext, **kwargs):
+    started = time.perf_counter()
     try:
-        bet = float(message.text)
+        bet = money.parse(message.text)
     except ValueError:
         await message.answer("❌ Введите число!")
         return
-    if bet < config.MIN_BET:
+    if bet < MIN_BET:
         await message.answer(f"❌ Минимальная ставка {config.MIN_BET} USDT")
         return
-    if bet > config.MAX_BET:
+    if bet > MAX_BET:
         await message.answer(f"❌ Максимальная ставка {config.MAX_BET} USDT")
         return
 
-    user = get_user(message.from_user.id)
-    if user[1] < bet:
+    data = await state.get_data()
+    game = GAMES.get(data.get('game'))
+    if game is None:
+        await state.clear()
+        await message.answer("Выберите игру:", reply_markup=MAIN_KEYBOARD)
+        return
+
+    if config.OUTCOME_ENGINE == "fair":
+        await show_fair_commitment(message)
+    bet_id = await db.reserve_bet(message.from_user.id, game.key, bet, game.coef)
+    if bet_id is None:
         await message.answer("❌ Недостаточно средств!")
         await state.clear()
         return
 
-    update_balance(message.from_user.id, -bet)
+    send_to_channel(game.emoji, message.from_user.full_name, bet, game.name, game.coef)
 
-    data = await state.get_data()
-    game = data['game']
-    emoji = data['emoji']
-    duel = data.get('duel', False)
+    # Несыгранная ставка возвращается при любом выходе, в том числе при отмене
+    # ожидающего броска (publisher.stop() при остановке бота отменяет очередь)
+    settled = False
+    try:
+        try:
+            values, result_msg_id, proof = await roll_outcome(message.from_user.id, game.emoji, game.dice)
+        except (asyncio.QueueFull, TimeoutError):
+            await message.answer("⏳ Канал сейчас перегружен, ставка возвращена. Попробуйте через минуту.")
+            await state.clear()
+            return
+        except Exception as e:
+            await message.answer("❌ Ошибка отправки игры в канал. Проверьте права бота.")
+            await state.clear()
+            return
 
-    if duel:
-        coef = config.COEF.get('dice_over_under', 1.7)
-    else:
-        coef = config.COEF.get(game, 1.0)
-
-    game_names = {
-        'dice_over': 'Кости: больше 3.5',
-        'dice_under': 'Кости: меньше 3.5',
-        'dice_even': 'Кости: четное',
-        'dice_odd': 'Кости: нечетное',
-        'football_goal': 'Футбол: гол',
-        'football_miss': 'Футбол: промах',
-        'basketball_goal': 'Баскетбол: попадание',
-        'basketball_miss': 'Баскетбол: промах',
-    }
-
-    if duel:
-        if game == 'duel_over':
-            game_name = "Дуэль: больше (против бота)"
+        win, result_text = game.results[tuple(values)]
+        win_amount = 0
+        if win:
+            win_amount = money.multiply(bet, game.coef)
+            user_result = f"✅ {result_text}\n💰 Вы выиграли {money.fmt(win_amount)} USDT!"
         else:
-            game_name = "Дуэль: меньше (против бота)"
-    else:
-        game_name = game_names.get(game, game)
+            user_result = f"❌ {result_text}\n💸 Вы проиграли {money.fmt(bet)} USDT."
+        if proof is not None:
+            user_result += f"\n🔐 Ставка #{proof.rsplit(':', 1)[1]} по сиду {proof[:12]}… — проверка: /fair"
+        applied = await db.settle_bet(bet_id, win, win_amount, proof)
+        settled = True
+        if not applied:
+            # Ставку уже вернул recover_bets (бросок шёл дольше BET_RECOVER_AFTER)
+            await message.answer("↩️ Ставка не успела сыграть и возвращена на баланс.")
+            await state.clear()
+            return
+    finally:
+        if not settled:
+            await asyncio.shield(db.refund_bet(bet_id))
 
-    await send_to_channel(emoji, message.from_user.full_name, bet, game_name, coef)
+    await message.answer(user_result)
+    elapsed = time.perf_counter() - started
+    bet_latency.observe(elapsed)
+    BET_SECONDS.observe(elapsed)
+
+    publisher.publish(send_result_to_channel, result_msg_id, message.from_user.full_name, result_text, win_amount, win,
+                      priority=PRIORITY_RESULT)
+
+    await state.clear()
+    await message.answer("Выберите действие:", reply_markup=MAIN_KEYBOARD)
 
+# --- Автоставка: серия одинаковых ставок с лимитами ---
+@dp.callback_query(F.data == "autobet", GameStates.waiting_bet)
+@subscription_required
+async def choose_autobet(callback: types.CallbackQuery, state: FSMContext, **kwargs):
+    await state.set_state(GameStates.waiting_autobet)
+    await callback.message.edit_text(
+        f"🔁 <b>Автоставка</b>\n"
+        f"Введите через пробел: раунды, ставку, стоп-лосс и тейк-профит (последние два необязательны, 0 — без лимита).\n"
+        f"Например: <code>20 0.5 5 10</code> — 20 раундов по 0.5 USDT, стоп при проигрыше 5 или выигрыше 10 USDT.\n"
+        f"Раундов до {config.AUTOBET_MAX_ROUNDS}, ставка от {config.MIN_BET} до {config.MAX_BET} USDT.",
+        reply_markup=BACK_KEYBOARD
+    )
+    await callback.answer()
+
+@dp.message(GameStates.waiting_autobet)
+@subscription_required
+async def process_autobet(message: types.Message, state: FSMContext, **kwargs):
     try:
-        if duel:
-            dice_msg1 = await bot.send_dice(config.CHANNEL_ID, emoji=emoji)
-            dice_msg2 = await bot.send_dice(config.CHANNEL_ID, emoji=emoji)
-            user_value = dice_msg1.dice.value
-            bot_value = dice_msg2.dice.value
-            if game == 'duel_over':
-                win = user_value > bot_value
-                result_text = f"Ваш кубик: {user_value}, кубик бота: {bot_value}"
-            else:
-                win = user_value < bot_value
-                result_text = f"Ваш кубик: {user_value}, кубик бота: {bot_value}"
-            if user_value == bot_value:
-                win = False
-                result_text += " — ничья, вы проиграли."
-            else:
-                result_text += f" — {'вы победили' if win else 'вы проиграли'}."
-        else:
-            dice_msg = await bot.send_dice(config.CHANNEL_ID, emoji=emoji)
-            dice_value = dice_msg.dice.value
-            win = False
-            result_text = ""
-            if game.startswith('dice_'):
-                if game == 'dice_over':
-                    win = dice_value > 3.5
-                    result_text = f"Выпало {dice_value} {'(больше 3.5)' if win else '(меньше или равно 3.5)'}"
-                elif game == 'dice_under':
-                    win = dice_value < 3.5
-                    result_text = f"Выпало {dice_value} {'(меньше 3.5)' if win else '(больше или равно 3.5)'}"
-                elif game == 'dice_even':
-                    win = dice_value % 2 == 0
-                    result_text = f"Выпало {dice_value} {'(четное)' if win else '(нечетное)'}"
-                elif game == 'dice_odd':
-                    win = dice_value % 2 != 0
-                    result_text = f"Выпало {dice_value} {'(нечетное)' if win else '(четное)'}"
-            elif game.startswith('football_'):
-                is_goal = football_is_goal(dice_value)
-                if game == 'football_goal':
-                    win = is_goal
-                else:
-                    win = not is_goal
-                result_text = f"{'ГОЛ' if is_goal else 'ПРОМАХ'} (выпало {dice_value})"
-            elif game.startswith('basketball_'):
-                is_goal = basketball_is_goal(dice_value)
-                if game == 'basketball_goal':
-                    win = is_goal
-                else:
-                    win = not is_goal
-                result_text = f"{'ПОПАДАНИЕ' if is_goal else 'ПРОМАХ'} (выпало {dice_value})"
-    except Exception as e:
-        await message.answer("❌ Ошибка отправки игры в канал. Проверьте права бота.")
-        update_balance(message.from_user.id, bet)
-        await state.clear()
+        parts = message.text.split()
+        if not 2 <= len(parts) <= 4:
+            raise ValueError
+        rounds = int(parts[0])
+        bet = money.parse(parts[1])
+        stop_loss = money.parse(parts[2]) if len(parts) > 2 else 0
+        take_profit = money.parse(parts[3]) if len(parts) > 3 else 0
+    except (ValueError, AttributeError):
+        await message.answer("❌ Формат: <code>раунды ставка [стоп-лосс] [тейк-профит]</code>")
+        return
+    if not 1 <= rounds <= config.AUTOBET_MAX_ROUNDS:
+        await message.answer(f"❌ Раундов: от 1 до {config.AUTOBET_MAX_ROUNDS}")
+        return
+    if not MIN_BET <= bet <= MAX_BET:
+        await message.answer(f"❌ Ставка: от {config.MIN_BET} до {config.MAX_BET} USDT")
+        return
+    if stop_loss < 0 or take_profit < 0:
+        await message.answer("❌ Лимиты не могут быть отрицательными")
         return
 
-    win_amount = 0
-    if win:
-        win_amount = bet * coef
-        update_balance(message.from_user.id, win_amount)
-        user_result = f"✅ {result_text}\n💰 Вы выиграли {win_amount:.2f} USDT!"
-    else:
-        user_result = f"❌ {result_text}\n💸 Вы проиграли {bet:.2f} USDT."
+    data = await state.get_data()
+    game = GAMES.get(data.get('game'))
+    if game is None:
+        await state.clear()
+        await message.answer("Выберите игру:", reply_markup=MAIN_KEYBOARD)
+        return
 
-    await message.answer(user_result)
+    user_id = message.from_user.id
+    await show_fair_commitment(message)
+    bet_ids = await db.reserve_series(user_id, game.key, bet, game.coef, rounds)
+    if bet_ids is None:
+        await message.answer(f"❌ Недостаточно средств: на серию нужно {money.fmt(bet * rounds)} USDT")
+        await state.clear()
+        return
 
-    if duel:
-        await send_result_to_channel(dice_msg1.message_id, message.from_user.full_name, result_text, win_amount, win)
-    else:
-        await send_result_to_channel(dice_msg.message_id, message.from_user.full_name, result_text, win_amount, win)
+    try:
+        # Серия всегда бросается локально (provably fair) при любом OUTCOME_ENGINE: десятки
+        # send_dice заняли бы канал на минуты, в канал уходит только итог серии
+        rolls = await fair.roll_series(user_id, game.emoji, game.dice, rounds)
+    except Exception as e:
+        print(f"Ошибка автоставки: {e}")
+        await db.settle_series(user_id, [(bet_id, 'refunded', 0, None) for bet_id in bet_ids])
+        await message.answer("❌ Не удалось провести серию, ставки возвращены.")
+        await state.clear()
+        return
 
-    update_stats(message.from_user.id, win)
+    # Раунды считаются по порядку; после срабатывания лимита остальные возвращаются
+    results = []
+    marks = []
+    net = 0
+    wins = 0
+    stopped = None
+    for bet_id, (values, proof) in zip(bet_ids, rolls):
+        if stopped:
+            results.append((bet_id, 'refunded', 0, None))
+            continue
+        win, _ = game.results[tuple(values)]
+        payout = money.multiply(bet, game.coef) if win else 0
+        net += payout - bet
+        wins += win
+        marks.append("✅" if win else "❌")
+        results.append((bet_id, 'won' if win else 'lost', payout, proof))
+        if stop_loss and -net >= stop_loss:
+            stopped = "стоп-лосс"
+        elif take_profit and net >= take_profit:
+            stopped = "тейк-профит"
+    await db.settle_series(user_id, results)
+
+    played = len(marks)
+    summary = (
+        f"{game.name}\n"
+        f"Сыграно: {played} из {rounds} по {money.fmt(bet)} USDT"
+        + (f" (сработал {stopped})" if stopped else "") + "\n"
+        f"Выигрышей: {wins}\n"
+        f"Итог: <b>{'+' if net >= 0 else ''}{money.fmt(net)} USDT</b>"
+    )
+    await message.answer(f"🔁 <b>Автоставка</b>: {summary}\n{''.join(marks)}")
+    publisher.publish(send_series_to_channel, message.from_user.full_name, summary, priority=PRIORITY_RESULT)
     await state.clear()
-    await message.answer("Выберите действие:", reply_markup=main_keyboard())
+    await message.answer("Выберите действие:", reply_markup=MAIN_KEYBOARD)
 
 # --- Обработчик кнопки "ПРОВЕРИТЬ ПОДПИСКУ" ---
 @dp.callback_query(F.data == "check_sub")
 async def check_subscription_callback(callback: types.CallbackQuery, state: FSMContext, **kwargs):
     user_id = callback.from_user.id
-    if await check_subscription(user_id):
-        get_user(user_id)
+    if await check_subscription(user_id, use_cache=False):
+        await db.get_user(user_id)
         await callback.message.edit_text(
             f"✅ Подписка подтверждена! Добро пожаловать в казино!",
-            reply_markup=main_keyboard()
+            reply_markup=MAIN_KEYBOARD
         )
         await callback.answer()
     else:
         await callback.answer("❌ Вы ещё не подписались. Подпишитесь и нажмите снова.", show_alert=True)
 
+# ========== МЕТРИКИ ==========
+# Хендлеры и вызовы Bot API замеряются middleware, CryptoBot и db.py — у себя.
+# Остальное уже считается в своих объектах и читается при опросе /metrics.
+handler_metrics = HandlerMetricsMiddleware()
+for observer_name, observer in dp.observers.items():
+    if observer_name != "update":
+        observer.middleware(handler_metrics)
+bot.session.middleware(BotApiMetricsMiddleware())
+
+def _cache_metrics(key: str) -> dict:
+    return {("subscription",): subscription_cache.stats()[key], ("users",): db.user_cache_stats()[key]}
+
+metrics.Gauge("casino_fsm_users", "Пользователи в состоянии FSM", ("state",), collect=lambda: state_counts(storage))
+metrics.Gauge("casino_invoices_pending", "Неоплаченные инвойсы CryptoBot", collect=db.count_pending_invoices)
+metrics.Gauge("casino_withdrawals", "Заявки на вывод по статусам", ("status",), collect=db.count_withdrawals)
+metrics.Gauge("casino_queue_depth", "Глубина очередей процесса", ("queue",), collect=lambda: {
+    "channel": publisher.depth,
+    "db_writes": db.write_queue_depth(),
+    "throttle": throttle.stats()["waiting"],
+})
+metrics.Counter("casino_channel_posts_total", "Посты в канал по исходу", ("result",), collect=lambda: {
+    "published": publisher.published, "failed": publisher.failed, "dropped": publisher.dropped,
+})
+metrics.Counter("casino_throttle_passed_total", "Апдейты, пропущенные антифлудом", ("action",),
+                collect=lambda: dict(throttle.passed))
+metrics.Counter("casino_throttle_limited_total", "Апдейты, отброшенные по лимиту", ("action",),
+                collect=lambda: dict(throttle.limited))
+metrics.Counter("casino_throttle_overflowed_total", "Апдейты, отброшенные по переполнению очереди",
+                collect=lambda: throttle.overflowed)
+metrics.Counter("casino_cache_hits_total", "Попадания в кэш", ("cache",), collect=lambda: _cache_metrics("hits"))
+metrics.Counter("casino_cache_misses_total", "Промахи кэша", ("cache",), collect=lambda: _cache_metrics("misses"))
+metrics.Gauge("casino_cache_size", "Записей в кэше", ("cache",), collect=lambda: _cache_metrics("size"))
+metrics.Gauge("casino_cryptobot_breaker_open", "Автомат CryptoBot разомкнут (1) или закрыт (0)",
+              collect=lambda: int(crypto is not None and crypto.breaker.state != "closed"))
+metrics.Counter("casino_cryptobot_breaker_trips_total", "Срабатывания автомата CryptoBot",
+                collect=lambda: crypto.breaker.trips if crypto is not None else 0)
+metrics.Counter("casino_cryptobot_rejected_total", "Запросы, отклонённые автоматом без обращения к API",
+                collect=lambda: crypto.rejected if crypto is not None else 0)
+
 # ========== ЗАПУСК ==========
+# Фоновые задачи, которые должны работать ровно в одном процессе: в режиме
+# polling это сам процесс, в режиме вебхука — воркер-лидер.
+background_tasks = []
+cryptobot_webhook_runner = None
+
+async def start_background_jobs():
+    global cryptobot_webhook_runner
+    if config.CRYPTOBOT_WEBHOOK_ENABLED:
+        cryptobot_webhook_runner = await start_webhook_server(on_invoice_paid)
+        print(f"Вебхук CryptoBot слушает :{config.CRYPTOBOT_WEBHOOK_PORT}{config.CRYPTOBOT_WEBHOOK_PATH}")
+    background_tasks.append(asyncio.create_task(
+        check_invoices_background(reconcile_only=config.CRYPTOBOT_WEBHOOK_ENABLED)
+    ))
+    background_tasks.append(asyncio.create_task(ledger_snapshot_background()))
+    background_tasks.append(asyncio.create_task(withdrawals_background()))
+    background_tasks.append(asyncio.create_task(stale_bets_background()))
+    if isinstance(storage, SQLiteStorage):
+        background_tasks.append(asyncio.create_task(storage.purge_loop()))
+    resumed = await broadcasts.activate()
+    if resumed:
+        print(f"Возобновлено рассылок: {resumed}")
+
+async def stop_background_jobs():
+    global cryptobot_webhook_runner
+    await broadcasts.stop()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    if cryptobot_webhook_runner is not None:
+        await cryptobot_webhook_runner.cleanup()
+        cryptobot_webhook_runner = None
+
+async def start_metrics_server(port: int):
+    if not config.METRICS_ENABLED:
+        return None
+    try:
+        runner = await metrics.start_server(config.METRICS_HOST, port)
+    except OSError as e:
+        # Порт занят (второй экземпляр, другой экспортер): бот работает и без метрик
+        print(f"Метрики не запущены на {config.METRICS_HOST}:{port}: {e}")
+        return None
+    print(f"Метрики: http://{config.METRICS_HOST}:{port}/metrics")
+    return runner
+
 async def main():
     global crypto
-    crypto = AioCryptoPay(token=config.API_CRYPTOBOT, network=Networks.MAIN_NET)
+    crypto = CryptoBotClient()
     print("Бот запущен...")
-    init_db()
-    asyncio.create_task(check_invoices_background())
-    await dp.start_polling(bot)
+    await db.init_db()
+    await recover_bets()
+    publisher.start()
+    metrics_runner = await start_metrics_server(config.METRICS_PORT)
+    await start_background_jobs()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await stop_background_jobs()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await publisher.stop()
+        await crypto.close()
+        await db.close_db()
+
+async def worker_main(index: int, updates, processed):
+    """Воркер режима вебхука: обрабатывает свою долю апдейтов, лидер ещё и фоновые задачи."""
+    global crypto
+    crypto = CryptoBotClient()
+    await db.init_db()
+    await recover_bets()
+    publisher.start()
+    metrics_runner = await start_metrics_server(config.METRICS_PORT + index)
+    leader = LeaderElection("background", on_elected=start_background_jobs, on_lost=stop_background_jobs)
+    leader_task = asyncio.create_task(leader.run())
+    print(f"Воркер {index} запущен")
+    try:
+        await consume(updates, lambda update: dp.feed_raw_update(bot, update), processed, index)
+    finally:
+        leader_task.cancel()
+        await leader.release()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await publisher.stop()
+        await dp.storage.close()
+        await bot.session.close()
+        await crypto.close()
+        await db.close_db()
+
+def run_worker(index: int, updates, processed):
+    asyncio.run(worker_main(index, updates, processed))
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if config.RUN_MODE == "webhook":
+        serve(run_worker, dp.resolve_used_update_types())
+    else:
+        asyncio.run(main())
@@ -0,0 +1,76 @@
+# media.py
+import os
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import FSInputFile, Message
+
+import db
+
+# Ответы Bot API, после которых сохранённый file_id бесполезен (нижний регистр)
+FILE_ID_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "wrong file_id",
+    "file reference expired",
+    "file_reference_expired",
+    "type of file mismatch",
+    "can't use file of type",
+)
+
+
+class CachedPhoto:
+    """Картинка, загруженная в Telegram один раз и дальше отправляемая по file_id.
+
+    file_id хранится в таблице settings, так что переживает перезапуск и общий
+    для всех воркеров. Для загрузки берётся локальный файл, если он есть, иначе
+    URL. Если Telegram отверг сохранённый file_id (FILE_ID_ERRORS), картинка
+    загружается заново; прочие ошибки отправки пробрасываются как есть.
+    """
+
+    def __init__(self, name: str, url: str = None, path: str = None):
+        self.name = name
+        self.url = url
+        self.path = path
+        self.setting_key = f"file_id:{name}"
+        self.file_id = None
+        self.uploads = 0
+
+    def _sources(self):
+        if self.path and os.path.isfile(self.path):
+            yield FSInputFile(self.path)
+        if self.url:
+            yield self.url
+
+    async def _upload(self, bot: Bot, chat_id: int, **kwargs) -> Message:
+        error = None
+        for source in self._sources():
+            try:
+                message = await bot.send_photo(chat_id, photo=source, **kwargs)
+            except TelegramRetryAfter:
+                raise
+            except Exception as e:
+                error = e
+                continue
+            self.file_id = message.photo[-1].file_id
+            self.uploads += 1
+            await db.set_setting(self.setting_key, self.file_id)
+            return message
+        raise error or FileNotFoundError(f"Нет источника для картинки {self.name}")
+
+    async def send(self, bot: Bot, chat_id: int, **kwargs) -> Message:
+        """send_photo с этой картинкой; kwargs — остальные параметры send_photo."""
+        if self.file_id is None:
+            self.file_id = await db.get_setting(self.setting_key)
+        file_id = self.file_id
+        if file_id:
+            try:
+                return await bot.send_photo(chat_id, photo=file_id, **kwargs)
+            except TelegramBadRequest as e:
+                if not any(error in e.message.lower() for error in FILE_ID_ERRORS):
+                    raise
+                print(f"file_id картинки {self.name} больше не действует ({e.message}), загружаю заново")
+                self.file_id = None
+                # Другой воркер мог уже сохранить новый file_id — его не трогаем
+                await db.delete_setting(self.setting_key, file_id)
+        return await self._upload(bot, chat_id, **kwargs)
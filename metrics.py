@@ -0,0 +1,194 @@
+# metrics.py
+"""Замеры задержек и метрики в текстовом формате Prometheus.
+
+LatencyRecorder — окно последних замеров для /latency. Counter, Gauge и
+Histogram копятся в памяти процесса и отдаются по HTTP GET /metrics
+(start_server). Запись метрики — словарь и пара сложений без блокировок:
+весь бот живёт в одном event loop, поэтому метрики можно не выключать.
+Значения, которые и так считаются в других местах (кэши, очереди, автомат
+CryptoBot), не дублируются: метрика с collect получает их при каждом опросе.
+"""
+import inspect
+import math
+import time
+from bisect import bisect_left
+from collections import deque
+
+from aiohttp import web
+
+# Границы бакетов гистограмм задержек, с
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class LatencyRecorder:
+    """Скользящее окно последних замеров задержки и перцентили по нему."""
+
+    def __init__(self, window: int = 1000):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+
+    def since(self, started: float):
+        """Записывает время, прошедшее с started (значение time.perf_counter())."""
+        self.observe(time.perf_counter() - started)
+
+    def percentile(self, p: float) -> float:
+        """Перцентиль p (0..100) по окну методом ближайшего ранга; 0.0 без замеров."""
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        rank = max(1, -(-len(ordered) * p // 100))
+        return ordered[int(rank) - 1]
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "window": len(self._samples),
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": max(self._samples, default=0.0),
+        }
+
+
+# ========== PROMETHEUS ==========
+def _number(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(int(value))
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Registry:
+    """Набор метрик, которые отдаются одним /metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    async def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = await metric.samples()
+            except Exception as e:
+                print(f"Ошибка сбора метрики {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{metric.name}{suffix}{labels} {_number(value)}" for suffix, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), collect=None, registry: Registry = None):
+        """collect() (можно async) — значение при опросе: число или {значения меток: число}."""
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values = {}
+        (registry or REGISTRY).register(self)
+
+    async def _current(self) -> dict:
+        if self.collect is None:
+            return self._values
+        values = self.collect()
+        if inspect.isawaitable(values):
+            values = await values
+        return values if isinstance(values, dict) else {(): values}
+
+    async def samples(self):
+        values = await self._current()
+        return [("", _labels(self.labels, key if isinstance(key, tuple) else (key,)), value)
+                for key, value in values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: int = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """Гистограмма: на каждый набор меток — счётчики бакетов и сумма значений."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS,
+                 registry: Registry = None):
+        super().__init__(name, help, labels, registry=registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            # [попадания в каждый бакет..., в +Inf, сумма]
+            series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def since(self, started: float, *labels):
+        """Записывает время, прошедшее с started (значение time.perf_counter())."""
+        self.observe(time.perf_counter() - started, *labels)
+
+    async def samples(self):
+        samples = []
+        for key, series in self._values.items():
+            total = 0
+            for bound, hits in zip(self.buckets + (math.inf,), series):
+                total += hits
+                samples.append(("_bucket", _labels(self.labels, key, f'le="{_number(float(bound))}"'), total))
+            samples.append(("_sum", _labels(self.labels, key), series[-1]))
+            samples.append(("_count", _labels(self.labels, key), total))
+        return samples
+
+
+def metrics_handler(registry: Registry = None):
+    """aiohttp-обработчик GET /metrics для registry (по умолчанию — общий)."""
+    registry = registry or REGISTRY
+
+    async def handle(request: web.Request):
+        return web.Response(body=(await registry.render()).encode(), headers={"Content-Type": CONTENT_TYPE})
+    return handle
+
+async def start_server(host: str, port: int, registry: Registry = None) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler(registry))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except Exception:
+        await runner.cleanup()
+        raise
+    return runner
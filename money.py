@@ -0,0 +1,66 @@
+# money.py
+"""Денежные суммы в целых микро-USDT (1 USDT = 1 000 000).
+
+Балансы, ставки, выплаты и инвойсы хранятся и считаются целыми числами, так что
+сложение и сравнение точные. В строки USDT и обратно суммы переводятся через
+Decimal только на границах: ввод пользователя, API CryptoBot, текст сообщений.
+"""
+from decimal import Decimal, DecimalException, InvalidOperation
+from functools import lru_cache
+
+MICRO = 1_000_000
+MICRO_PER_CENT = MICRO // 100
+MAX_DIGITS = 12         # больше триллиона USDT суммой не считается
+_CENT = Decimal("0.01")
+
+
+def parse(value) -> int:
+    """'12.5' (или 12.5) -> 12_500_000.
+
+    ValueError, если это не сумма, в ней больше 6 знаков после запятой или
+    больше MAX_DIGITS цифр в целой части.
+    """
+    try:
+        amount = Decimal(str(value).strip().replace(",", "."))
+    except InvalidOperation:
+        raise ValueError(f"Не сумма: {value!r}") from None
+    if not amount.is_finite():
+        raise ValueError(f"Не сумма: {value!r}")
+    # '1e999999' переполняет Decimal, а длинная строка цифр — int на мегабайты
+    if amount and amount.adjusted() >= MAX_DIGITS:
+        raise ValueError(f"Слишком большая сумма: {value!r}")
+    try:
+        micro = amount * MICRO
+        if micro != micro.to_integral_value():
+            raise ValueError(f"Больше 6 знаков после запятой: {value!r}")
+    except DecimalException:
+        raise ValueError(f"Не сумма: {value!r}") from None
+    return int(micro)
+
+
+def from_cents(cents: int) -> int:
+    return cents * MICRO_PER_CENT
+
+
+def to_decimal(micro: int) -> Decimal:
+    return Decimal(micro).scaleb(-6)
+
+
+def fmt(micro: int) -> str:
+    """Сумма для текста и API: минимум 2 знака после запятой, без округления (12_500_000 -> '12.50')."""
+    amount = to_decimal(micro)
+    if amount == amount.quantize(_CENT):
+        return f"{amount:.2f}"
+    return f"{amount.normalize():f}"
+
+
+@lru_cache(maxsize=None)
+def _ratio(coef: float) -> tuple[int, int]:
+    # 1.7 -> (17, 10): коэффициент как точная дробь по его десятичной записи
+    return Decimal(str(coef)).as_integer_ratio()
+
+
+def multiply(micro: int, coef: float) -> int:
+    """micro * coef в целых микро-USDT, с округлением вниз."""
+    numerator, denominator = _ratio(coef)
+    return micro * numerator // denominator
@@ -0,0 +1,185 @@
+# publisher.py
+import asyncio
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+import config
+from ratelimit import TokenBucket
+
+# Приоритеты очереди канала: меньше — раньше. Анонс ставки и её кубики делят
+# одну очередь, поэтому порядок в канале всегда анонс -> бросок -> результат
+PRIORITY_BET = 0
+PRIORITY_RESULT = 1
+PRIORITY_NAMES = ("bet", "result")
+
+
+class ChannelPublisher:
+    """Очередь публикаций в канал с приоритетами и общим темпом отправки.
+
+    Все посты в канал проходят через одного отправителя и token bucket
+    (config.CHANNEL_RATE сообщений в минуту). Анонсы ставок и броски кубика идут
+    первыми в порядке поступления, затем результаты: результат ставки ставится в
+    очередь после её бросков, а значит и после анонса. Если очередь забита,
+    подряд идущие анонсы склеиваются в один дайджест. RetryAfter тормозит весь
+    канал и повторяет пост.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int = None, rate: float = None, maxsize: int = None):
+        self.bot = bot
+        self.chat_id = chat_id or config.CHANNEL_ID
+        rate = rate or config.CHANNEL_RATE
+        self.bucket = TokenBucket(rate / 60, config.CHANNEL_BURST)
+        self.maxsize = maxsize or config.CHANNEL_QUEUE_SIZE
+        self._queues = tuple(deque() for _ in PRIORITY_NAMES)
+        self._ready = asyncio.Event()
+        self._busy = False
+        self._task: asyncio.Task | None = None
+        self.published = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retried = 0
+        self.digests = 0
+        self.coalesced = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for q in self._queues)
+
+    def _put(self, priority: int, item) -> bool:
+        if self.depth >= self.maxsize:
+            self.dropped += 1
+            return False
+        self._queues[priority].append(item)
+        self._ready.set()
+        return True
+
+    def publish(self, fn, *args, priority: int = PRIORITY_RESULT) -> bool:
+        """Ставит в очередь вызов await fn(*args) без ожидания; False, если очередь заполнена."""
+        return self._put(priority, (fn, args, None))
+
+    async def call(self, fn, *args, priority: int = PRIORITY_BET, timeout: float = None):
+        """Выполняет fn(*args) в очереди канала и возвращает результат (например, бросок кубика)."""
+        results = await self.call_many([(fn, args)], priority=priority, timeout=timeout)
+        return results[0]
+
+    async def call_many(self, calls: list, priority: int = PRIORITY_BET, timeout: float = None) -> list:
+        """Выполняет вызовы [(fn, args), ...] в очереди канала подряд и возвращает их результаты.
+
+        В очередь встают все вызовы или ни одного (QueueFull), так что дуэль не
+        оставит в канале один кубик. Если результатов нет за timeout секунд —
+        TimeoutError, ещё не отправленные вызовы снимаются с очереди.
+        """
+        if self.depth + len(calls) > self.maxsize:
+            self.dropped += len(calls)
+            raise asyncio.QueueFull
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in calls]
+        for (fn, args), future in zip(calls, futures):
+            self._queues[priority].append((fn, args, future))
+        self._ready.set()
+        try:
+            return await asyncio.wait_for(asyncio.gather(*futures), timeout)
+        finally:
+            # Отменённые вызовы _run пропускает; завершённым cancel() не вредит
+            for future in futures:
+                future.cancel()
+
+    def announce(self, text: str) -> bool:
+        """Анонс ставки: встаёт перед её кубиками, может уйти в составе дайджеста."""
+        return self._put(PRIORITY_BET, text)
+
+    def _next_announcement(self) -> str:
+        queue = self._queues[PRIORITY_BET]
+        if not config.CHANNEL_DIGEST_THRESHOLD or self.depth < config.CHANNEL_DIGEST_THRESHOLD:
+            return queue.popleft()
+        # Склеиваются только анонсы подряд: кубики ставок остаются после своих анонсов
+        texts = [queue.popleft()]
+        while queue and isinstance(queue[0], str) and len(texts) < config.CHANNEL_DIGEST_MAX:
+            texts.append(queue.popleft())
+        if len(texts) == 1:
+            return texts[0]
+        self.digests += 1
+        self.coalesced += len(texts)
+        return f"📋 <b>Новые ставки ({len(texts)})</b>\n\n" + "\n\n".join(texts)
+
+    async def _send(self, fn, args, future):
+        for attempt in range(config.CHANNEL_MAX_RETRIES + 1):
+            await self.bucket.acquire()
+            if future is not None and future.cancelled():
+                # Вызов сняли (таймаут броска), пока он ждал темпа: пост не нужен
+                self.bucket.tokens += 1
+                raise asyncio.CancelledError
+            try:
+                return await fn(*args)
+            except TelegramRetryAfter as e:
+                if attempt == config.CHANNEL_MAX_RETRIES:
+                    raise
+                self.retried += 1
+                self.bucket.pause(e.retry_after)
+
+    async def _run(self):
+        while True:
+            while not self.depth:
+                self._ready.clear()
+                await self._ready.wait()
+            priority = next(p for p, q in enumerate(self._queues) if q)
+            if isinstance(self._queues[priority][0], str):
+                fn, args, future = self.bot.send_message, (self.chat_id, self._next_announcement()), None
+            else:
+                fn, args, future = self._queues[priority].popleft()
+            if future is not None and future.cancelled():
+                continue
+            self._busy = True
+            try:
+                result = await self._send(fn, args, future)
+                self.published += 1
+                if future is not None and not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                if future is None or not future.cancelled():
+                    raise
+            except Exception as e:
+                self.failed += 1
+                if future is not None and not future.done():
+                    future.set_exception(e)
+                else:
+                    print(f"Ошибка публикации в канал: {e}")
+            finally:
+                self._busy = False
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10):
+        """Дожидается отправки оставшихся постов (не дольше timeout) и останавливает очередь."""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self.depth or self._busy) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self.depth:
+            print(f"Не отправлено в канал при остановке: {self.depth}")
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        for queue in self._queues:
+            for item in queue:
+                if isinstance(item, tuple) and item[2] is not None:
+                    item[2].cancel()
+            queue.clear()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "by_priority": {name: len(q) for name, q in zip(PRIORITY_NAMES, self._queues)},
+            "published": self.published,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "retried": self.retried,
+            "digests": self.digests,
+            "coalesced": self.coalesced,
+        }
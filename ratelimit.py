@@ -0,0 +1,75 @@
+# ratelimit.py
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, tokens: float = 1) -> float:
+        """Сколько секунд ждать, пока станут доступны tokens (0 — можно сейчас)."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.tokens < tokens:
+            wait = max(wait, (tokens - self.tokens) / self.rate)
+        return wait
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        if self.delay(tokens) > 0:
+            return False
+        self.tokens -= tokens
+        return True
+
+    async def acquire(self, tokens: float = 1):
+        while True:
+            wait = self.delay(tokens)
+            if wait <= 0:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Блокирует ведро на seconds (например, после TelegramRetryAfter)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class KeyedTokenBuckets:
+    """Отдельное ведро на ключ (чат, пользователь); хранит не больше maxsize вёдер (LRU)."""
+
+    def __init__(self, rate: float, capacity: float = None, maxsize: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+
+    def get(self, key) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def try_acquire(self, key, tokens: float = 1) -> bool:
+        return self.get(key).try_acquire(tokens)
+
+    async def acquire(self, key, tokens: float = 1):
+        await self.get(key).acquire(tokens)
+
+    def __len__(self):
+        return len(self._buckets)
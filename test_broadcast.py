@@ -0,0 +1,34 @@
+# test_broadcast.py
+"""Движок рассылок: одно задание — один исполнитель."""
+import asyncio
+
+import db
+from broadcast import BroadcastEngine
+from test_db import run
+
+
+class SlowBot:
+    """Бот, который долго отправляет: задание не успевает завершиться за тест."""
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(60)
+
+
+def running_jobs() -> int:
+    return sum(task.get_coro().__qualname__ == "Broadcast.run" for task in asyncio.all_tasks())
+
+
+def test_job_launched_once_when_start_races_sync(tmp_path):
+    async def scenario():
+        await db.get_user(1)
+        engine = BroadcastEngine(SlowBot())
+        await engine.activate()
+        # start() и просмотр базы видят новое задание одновременно
+        job_id, *_ = await asyncio.gather(engine.start("привет"), engine._sync(), engine._sync())
+        jobs, launched = list(engine.jobs), running_jobs()
+        await engine.stop()
+        return jobs, job_id, launched
+
+    jobs, job_id, launched = run(tmp_path / "bot.db", scenario)
+    assert jobs == [job_id]
+    assert launched == 1
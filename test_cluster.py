@@ -0,0 +1,111 @@
+# test_cluster.py
+"""Режим вебхука: маршрутизация апдейтов по воркерам и аренда лидера."""
+import asyncio
+
+import pytest
+
+import db
+from cluster import EVENT_FIELDS, LeaderElection, route_key
+from test_db import run
+
+USER = {"id": 7, "is_bot": False, "first_name": "Игрок"}
+ADMIN = {"id": 1, "is_bot": False, "first_name": "Админ"}
+CHAT = {"id": -100500, "type": "channel"}
+
+# Поле апдейта -> (событие, ожидаемый ключ)
+EVENTS = {
+    "message": ({"from": USER, "chat": CHAT}, 7),
+    "edited_message": ({"from": USER, "chat": CHAT}, 7),
+    "callback_query": ({"from": USER, "message": {"chat": CHAT}}, 7),
+    "inline_query": ({"from": USER, "query": ""}, 7),
+    "chosen_inline_result": ({"from": USER, "result_id": "1"}, 7),
+    "pre_checkout_query": ({"from": USER, "invoice_payload": "stars"}, 7),
+    "shipping_query": ({"from": USER, "invoice_payload": "stars"}, 7),
+    # Статус меняет администратор, ключ — участник, чья подписка изменилась
+    "chat_member": ({"from": ADMIN, "chat": CHAT, "new_chat_member": {"user": USER, "status": "member"}}, 7),
+    "my_chat_member": ({"from": USER, "chat": CHAT}, 7),
+    "chat_join_request": ({"from": USER, "chat": CHAT}, 7),
+    "poll_answer": ({"user": USER, "poll_id": "1"}, 7),
+    "message_reaction": ({"user": USER, "chat": CHAT}, 7),
+    "business_message": ({"from": USER, "chat": {"id": 7, "type": "private"}}, 7),
+    # Посты канала без автора — по чату
+    "channel_post": ({"chat": CHAT}, -100500),
+    "edited_channel_post": ({"chat": CHAT}, -100500),
+}
+
+
+def test_every_event_field_has_a_case():
+    assert set(EVENTS) == set(EVENT_FIELDS)
+
+
+@pytest.mark.parametrize("field", EVENT_FIELDS)
+def test_route_key(field):
+    event, expected = EVENTS[field]
+    assert route_key({"update_id": 99, field: event}) == expected
+
+
+def test_route_key_fallbacks():
+    # Анонимная реакция: пользователя нет, ключ — чат
+    assert route_key({"update_id": 99, "message_reaction": {"actor_chat": CHAT, "chat": CHAT}}) == -100500
+    # Неизвестный тип апдейта — по update_id
+    assert route_key({"update_id": 99, "poll": {"id": "1"}}) == 99
+
+
+def election(owner: str, events: list, ttl: float = 0.3, on_elected=None) -> LeaderElection:
+    async def elected():
+        events.append((owner, "elected"))
+        if on_elected is not None:
+            await on_elected()
+
+    async def lost():
+        events.append((owner, "lost"))
+
+    leader = LeaderElection("test", on_elected=elected, on_lost=lost, ttl=ttl)
+    leader.owner = owner
+    return leader
+
+
+def test_lease_taken_over_after_leader_stops_renewing(tmp_path):
+    async def scenario():
+        events = []
+        first, second = election("a", events), election("b", events)
+        first_task = asyncio.create_task(first.run())
+        await asyncio.sleep(0.05)
+        second_task = asyncio.create_task(second.run())
+        await asyncio.sleep(0.2)
+        both_before = first.is_leader, second.is_leader
+        # Лидер завис или упал, не отдав аренду: через ttl её забирает второй
+        first_task.cancel()
+        await asyncio.sleep(0.5)
+        after = second.is_leader
+        await second.release()
+        second_task.cancel()
+        await asyncio.gather(first_task, second_task, return_exceptions=True)
+        return both_before, after, events
+
+    both_before, after, events = run(tmp_path / "bot.db", scenario)
+    assert both_before == (True, False)
+    assert after is True
+    assert events == [("a", "elected"), ("b", "elected"), ("b", "lost")]
+
+
+def test_failed_election_stops_jobs_and_releases_lease(tmp_path):
+    async def scenario():
+        events = []
+
+        async def broken():
+            raise RuntimeError("фоновые задачи не запустились")
+
+        leader = election("a", events, ttl=60, on_elected=broken)
+        task = asyncio.create_task(leader.run())
+        await asyncio.sleep(0.05)
+        # Аренда свободна сразу, не через ttl
+        taken = await db.acquire_lease("test", "b", 60)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return leader.is_leader, taken, events
+
+    is_leader, taken, events = run(tmp_path / "bot.db", scenario)
+    assert is_leader is False
+    assert taken is True
+    assert events == [("a", "elected"), ("a", "lost")]
@@ -0,0 +1,153 @@
+# test_cryptobot.py
+"""Клиент CryptoBot против fake_cryptobot.py: повторы, классификация ошибок и автомат."""
+import asyncio
+import itertools
+
+import aiohttp
+import pytest
+from aiocryptopay.exceptions.factory import CodeErrorFactory
+from aiohttp import web
+
+import config
+import fake_cryptobot
+from cryptobot import CircuitBreaker, CircuitOpen, CryptoBotClient, is_rejected, is_transient
+from fake_cryptobot import FakeCryptoBot
+
+TOKEN = "1:test"
+
+
+def api_error(code: int) -> CodeErrorFactory:
+    return CodeErrorFactory.exception_to_raise(code, "ERROR")
+
+
+def run(scenario, token: str = TOKEN, retries: int = 2, timeout: float = 1, **fake_options):
+    """Поднимает FakeCryptoBot на свободном порту и выполняет await scenario(fake, client)."""
+    async def main():
+        fake = FakeCryptoBot(TOKEN, **fake_options)
+        runner = web.AppRunner(fake.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        port = runner.addresses[0][1]
+        client = CryptoBotClient(token=token, network=f"http://127.0.0.1:{port}", timeout=timeout, retries=retries)
+        try:
+            return await scenario(fake, client)
+        finally:
+            await client.close()
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(config, "CRYPTOBOT_RETRY_BASE", 0.01)
+
+
+def fail_first(monkeypatch, failures: int):
+    """Первые failures ответов FakeCryptoBot с error_rate=0.5 — 500, дальше успех."""
+    draws = itertools.chain([0.0] * failures, itertools.repeat(0.99))
+    monkeypatch.setattr(fake_cryptobot.random, "random", lambda: next(draws))
+
+
+@pytest.mark.parametrize("error, transient, rejected", [
+    (api_error(400), False, True),
+    (api_error(401), False, True),
+    (api_error(404), False, True),
+    (api_error(429), True, False),
+    (api_error(500), True, False),
+    (api_error(502), True, False),
+    (asyncio.TimeoutError(), True, False),
+    (aiohttp.ClientConnectionError(), True, False),
+    (ValueError("bad response"), False, False),
+])
+def test_error_classification(error, transient, rejected):
+    assert is_transient(error) is transient
+    assert is_rejected(error) is rejected
+
+
+def test_get_invoices_retries_server_errors(monkeypatch):
+    async def scenario(fake, client):
+        fail_first(monkeypatch, 0)
+        invoice = await client.create_invoice(asset="USDT", amount=1)
+        fail_first(monkeypatch, 2)
+        invoices = await client.get_invoices(invoice_ids=str(invoice.invoice_id))
+        return invoices, fake.calls["getInvoices"], dict(client.errors["getInvoices"])
+
+    invoices, calls, errors = run(scenario, error_rate=0.5)
+    assert [invoice.status for invoice in invoices] == ["active"]
+    assert calls == 3
+    assert errors == {"CodeErrorFactory_500": 2}
+
+
+def test_get_invoices_gives_up_after_retries():
+    async def scenario(fake, client):
+        with pytest.raises(CodeErrorFactory) as error:
+            await client.get_invoices()
+        return error.value.code, fake.calls["getInvoices"]
+
+    assert run(scenario, error_rate=1) == (500, 3)
+
+
+def test_get_invoices_retries_timeouts():
+    async def scenario(fake, client):
+        with pytest.raises(asyncio.TimeoutError):
+            await client.get_invoices()
+        return dict(client.errors["getInvoices"]), client.breaker.failures
+
+    assert run(scenario, retries=1, timeout=0.05, latency=0.2) == ({"TimeoutError": 2}, 2)
+
+
+def test_create_invoice_is_not_retried():
+    async def scenario(fake, client):
+        with pytest.raises(CodeErrorFactory):
+            await client.create_invoice(asset="USDT", amount=1)
+        return fake.calls["createInvoice"], fake.invoices
+
+    assert run(scenario, error_rate=1) == (1, {})
+
+
+def test_rejected_request_is_not_retried_and_keeps_breaker_closed():
+    async def scenario(fake, client):
+        client.breaker = CircuitBreaker(1, 60)
+        with pytest.raises(CodeErrorFactory) as error:
+            await client.get_invoices()
+        return is_rejected(error.value), fake.calls["getInvoices"], client.breaker.state
+
+    # Неверный токен — ответ 401 по существу: API живо, повторять нечего
+    assert run(scenario, token="1:wrong") == (True, 1, "closed")
+
+
+def test_breaker_opens_half_opens_and_closes():
+    async def scenario(fake, client):
+        client.breaker = CircuitBreaker(3, 0.2)
+        states = []
+        for _ in range(3):
+            with pytest.raises(CodeErrorFactory):
+                await client.get_invoices()
+        states.append(client.breaker.state)
+        # Открыт: запрос отклоняется без обращения к API
+        with pytest.raises(CircuitOpen):
+            await client.get_invoices()
+        calls_while_open = fake.calls["getInvoices"]
+        await asyncio.sleep(0.25)
+        states.append(client.breaker.state)
+        # Пробный запрос снова неудачен — автомат открыт ещё на интервал
+        with pytest.raises(CodeErrorFactory):
+            await client.get_invoices()
+        states.append(client.breaker.state)
+        await asyncio.sleep(0.25)
+        fake.error_rate = 0
+        fake.latency = 0.1
+        probe = asyncio.create_task(client.get_invoices())
+        await asyncio.sleep(0.02)
+        # Пока идёт пробный запрос, остальные ждут его исхода
+        with pytest.raises(CircuitOpen):
+            await client.get_invoices()
+        await probe
+        states.append(client.breaker.state)
+        return states, calls_while_open, client.breaker.trips, client.rejected
+
+    states, calls_while_open, trips, rejected = run(scenario, retries=0, error_rate=1)
+    assert states == ["open", "half-open", "open", "closed"]
+    assert calls_while_open == 3
+    assert trips == 1
+    assert rejected == 2
@@ -0,0 +1,225 @@
+# test_db.py
+"""Деньги в db.py: миграция REAL -> микро-USDT, журнал и идемпотентность платежей.
+
+Запуск: python -m pytest -q
+"""
+import asyncio
+import sqlite3
+
+import pytest
+
+import db
+import money
+
+# Схема до перевода денег в целые микро-USDT: суммы — REAL в USDT
+LEGACY_SCHEMA = """
+    CREATE TABLE users (
+        user_id INTEGER PRIMARY KEY,
+        balance REAL DEFAULT 0,
+        total_bets INTEGER DEFAULT 0,
+        total_wins INTEGER DEFAULT 0,
+        registered_date TEXT,
+        blocked INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE invoices (
+        invoice_id TEXT PRIMARY KEY,
+        user_id INTEGER,
+        amount REAL,
+        status TEXT DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE bets (
+        bet_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        game TEXT NOT NULL,
+        amount REAL NOT NULL,
+        coef REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'reserved',
+        payout REAL NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        settled_at TEXT,
+        roll TEXT
+    );
+"""
+
+
+def run(path, scenario, group_commit: bool = False):
+    """Открывает базу path, выполняет await scenario() и закрывает базу."""
+    async def main():
+        await db.init_db(str(path), group_commit=group_commit)
+        try:
+            return await scenario()
+        finally:
+            await db.close_db()
+            db._user_cache.clear()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.executemany(
+        "INSERT INTO users (user_id, balance, total_bets, total_wins, registered_date) VALUES (?, ?, ?, ?, ?)",
+        [
+            (1, 12.345678, 3, 1, "2024-01-01"),
+            (2, 0.1 + 0.2, 0, 0, "2024-01-01"),     # 0.30000000000000004
+            (3, 1.9999999, 0, 0, "2024-01-01"),     # 7 знаков: округляется до микро-USDT
+            (4, 0, 0, 0, "2024-01-01"),
+        ]
+    )
+    conn.executemany(
+        "INSERT INTO invoices (invoice_id, user_id, amount, status) VALUES (?, ?, ?, ?)",
+        [("100", 1, 5.5, "paid"), ("101", 1, 2.25, "pending")]
+    )
+    conn.executemany(
+        "INSERT INTO bets (user_id, game, amount, coef, status, payout, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(1, "dice_over", 0.7, 1.7, "won", 1.19, "2024-01-01"), (1, "dice_over", 0.2, 1.7, "lost", 0, "2024-01-01")]
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_migration_converts_money_to_micro(legacy_db):
+    async def scenario():
+        users = await db._run(db._fetchall, "SELECT user_id, balance FROM users ORDER BY user_id")
+        invoices = await db._run(db._fetchall, "SELECT invoice_id, amount FROM invoices ORDER BY invoice_id")
+        bets = await db._run(db._fetchall, "SELECT bet_id, amount, payout FROM bets ORDER BY bet_id")
+        version = await db._run(db._fetchone, "PRAGMA user_version")
+        return users, invoices, bets, version[0]
+
+    users, invoices, bets, version = run(legacy_db, scenario)
+    assert users == [(1, 12_345_678), (2, 300_000), (3, 2_000_000), (4, 0)]
+    assert all(isinstance(balance, int) for _, balance in users)
+    assert invoices == [("100", 5_500_000), ("101", 2_250_000)]
+    assert bets == [(1, 700_000, 1_190_000), (2, 200_000, 0)]
+    assert version == len(db.MIGRATIONS)
+
+
+def test_migration_keeps_bet_sequence(legacy_db):
+    async def scenario():
+        await db.get_user(1)
+        return await db.reserve_bet(1, "dice_over", money.parse(1), 1.7)
+
+    assert run(legacy_db, scenario) == 3
+
+
+def test_opening_entries_match_balances(legacy_db):
+    async def scenario():
+        entries = await db._run(
+            db._fetchall, "SELECT user_id, kind, amount, balance FROM ledger ORDER BY user_id"
+        )
+        checks = [await db.verify_balance(user_id) for user_id in (1, 2, 3, 4)]
+        return entries, checks
+
+    entries, checks = run(legacy_db, scenario)
+    # Пользователь с нулевым балансом проводки не получает
+    assert entries == [
+        (1, "opening", 12_345_678, 12_345_678),
+        (2, "opening", 300_000, 300_000),
+        (3, "opening", 2_000_000, 2_000_000),
+    ]
+    assert all(balance == expected for balance, expected in checks)
+
+
+def test_migration_runs_once(legacy_db):
+    run(legacy_db, lambda: db.get_user(1))
+    entries = run(legacy_db, lambda: db._run(db._fetchall, "SELECT entry_id FROM ledger"))
+    assert len(entries) == 3
+
+
+def test_paid_invoice_not_credited_again_after_migration(legacy_db):
+    async def scenario():
+        again = await db.mark_invoice_paid("100")
+        direct = await db.credit_payment("cryptobot", "100", 1, money.parse(5.5))
+        pending = await db.mark_invoice_paid("101")
+        return again, direct, pending, (await db.get_user(1, fresh=True)).balance, await db.verify_balance(1)
+
+    again, direct, pending, balance, (stored, expected) = run(legacy_db, scenario)
+    assert again is None and direct is None
+    assert pending == (1, 2_250_000)
+    assert balance == 12_345_678 + 2_250_000
+    assert stored == expected == balance
+
+
+def test_legacy_invoices_have_no_known_expiry(legacy_db):
+    async def scenario():
+        return await db.get_pending_invoices(0)
+
+    # Инвойс 101 создан до expires_at: срок жизни неизвестен, локально он не просрочится
+    assert run(legacy_db, scenario) == [("101", 1, 2_250_000, 0)]
+
+
+def test_pending_invoice_overdue_only_after_expiry_and_grace(tmp_path):
+    async def scenario():
+        await db.save_invoice("1", 5, money.parse(1), expires_in=3600)
+        await db.save_invoice("2", 5, money.parse(1), expires_in=3600)
+        await db.save_invoice("3", 5, money.parse(1))
+        # Инвойс 2 истёк 15 минут назад
+        await db._run(db._transaction, lambda cur: cur.execute(
+            "UPDATE invoices SET expires_at = datetime('now', '-900 seconds') WHERE invoice_id = '2'"
+        ))
+        return await db.get_pending_invoices(600), await db.get_pending_invoices(1200)
+
+    within_grace, beyond_grace = run(tmp_path / "bot.db", scenario)
+    assert [(invoice_id, overdue) for invoice_id, _, _, overdue in within_grace] == [("1", 0), ("2", 1), ("3", 0)]
+    assert [overdue for *_, overdue in beyond_grace] == [0, 0, 0]
+
+
+@pytest.mark.parametrize("group_commit", [False, True])
+def test_credit_payment_is_idempotent(tmp_path, group_commit):
+    async def scenario():
+        await db.get_user(7)
+        first = await db.credit_payment("stars", "charge-1", 7, money.parse(3))
+        second = await db.credit_payment("stars", "charge-1", 7, money.parse(3))
+        # Тот же id у другого провайдера — другой платёж
+        other = await db.credit_payment("cryptobot", "charge-1", 7, money.parse(1))
+        entries = await db._run(db._fetchall, "SELECT kind, amount, ref FROM ledger WHERE user_id = 7 ORDER BY entry_id")
+        return first, second, other, entries, await db.verify_balance(7)
+
+    first, second, other, entries, (stored, expected) = run(tmp_path / "bot.db", scenario, group_commit)
+    assert first.balance == 3_000_000
+    assert second is None
+    assert other.balance == 4_000_000
+    assert entries == [("stars", 3_000_000, "stars:charge-1"), ("deposit", 1_000_000, "cryptobot:charge-1")]
+    assert stored == expected == 4_000_000
+
+
+@pytest.mark.parametrize("group_commit", [False, True])
+def test_concurrent_duplicate_credits_apply_once(tmp_path, group_commit):
+    async def scenario():
+        await db.save_invoice("200", 8, money.parse(10))
+        results = await asyncio.gather(
+            *(db.mark_invoice_paid("200") for _ in range(5)),
+            *(db.credit_payment("cryptobot", "200", 8, money.parse(10)) for _ in range(5)),
+        )
+        return results, await db.verify_balance(8)
+
+    results, (stored, expected) = run(tmp_path / "bot.db", scenario, group_commit)
+    assert sum(result is not None for result in results) == 1
+    assert stored == expected == 10_000_000
+
+
+def test_credit_registers_unknown_user(tmp_path):
+    async def scenario():
+        user = await db.credit_payment("cryptobot", "300", 9, money.parse("0.000001"))
+        return user, await db.verify_balance(9)
+
+    user, (stored, expected) = run(tmp_path / "bot.db", scenario)
+    assert user.user_id == 9 and user.balance == 1
+    assert stored == expected == 1
+
+
+@pytest.mark.parametrize("group_commit", [False, True])
+def test_concurrent_debits_never_overdraw(tmp_path, group_commit):
+    async def scenario():
+        await db.get_user(10)
+        await db.update_balance(10, money.parse(10), "admin")
+        results = await asyncio.gather(*(db.debit_balance(10, money.parse(4), "admin") for _ in range(5)))
+        return results, await db.verify_balance(10)
+
+    results, (stored, expected) = run(tmp_path / "bot.db", scenario, group_commit)
+    assert sum(result is not None for result in results) == 2
+    assert stored == expected == 2_000_000
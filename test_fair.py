@@ -0,0 +1,87 @@
+# test_fair.py
+"""Provably fair: детерминизм и равномерность бросков, nonce серий и хэш до первой ставки."""
+import hashlib
+from collections import Counter
+
+import pytest
+
+import fair
+from games import DICE_SIDES
+from test_db import run
+
+SIDES = sorted(set(DICE_SIDES.values()))
+
+
+def test_roll_is_deterministic():
+    first = [fair.roll("server", "client", nonce, 6, index) for nonce in range(50) for index in range(2)]
+    again = [fair.roll("server", "client", nonce, 6, index) for nonce in range(50) for index in range(2)]
+    assert first == again
+    # Любая часть входа меняет последовательность
+    assert first != [fair.roll("server2", "client", nonce, 6, index) for nonce in range(50) for index in range(2)]
+    assert first != [fair.roll("server", "client2", nonce, 6, index) for nonce in range(50) for index in range(2)]
+
+
+@pytest.mark.parametrize("sides", SIDES)
+def test_roll_range_and_uniformity(sides):
+    rolls = 30_000
+    counts = Counter(fair.roll("server", "client", nonce, sides) for nonce in range(rolls))
+    assert set(counts) == set(range(1, sides + 1))
+    # Хи-квадрат: 20.5 — критическое значение при p=0.001 для 6 граней (для 5 граней — 18.5)
+    expected = rolls / sides
+    assert sum((count - expected) ** 2 / expected for count in counts.values()) < 20.5
+
+
+@pytest.mark.parametrize("sides", SIDES)
+def test_rejected_words_fall_through_to_next_round(monkeypatch, sides):
+    real_new = fair.hmac.new
+
+    def new(key, message, digestmod):
+        # Раунд 0 целиком из слов 0xFFFFFFFF: все выше границы отбраковки
+        if message.endswith(b":0"):
+            return type("Digest", (), {"digest": lambda self: b"\xff" * 32})()
+        return real_new(key, message, digestmod)
+
+    monkeypatch.setattr(fair.hmac, "new", new)
+    word = real_new(b"server", b"client:1:0:1", hashlib.sha256).digest()[:4]
+    assert fair.roll("server", "client", 1, sides) == int.from_bytes(word, "big") % sides + 1
+
+
+def test_roll_series_advances_nonce(tmp_path):
+    async def scenario():
+        first = await fair.roll_series(5, "🎲", 2, 3)
+        second = await fair.roll_series(5, "🎲", 2, 2)
+        single = await fair.roll_for(5, "⚽")
+        server_seed, client_seed, nonce = await fair.get_seeds(5)
+        await fair.rotate(5)
+        after_rotate = await fair.roll_for(5, "🎲")
+        return first + second + [single], (server_seed, client_seed, nonce), after_rotate
+
+    rolls, (server_seed, client_seed, nonce), after_rotate = run(tmp_path / "bot.db", scenario)
+    proofs = [proof.split(":") for _, proof in rolls]
+    assert [int(n) for *_, n in proofs] == [1, 2, 3, 4, 5, 6]
+    assert nonce == 6
+    assert all(hashed == fair.seed_hash(server_seed) and client == client_seed for hashed, client, _ in proofs)
+    # Значения ставки пересчитываются по раскрытому сиду
+    for values, proof in rolls[:5]:
+        n = int(proof.rsplit(":", 1)[1])
+        assert values == [fair.roll(server_seed, client_seed, n, 6, index) for index in range(2)]
+    assert rolls[5][0] == [fair.roll(server_seed, client_seed, 6, 5)]
+    assert after_rotate[1].endswith(":1") and not after_rotate[1].startswith(fair.seed_hash(server_seed))
+
+
+def test_commitment_shown_before_first_roll(tmp_path, monkeypatch):
+    monkeypatch.setattr(fair, "_seeded", set())
+
+    async def scenario():
+        committed = await fair.commitment(6)
+        again = await fair.commitment(6)
+        _, proof = await fair.roll_for(6, "🎲")
+        # Другой воркер: сиды уже в базе, повторно хэш не показывается
+        fair._seeded.clear()
+        other_worker = await fair.commitment(6)
+        return committed, again, proof, other_worker
+
+    committed, again, proof, other_worker = run(tmp_path / "bot.db", scenario)
+    assert committed is not None
+    assert proof == f"{committed[0]}:{committed[1]}:1"
+    assert again is None and other_worker is None
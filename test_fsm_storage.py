@@ -0,0 +1,63 @@
+# test_fsm_storage.py
+"""SQLiteStorage: состояние и данные FSM в базе, кэш перед ней и TTL."""
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+import db
+from fsm_storage import SQLiteStorage
+from test_db import run
+
+KEY = StorageKey(bot_id=1, chat_id=42, user_id=42)
+
+
+async def fsm_rows():
+    return await db._run(db._fetchall, "SELECT key, state, data FROM fsm")
+
+
+def test_round_trip_through_database(tmp_path):
+    async def scenario():
+        writer = SQLiteStorage()
+        await writer.set_state(KEY, "GameStates:waiting_bet")
+        await writer.set_data(KEY, {"game": "dice_over", "комментарий": "ставка"})
+        # Новый экземпляр с пустым кэшем читает то же из базы
+        reader = SQLiteStorage()
+        loaded = await reader.get_state(KEY), await reader.get_data(KEY)
+        await writer.set_state(KEY, None)
+        await writer.set_data(KEY, {})
+        return loaded, await fsm_rows()
+
+    (state, data), rows = run(tmp_path / "bot.db", scenario)
+    assert state == "GameStates:waiting_bet"
+    assert data == {"game": "dice_over", "комментарий": "ставка"}
+    # Пустая запись удаляется сразу
+    assert rows == []
+
+
+def test_state_expires_after_ttl(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(ttl=1)
+        await storage.set_state(KEY, "GameStates:waiting_bet")
+        time.sleep(1.1)
+        cached = await storage.get_state(KEY)
+        fresh = await SQLiteStorage().get_state(KEY)
+        purged = await db.fsm_purge(int(time.time()))
+        return cached, fresh, purged
+
+    assert run(tmp_path / "bot.db", scenario) == (None, None, 1)
+
+
+def test_cache_never_outlives_database_row(tmp_path):
+    async def scenario():
+        # Строка, записанная раньше (другим процессом): до истечения ей осталась секунда
+        storage = SQLiteStorage(ttl=3600)
+        await db.fsm_set_state(storage.key_builder.build(KEY), "GameStates:waiting_bet", int(time.time()) + 1)
+        loaded = await storage.get_state(KEY)
+        time.sleep(1.1)
+        await db.fsm_purge(int(time.time()))
+        return loaded, await storage.get_state(KEY), await fsm_rows()
+
+    loaded, after_purge, rows = run(tmp_path / "bot.db", scenario)
+    assert loaded == "GameStates:waiting_bet"
+    assert after_purge is None and rows == []
+
@@ -0,0 +1,96 @@
+# test_games.py
+"""Реестр игр против прежнего if/else из process_bet: исход, текст и коэффициент на каждое значение."""
+import itertools
+
+import pytest
+
+from games import DICE_SIDES, GAMES
+
+# Коэффициенты до реестра; дуэль брала COEF.get('dice_over_under', 1.7)
+LEGACY_COEF = {
+    'dice_over': 1.7, 'dice_under': 1.7, 'dice_even': 1.7, 'dice_odd': 1.7,
+    'football_goal': 1.2, 'football_miss': 1.7, 'basketball_goal': 1.2, 'basketball_miss': 1.7,
+    'duel_over': 1.7, 'duel_under': 1.7,
+}
+LEGACY_EMOJI = {'dice': "🎲", 'duel': "🎲", 'football': "⚽", 'basketball': "🏀"}
+
+
+def legacy_outcome(game: str, *values) -> tuple[bool, str]:
+    """Расчёт исхода в том виде, в каком он был в process_bet до games.py."""
+    if game.startswith('duel_'):
+        user_value, bot_value = values
+        if game == 'duel_over':
+            win = user_value > bot_value
+        else:
+            win = user_value < bot_value
+        result_text = f"Ваш кубик: {user_value}, кубик бота: {bot_value}"
+        if user_value == bot_value:
+            win = False
+            result_text += " — ничья, вы проиграли."
+        else:
+            result_text += f" — {'вы победили' if win else 'вы проиграли'}."
+        return win, result_text
+    (dice_value,) = values
+    if game == 'dice_over':
+        win = dice_value > 3.5
+        return win, f"Выпало {dice_value} {'(больше 3.5)' if win else '(меньше или равно 3.5)'}"
+    if game == 'dice_under':
+        win = dice_value < 3.5
+        return win, f"Выпало {dice_value} {'(меньше 3.5)' if win else '(больше или равно 3.5)'}"
+    if game == 'dice_even':
+        win = dice_value % 2 == 0
+        return win, f"Выпало {dice_value} {'(четное)' if win else '(нечетное)'}"
+    if game == 'dice_odd':
+        win = dice_value % 2 != 0
+        return win, f"Выпало {dice_value} {'(нечетное)' if win else '(четное)'}"
+    if game.startswith('football_'):
+        is_goal = dice_value in (3, 4, 5)
+        win = is_goal if game == 'football_goal' else not is_goal
+        return win, f"{'ГОЛ' if is_goal else 'ПРОМАХ'} (выпало {dice_value})"
+    is_goal = dice_value in (4, 5)
+    win = is_goal if game == 'basketball_goal' else not is_goal
+    return win, f"{'ПОПАДАНИЕ' if is_goal else 'ПРОМАХ'} (выпало {dice_value})"
+
+
+CASES = [
+    (key, combo)
+    for key in LEGACY_COEF
+    for combo in itertools.product(
+        range(1, DICE_SIDES[LEGACY_EMOJI[key.split('_')[0]]] + 1), repeat=2 if key.startswith('duel_') else 1
+    )
+]
+
+
+def test_registry_matches_legacy_games():
+    assert set(GAMES) == set(LEGACY_COEF)
+    for key, game in GAMES.items():
+        assert game.coef == LEGACY_COEF[key]
+        assert game.emoji == LEGACY_EMOJI[key.split('_')[0]]
+        assert game.dice == (2 if key.startswith('duel_') else 1)
+        assert set(game.results) == {combo for case, combo in CASES if case == key}
+
+
+@pytest.mark.parametrize("key, combo", CASES)
+def test_outcome_matches_legacy(key, combo):
+    assert GAMES[key].results[combo] == legacy_outcome(key, *combo)
+
+
+@pytest.mark.parametrize("key, wins", [
+    ('dice_over', {4, 5, 6}),
+    ('dice_under', {1, 2, 3}),
+    ('dice_even', {2, 4, 6}),
+    ('dice_odd', {1, 3, 5}),
+    ('football_goal', {3, 4, 5}),
+    ('football_miss', {1, 2}),
+    ('basketball_goal', {4, 5}),
+    ('basketball_miss', {1, 2, 3}),
+])
+def test_winning_values(key, wins):
+    assert {combo[0] for combo, (win, _) in GAMES[key].results.items() if win} == wins
+
+
+def test_duel_draw_loses():
+    for key in ('duel_over', 'duel_under'):
+        for value in range(1, 7):
+            win, text = GAMES[key].results[(value, value)]
+            assert not win and text.endswith("ничья, вы проиграли.")
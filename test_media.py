@@ -0,0 +1,68 @@
+# test_media.py
+"""CachedPhoto: повторная загрузка только когда Telegram отверг сам file_id."""
+import pytest
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendPhoto
+
+import db
+from media import CachedPhoto
+from test_db import run
+
+
+class Photo:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class Message:
+    def __init__(self, file_id):
+        self.photo = [Photo(file_id)]
+
+
+class FakeBot:
+    """send_photo по file_id падает с error, загрузка по URL выдаёт новый file_id."""
+
+    def __init__(self, error: str):
+        self.error = error
+        self.sent = []
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        self.sent.append(photo)
+        if photo == "old-id":
+            raise TelegramBadRequest(SendPhoto(chat_id=chat_id, photo=photo), self.error)
+        return Message("new-id")
+
+
+@pytest.mark.parametrize("error", [
+    "Bad Request: wrong file identifier/HTTP URL specified",
+    "Bad Request: wrong remote file identifier specified: Wrong string length",
+    "Bad Request: FILE_REFERENCE_EXPIRED",
+    "Bad Request: type of file mismatch",
+])
+def test_rejected_file_id_is_uploaded_again(tmp_path, error):
+    async def scenario():
+        await db.set_setting("file_id:win", "old-id")
+        bot = FakeBot(error)
+        await CachedPhoto("win", url="https://example.com/win.png").send(bot, 1, caption="🎉")
+        return bot.sent, await db.get_setting("file_id:win")
+
+    sent, stored = run(tmp_path / "bot.db", scenario)
+    assert sent == ["old-id", "https://example.com/win.png"]
+    assert stored == "new-id"
+
+
+@pytest.mark.parametrize("error", [
+    "Bad Request: chat not found",
+    "Bad Request: message caption is too long",
+    # Слово "file" в тексте ещё не значит, что виноват file_id
+    "Bad Request: file is too big",
+])
+def test_other_errors_keep_file_id(tmp_path, error):
+    async def scenario():
+        await db.set_setting("file_id:win", "old-id")
+        bot = FakeBot(error)
+        with pytest.raises(TelegramBadRequest):
+            await CachedPhoto("win", url="https://example.com/win.png").send(bot, 1, caption="🎉")
+        return bot.sent, await db.get_setting("file_id:win")
+
+    assert run(tmp_path / "bot.db", scenario) == (["old-id"], "old-id")
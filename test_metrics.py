@@ -0,0 +1,25 @@
+# test_metrics.py
+"""Сервер /metrics: занятый порт не мешает запуску бота."""
+import asyncio
+import socket
+
+import pytest
+
+import config
+import main
+import metrics
+
+
+def test_busy_port_does_not_stop_startup(monkeypatch):
+    monkeypatch.setattr(config, "METRICS_ENABLED", True)
+
+    async def scenario():
+        with socket.socket() as busy:
+            busy.bind((config.METRICS_HOST, 0))
+            busy.listen()
+            port = busy.getsockname()[1]
+            with pytest.raises(OSError):
+                await metrics.start_server(config.METRICS_HOST, port)
+            return await main.start_metrics_server(port)
+
+    assert asyncio.run(scenario()) is None
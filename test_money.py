@@ -0,0 +1,35 @@
+# test_money.py
+"""Разбор и вывод денежных сумм в микро-USDT."""
+import pytest
+
+import money
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("12.5", 12_500_000),
+    ("0,000001", 1),
+    (" 3 ", 3_000_000),
+    (12.5, 12_500_000),
+    ("1e2", 100_000_000),
+    ("999999999999.999999", 999_999_999_999_999_999),
+    ("1e-6", 1),
+    ("0", 0),
+])
+def test_parse(value, expected):
+    assert money.parse(value) == expected
+
+
+@pytest.mark.parametrize("value", [
+    "", "abc", "nan", "inf", "-Infinity", "0.0000001", "1e-999999",
+    # Переполнение Decimal и гигантские целые — ValueError, а не decimal.Overflow
+    "1e999999", "9e999999999", "1e12", "1" * 5000,
+])
+def test_parse_rejects(value):
+    with pytest.raises(ValueError):
+        money.parse(value)
+
+
+def test_fmt():
+    assert money.fmt(12_500_000) == "12.50"
+    assert money.fmt(1) == "0.000001"
+    assert money.fmt(money.multiply(money.parse(1), 1.7)) == "1.70"
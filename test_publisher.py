@@ -0,0 +1,117 @@
+# test_publisher.py
+"""Очередь канала: порядок анонс -> бросок -> результат, дуэль целиком и таймаут броска."""
+import asyncio
+
+import pytest
+
+import config
+from publisher import PRIORITY_RESULT, ChannelPublisher
+
+
+class FakeBot:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(self.delay)
+        self.sent.append(text)
+
+
+def channel(bot, maxsize: int = 100, rate: float = 6000) -> ChannelPublisher:
+    publisher = ChannelPublisher(bot, chat_id=1, rate=rate, maxsize=maxsize)
+    publisher.start()
+    return publisher
+
+
+def test_bet_announcement_precedes_its_dice_and_result(monkeypatch):
+    monkeypatch.setattr(config, "CHANNEL_DIGEST_THRESHOLD", 0)
+
+    async def scenario():
+        bot = FakeBot(delay=0.01)
+        publisher = channel(bot)
+
+        async def dice(name):
+            bot.sent.append(f"dice {name}")
+            return name
+
+        async def bet(name):
+            publisher.announce(f"bet {name}")
+            await publisher.call_many([(dice, (name,))] * 2)
+            publisher.publish(bot.send_message, 1, f"result {name}", priority=PRIORITY_RESULT)
+
+        # Пока идут ставки, в очереди уже ждут результаты прошлых
+        for name in "abc":
+            publisher.publish(bot.send_message, 1, f"old result {name}", priority=PRIORITY_RESULT)
+        await asyncio.gather(*(bet(name) for name in "xyz"))
+        await publisher.stop()
+        return bot.sent
+
+    sent = run(scenario)
+    for name in "xyz":
+        order = [sent.index(f"bet {name}"), sent.index(f"dice {name}"), sent.index(f"result {name}")]
+        assert order == sorted(order)
+        assert sent.count(f"dice {name}") == 2
+
+
+def test_digest_keeps_announcements_before_dice(monkeypatch):
+    monkeypatch.setattr(config, "CHANNEL_DIGEST_THRESHOLD", 2)
+
+    async def scenario():
+        bot = FakeBot()
+        publisher = channel(bot)
+
+        async def dice(name):
+            bot.sent.append(f"dice {name}")
+
+        # Очередь наполняется до старта отправителя
+        publisher._task.cancel()
+        publisher._task = None
+        publisher.announce("bet a")
+        publisher.announce("bet b")
+        rolls = asyncio.ensure_future(publisher.call_many([(dice, ("a",)), (dice, ("b",))]))
+        await asyncio.sleep(0)
+        publisher.announce("bet c")
+        publisher.start()
+        await rolls
+        await publisher.stop()
+        return bot.sent, publisher.digests
+
+    sent, digests = run(scenario)
+    assert digests == 1
+    assert "bet a" in sent[0] and "bet b" in sent[0]
+    assert sent[1:] == ["dice a", "dice b", "bet c"]
+
+
+def test_call_many_queues_all_or_nothing():
+    async def scenario():
+        bot = FakeBot()
+        publisher = ChannelPublisher(bot, chat_id=1, rate=6000, maxsize=3)
+        publisher.announce("bet a")
+        publisher.announce("bet b")
+        with pytest.raises(asyncio.QueueFull):
+            await publisher.call_many([(bot.send_message, (1, "dice"))] * 2)
+        return publisher.depth, publisher.dropped
+
+    # Второй кубик не влез бы — первый тоже не встаёт в очередь
+    assert run(scenario) == (2, 2)
+
+
+def test_call_many_timeout_drops_unsent_calls():
+    async def scenario():
+        bot = FakeBot()
+        # Три поста в секунду: второй кубик ждёт темпа дольше таймаута
+        publisher = channel(bot, rate=180)
+        publisher.bucket.tokens = 1
+        with pytest.raises(TimeoutError):
+            await publisher.call_many([(bot.send_message, (1, "dice"))] * 2, timeout=0.1)
+        # Отправитель дождался токена уже после таймаута — снятый кубик не уходит
+        await asyncio.sleep(0.5)
+        await publisher.stop()
+        return bot.sent, publisher.published
+
+    assert run(scenario) == (["dice"], 1)
+
+
+def run(scenario):
+    return asyncio.run(scenario())
@@ -0,0 +1,125 @@
+# test_throttling.py
+"""Антифлуд: очередь пользователя, её предел, token bucket по классам и классификация кнопок."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram import types
+
+import config
+import main
+from throttling import UserThrottleMiddleware
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(config, "THROTTLE_RATES", {'bets': (1, 3), 'fast': (1000, 1000), 'refill': (20, 1)})
+    monkeypatch.setattr(config, "THROTTLE_QUEUE_SIZE", 3)
+
+
+def data(user_id: int, action: str = 'fast') -> dict:
+    return {"event_from_user": SimpleNamespace(id=user_id), "action": action}
+
+
+async def by_action(event, data):
+    return data["action"]
+
+
+def test_same_user_runs_one_update_at_a_time():
+    async def scenario():
+        throttle = UserThrottleMiddleware(by_action)
+        running = {}
+        overlaps = []
+
+        async def handler(event, data):
+            user_id = data["event_from_user"].id
+            running[user_id] = running.get(user_id, 0) + 1
+            overlaps.append(dict(running))
+            await asyncio.sleep(0.02)
+            running[user_id] -= 1
+            return event
+
+        results = await asyncio.gather(*(throttle(handler, n, data(n % 2)) for n in range(4)))
+        return results, overlaps, throttle.stats()
+
+    results, overlaps, stats = asyncio.run(scenario())
+    assert results == [0, 1, 2, 3]
+    # У каждого пользователя не больше одного апдейта в работе, но пользователи идут параллельно
+    assert max(counts.get(0, 0) for counts in overlaps) == 1
+    assert max(counts.get(1, 0) for counts in overlaps) == 1
+    assert any(counts.get(0) and counts.get(1) for counts in overlaps)
+    assert stats["queued"] == 2
+    # Замки и счётчики очереди не копятся после обработки
+    assert stats["active_users"] == 0 and stats["waiting"] == 0
+
+
+def test_queue_bound_drops_extra_updates():
+    async def scenario():
+        throttle = UserThrottleMiddleware(by_action)
+
+        async def handler(event, data):
+            await asyncio.sleep(0.02)
+            return event
+
+        results = await asyncio.gather(*(throttle(handler, n, data(1)) for n in range(5)))
+        return results, throttle.overflowed
+
+    results, overflowed = asyncio.run(scenario())
+    assert results == [0, 1, 2, None, None]
+    assert overflowed == 2
+
+
+def test_token_bucket_per_action_and_user():
+    async def scenario():
+        throttle = UserThrottleMiddleware(by_action)
+
+        async def handler(event, data):
+            return event
+
+        bets = [await throttle(handler, n, data(1, 'bets')) for n in range(5)]
+        # Другой класс и другой пользователь — свои вёдра
+        other_action = await throttle(handler, "fast", data(1, 'fast'))
+        other_user = await throttle(handler, "bet", data(2, 'bets'))
+        # Неклассифицированные апдейты идут без лимита
+        unlimited = [await throttle(handler, n, data(1, None)) for n in range(5)]
+        return bets, other_action, other_user, unlimited, throttle.stats()
+
+    bets, other_action, other_user, unlimited, stats = asyncio.run(scenario())
+    assert bets == [0, 1, 2, None, None]
+    assert other_action == "fast" and other_user == "bet"
+    assert unlimited == [0, 1, 2, 3, 4]
+    assert stats["limited"] == {'bets': 2}
+    assert stats["passed"] == {'bets': 4, 'fast': 1}
+
+
+def test_token_bucket_refills():
+    async def scenario():
+        throttle = UserThrottleMiddleware(by_action)
+
+        async def handler(event, data):
+            return event
+
+        first = await throttle(handler, 1, data(1, 'refill'))
+        second = await throttle(handler, 2, data(1, 'refill'))
+        await asyncio.sleep(0.06)
+        third = await throttle(handler, 3, data(1, 'refill'))
+        return first, second, third
+
+    assert asyncio.run(scenario()) == (1, None, 3)
+
+
+@pytest.mark.parametrize("callback_data, action", [
+    ("deposit", 'other'),
+    ("deposit_usdt", 'other'),
+    ("deposit_custom", 'other'),
+    ("deposit_stars", 'other'),
+    ("withdraw", 'other'),
+    ("play_menu", 'other'),
+    ("deposit_10", 'payments'),
+    ("check_invoice_12345", 'payments'),
+    ("autobet", 'bets'),
+])
+def test_classify_callbacks(callback_data, action):
+    user = types.User(id=1, is_bot=False, first_name="Игрок")
+    callback = types.CallbackQuery(id="1", from_user=user, chat_instance="1", data=callback_data)
+    assert asyncio.run(main.classify_action(callback, {})) == action
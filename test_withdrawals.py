@@ -0,0 +1,150 @@
+# test_withdrawals.py
+"""Заявки на вывод: pending -> processing -> done | refunded | review, восстановление и /resolve."""
+import asyncio
+
+import pytest
+from aiocryptopay.exceptions.factory import CodeErrorFactory
+
+import db
+import main
+import money
+from cryptobot import CircuitOpen
+from test_db import run
+
+USER = 20
+
+
+async def funded(amount: str = "10"):
+    await db.get_user(USER)
+    await db.update_balance(USER, money.parse(amount), "admin")
+
+
+async def state(withdrawal_id: int):
+    status, error = await db._run(
+        db._fetchone, "SELECT status, error FROM withdrawals WHERE withdrawal_id = ?", (withdrawal_id,)
+    )
+    stored, expected = await db.verify_balance(USER)
+    assert stored == expected
+    return status, error, stored
+
+
+class Check:
+    check_id = 77
+    bot_check_url = "https://t.me/CryptoBot?start=CQ77"
+
+
+class FakeCrypto:
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.calls = 0
+
+    async def create_check(self, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return Check()
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    """main.process_withdrawal с подменённым CryptoBot и без сообщений пользователю."""
+    sent = []
+
+    async def notify(user_id, text, check_url=None):
+        sent.append(text)
+
+    monkeypatch.setattr(main, "notify_withdrawal", notify)
+
+    def process(error: Exception = None):
+        crypto = FakeCrypto(error)
+        monkeypatch.setattr(main, "crypto", crypto)
+
+        async def scenario():
+            await funded()
+            withdrawal_id = await db.reserve_withdrawal(USER, money.parse(4))
+            claimed = await db.claim_withdrawals(10)
+            done = await main.process_withdrawal(*claimed[0][:3])
+            return done, await state(withdrawal_id), crypto.calls
+        return scenario
+    return process
+
+
+def test_reserve_debits_and_claim_moves_to_processing(tmp_path):
+    async def scenario():
+        await funded()
+        first = await db.reserve_withdrawal(USER, money.parse(4))
+        second = await db.reserve_withdrawal(USER, money.parse(4))
+        overdraw = await db.reserve_withdrawal(USER, money.parse(4))
+        claimed = await db.claim_withdrawals(1)
+        return first, second, overdraw, claimed, await db.count_withdrawals(), await state(first)
+
+    first, second, overdraw, claimed, counts, (status, _, balance) = run(tmp_path / "bot.db", scenario)
+    assert overdraw is None
+    assert [row[:4] for row in claimed] == [(first, USER, 4_000_000, 'processing')]
+    assert counts == {'pending': 1, 'processing': 1}
+    assert status == 'processing' and balance == 2_000_000
+
+
+def test_check_created(tmp_path, worker):
+    done, (status, _, balance), calls = run(tmp_path / "bot.db", worker())
+    assert done is True and calls == 1
+    assert status == 'done' and balance == 6_000_000
+
+
+def test_rejected_check_is_refunded(tmp_path, worker):
+    error = CodeErrorFactory.exception_to_raise(400, "NOT_ENOUGH_COINS")
+    done, (status, _, balance), _ = run(tmp_path / "bot.db", worker(error))
+    assert done is True
+    assert status == 'refunded' and balance == 10_000_000
+
+
+@pytest.mark.parametrize("error", [
+    asyncio.TimeoutError(),
+    CodeErrorFactory.exception_to_raise(500, "INTERNAL_ERROR"),
+    ValueError("неожиданный ответ"),
+])
+def test_ambiguous_error_goes_to_review_without_refund(tmp_path, worker, error):
+    done, (status, _, balance), _ = run(tmp_path / "bot.db", worker(error))
+    # Чек мог создаться: деньги остаются списанными до решения администратора
+    assert done is True
+    assert status == 'review' and balance == 6_000_000
+
+
+def test_open_breaker_returns_withdrawal_to_queue(tmp_path, worker):
+    done, (status, _, balance), _ = run(tmp_path / "bot.db", worker(CircuitOpen(30)))
+    assert done is False
+    assert status == 'pending' and balance == 6_000_000
+
+
+def test_processing_recovered_into_review(tmp_path):
+    async def scenario():
+        await funded()
+        interrupted = await db.reserve_withdrawal(USER, money.parse(4))
+        waiting = await db.reserve_withdrawal(USER, money.parse(1))
+        await db.claim_withdrawals(1)
+        recovered = await db.recover_withdrawals()
+        return recovered, await state(interrupted), await state(waiting)
+
+    recovered, interrupted, waiting = run(tmp_path / "bot.db", scenario)
+    assert recovered == 1
+    assert interrupted == ('review', 'прервано во время создания чека', 5_000_000)
+    assert waiting[0] == 'pending'
+
+
+def test_resolve_refund_and_done(tmp_path):
+    async def scenario():
+        await funded()
+        refunded = await db.reserve_withdrawal(USER, money.parse(4))
+        paid = await db.reserve_withdrawal(USER, money.parse(1))
+        await db.claim_withdrawals(10)
+        await db.recover_withdrawals()
+        refund = await db.set_withdrawal_status(refunded, ('review',), 'refunded', error="решено администратором")
+        # Повторный /resolve по той же заявке ничего не меняет
+        again = await db.set_withdrawal_status(refunded, ('review',), 'refunded')
+        done = await db.set_withdrawal_status(paid, ('review',), 'done')
+        return refund, again, done, await state(refunded), await state(paid)
+
+    refund, again, done, refunded, paid = run(tmp_path / "bot.db", scenario)
+    assert refund == (USER, 4_000_000) and again is None and done == (USER, 1_000_000)
+    assert refunded == ('refunded', 'решено администратором', 9_000_000)
+    assert paid[0] == 'done'
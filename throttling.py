@@ -0,0 +1,87 @@
+# throttling.py
+import asyncio
+from collections import Counter
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+import config
+from ratelimit import KeyedTokenBuckets
+
+
+class UserThrottleMiddleware(BaseMiddleware):
+    """Антифлуд: апдейты одного пользователя обрабатываются по очереди и с лимитом.
+
+    Вешается как outer-middleware на message и callback_query, поэтому
+    оборачивает хендлеры вместе с их фильтрами и @subscription_required, не
+    меняя их. classify(event, data) возвращает класс действия (ключ
+    config.THROTTLE_RATES) или None — такие апдейты проходят без ограничений.
+    Сверх лимита класса и сверх THROTTLE_QUEUE_SIZE ожидающих апдейтов
+    пользователя апдейт отбрасывается. В режиме вебхука апдейты пользователя
+    всегда попадают в один воркер, так что очереди в памяти процесса достаточно.
+    """
+
+    def __init__(self, classify):
+        self.classify = classify
+        self.buckets = {
+            action: KeyedTokenBuckets(rate, burst) for action, (rate, burst) in config.THROTTLE_RATES.items()
+        }
+        self.warnings = KeyedTokenBuckets(1 / config.THROTTLE_WARN_INTERVAL, 1)
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._depth: dict[int, int] = {}
+        self.passed = Counter()
+        self.limited = Counter()
+        self.overflowed = 0
+        self.queued = 0
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        action = await self.classify(event, data) if user else None
+        if action is None:
+            return await handler(event, data)
+        user_id = user.id
+        if not self.buckets[action].try_acquire(user_id):
+            self.limited[action] += 1
+            await self._reject(event, user_id)
+            return None
+        depth = self._depth.get(user_id, 0)
+        if depth >= config.THROTTLE_QUEUE_SIZE:
+            self.overflowed += 1
+            await self._reject(event, user_id)
+            return None
+        if depth:
+            self.queued += 1
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        self._depth[user_id] = depth + 1
+        try:
+            async with lock:
+                self.passed[action] += 1
+                return await handler(event, data)
+        finally:
+            self._depth[user_id] -= 1
+            if not self._depth[user_id]:
+                del self._depth[user_id]
+                del self._locks[user_id]
+
+    async def _reject(self, event, user_id: int):
+        # Кнопке нужен ответ, иначе у пользователя висят «часики»; в чат пишем изредка
+        text = "⏳ Слишком много запросов, подождите немного."
+        try:
+            if isinstance(event, CallbackQuery):
+                await event.answer(text)
+            elif isinstance(event, Message) and self.warnings.try_acquire(user_id):
+                await event.answer(text)
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "active_users": len(self._depth),
+            "waiting": sum(depth - 1 for depth in self._depth.values()),
+            "passed": dict(self.passed),
+            "limited": dict(self.limited),
+            "overflowed": self.overflowed,
+            "queued": self.queued,
+        }